@@ -4,8 +4,11 @@ LP Optimization problem (OR_l), derived from Theorem 2 of the paper.
 """
 
 import os
+import math
+import time
 import logging
 from typing import List
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import cvxpy as cp
 
@@ -15,9 +18,16 @@ from generic import (
     FlowLinkSendHolder,
     CollectiveGroupContainer,
     FlowCGHolder,
+    ProblemIndex,
 )
-from utils import save_alloc_solutions
-from opt_utils import get_group_flows, compute_average_completion_time
+from utils import save_alloc_solutions, save_results
+from opt_utils import (
+    get_group_flows,
+    compute_average_completion_time,
+    create_problem_index,
+)
+from tracing import trace
+from memory_utils import check_memory_budget
 
 
 def get_link_groups(
@@ -47,6 +57,7 @@ def optimize_flow_rates(
     cg_container: CollectiveGroupContainer,
     fcg_holder: FlowCGHolder,
     opt_parameters: dict,
+    problem_index: ProblemIndex = None,
 ):
     """
     Optimizing the flow rates of groups to minimize the average completion time of collective.
@@ -57,6 +68,11 @@ def optimize_flow_rates(
     save_path = os.path.join(opt_parameters["model_path"], "AllocationOptimization")
     os.makedirs(save_path, exist_ok=True)
 
+    if problem_index is None:
+        problem_index = create_problem_index(
+            flow_container, link_container, fl_s_holder, cg_container, fcg_holder
+        )
+
     # Get the basic numbers
     K = cg_container.K
     Nks = cg_container.Nks
@@ -77,17 +93,15 @@ def optimize_flow_rates(
     # In the first step, we need to compute the initial flow rates of groups
     # Step 1. Compute the initial flow rates of groups
     logging.info("-----> Step1. Computing initial flow rates:")
-    flow_datas = np.array([flow.data_volume for flow in flow_container.item_objs])
+    flow_datas = problem_index.flow_datas
+    group_datas = problem_index.group_datas
     op_big_R = list()
     # We visit each group
     for k in range(K):
         big_R_k = list()
         for n in range(Nks[k]):
-            group_flows = get_group_flows(k, n, fcg_holder.matrix, cg_container)
-
-            group_flow_datas = flow_datas[group_flows]
             group_tau = big_tau[k][n]
-            big_R_k.append(sum(group_flow_datas) / group_tau)
+            big_R_k.append(group_datas[problem_index.group_index(k, n)] / group_tau)
 
         op_big_R.append(big_R_k)
 
@@ -95,7 +109,7 @@ def optimize_flow_rates(
     adjusted_big_R = op_big_R.copy()
     for e in range(E):
         # all groups that pass the link
-        link_groups = get_link_groups(e, fl_s_holder, fcg_holder, cg_container, K, Nks)
+        link_groups = problem_index.link_kn_groups(e)
         # We ensure that they do not exceed the link capacity, based on
         # the Eq. 15 of the paper.
         lg_rates = np.array([op_big_R[k][n] for k, n in link_groups])
@@ -129,19 +143,23 @@ def optimize_flow_rates(
     n_cols = extened_rates.shape[1]
 
     cases = [extened_rates[:, i].tolist() for i in range(n_cols)]
+    # The grid holds each combination of the cases, once per column and once
+    # more transposed, which grows exponentially with the groups
+    check_memory_budget(
+        "or.grid_search", 2 * math.prod(len(case) for case in cases) * n_cols * 8
+    )
     available_cases = np.array(np.meshgrid(*cases)).T.reshape(-1, n_cols)
 
     # Step 4. Based on Eq. 21 and Eq. 22, we filter out those that exceed the link capacity
     logging.info("-----> Step 4. Extracting the feasible ones and computing:")
+    links_groups = [problem_index.link_kn_groups(e) for e in range(E)]
     solutions = list()
     for case_i in available_cases:
         big_kn_R = np.array_split(case_i, Nks[:-1])
 
         is_valid = True
         for e in range(E):
-            link_groups = get_link_groups(
-                e, fl_s_holder, fcg_holder, cg_container, K, Nks
-            )
+            link_groups = links_groups[e]
             # We ensure that they do not exceed the link capacity, based on
             # the Eq. 15 of the paper.
             lg_rates = np.array([big_kn_R[k][n] for k, n in link_groups])
@@ -151,7 +169,7 @@ def optimize_flow_rates(
                 break
         if is_valid:
             sol_time = compute_average_completion_time(
-                big_kn_R, fcg_holder, cg_container, flow_datas, K, Nks
+                big_kn_R, fcg_holder, cg_container, flow_datas, K, Nks, problem_index
             )
             solutions.append((big_kn_R, sol_time))
 
@@ -184,16 +202,30 @@ def optimize_lp_flow_rates(
     cg_container: CollectiveGroupContainer,
     fcg_holder: FlowCGHolder,
     opt_parameters: dict,
+    problem_index: ProblemIndex = None,
+    phase_times: dict = None,
 ):
     """
     Optimizing the flow rates of groups to minimize the average completion time of collective based on the LP of the pulp.
 
     See (OR_l) in subsection 3-C of the paper.
+
+    :param phase_times: An optional dict, filled with the time (seconds) to
+     `build` and to `solve` the model.
+    :return optimal_solution: The optimized rates and their objective.
+    :return ablation_solution: The rates given by the big tau of the OP and
+     their objective, saved for the ablation study.
     """
+    build_start = time.time()
     # Set the save path
     save_path = os.path.join(opt_parameters["model_path"], "AllocationOptimization")
     os.makedirs(save_path, exist_ok=True)
 
+    if problem_index is None:
+        problem_index = create_problem_index(
+            flow_container, link_container, fl_s_holder, cg_container, fcg_holder
+        )
+
     # Get the basic numbers
     K = cg_container.K
     Nks = cg_container.Nks
@@ -213,88 +245,82 @@ def optimize_lp_flow_rates(
     # Note: Here we do not use the pulp to address the optimization problem, instead we implement the our own solver which reaches the same solution as that discussed in the (OR_l) in subsection3-C of the paper.
     # In the first step, we need to compute the initial flow rates of groups
     # Step 1. Compute the initial flow rates of groups
-    logging.info("-----> Step1. Computing initial flow rates:")
-    flow_datas = np.array([flow.data_volume for flow in flow_container.item_objs])
-    op_big_R = list()
-    # We visit each group
-    for k in range(K):
-        op_big_R_k = list()
-        for n in range(Nks[k]):
-            group_flows = get_group_flows(k, n, fcg_holder.matrix, cg_container)
-
-            group_flow_datas = flow_datas[group_flows]
-            group_tau = big_tau[k][n]
-            op_big_R_k.append(sum(group_flow_datas) / group_tau)
+    with trace("or.initial_rates"):
+        logging.info("-----> Step1. Computing initial flow rates:")
+        flow_datas = problem_index.flow_datas
+        group_datas = problem_index.group_datas
+        op_big_R = list()
+        # We visit each group
+        for k in range(K):
+            op_big_R_k = list()
+            for n in range(Nks[k]):
+                group_tau = big_tau[k][n]
+                op_big_R_k.append(
+                    group_datas[problem_index.group_index(k, n)] / group_tau
+                )
+
+            op_big_R.append(op_big_R_k)
+
+    with trace("or.variables"):
+        logging.info("-----> Step2. Building the LP for flow rates:")
+        small_lambda = opt_parameters["small_lambda"]
+        jump_range = opt_parameters["jump_range"]
+        total_lambda = float(small_lambda * jump_range)
+
+        # Define decision variables based on Eq 12 and 14 of the paper
+        group_offsets = problem_index.group_offsets
+        k_groups_data = [
+            group_datas[group_offsets[k] : group_offsets[k + 1]] for k in range(K)
+        ]
 
-        op_big_R.append(op_big_R_k)
+        r_variables = [cp.Variable(Nks[k], f"C-{k}") for k in range(K)]
+        r_lower = [np.array(op_big_R[k]) - total_lambda for k in range(K)]
+        r_upper = [np.array(op_big_R[k]) + total_lambda for k in range(K)]
 
-    logging.info("-----> Step2. Building the LP for flow rates:")
-    small_lambda = opt_parameters["small_lambda"]
-    jump_range = opt_parameters["jump_range"]
-    total_lambda = float(small_lambda * jump_range)
+        logging.info(
+            "-----> Defined vars (Theorem 2). R: #%s,",
+            sum(Nks),
+        )
 
-    # Define decision variables based on Eq 12 and 14 of the paper
-    k_groups_data = list()
-    for k in range(K):
-        k_groups_data.append(
-            np.array(
-                [
-                    sum(
-                        flow_datas[
-                            get_group_flows(k, n, fcg_holder.matrix, cg_container)
-                        ]
-                    )
-                    for n in range(Nks[k])
-                ]
+    with trace("or.objective"):
+        # Objective function, Eq. 12 of the paper
+        objective = cp.Minimize(
+            cp.sum(
+                [cp.max(cp.inv_pos(r_variables[k]) * k_groups_data[k]) for k in range(K)]
             )
+            * (1.0 / K)
         )
 
-    r_variables = [cp.Variable(Nks[k], f"C-{k}") for k in range(K)]
-    r_lower = [np.array(op_big_R[k]) - total_lambda for k in range(K)]
-    r_upper = [np.array(op_big_R[k]) + total_lambda for k in range(K)]
-
-    logging.info(
-        "-----> Defined vars (Theorem 2). R: #%s,",
-        sum(Nks),
-    )
-
-    # Objective function, Eq. 12 of the paper
-    objective = cp.Minimize(
-        cp.sum(
-            [cp.max(cp.inv_pos(r_variables[k]) * k_groups_data[k]) for k in range(K)]
+        logging.info(
+            "-----> Set Objective.",
         )
-        * (1.0 / K)
-    )
-
-    logging.info(
-        "-----> Set Objective.",
-    )
-    constraints = list()
-    # Add constraints, Eq 9 of the paper
-    # r_variables[k] <= np.ones_like(r_variables[k]),
-    # r_variables[k] >= np.zeros_like(r_variables[k])
-    for k in range(K):
-        constraints.append(r_variables[k] >= 0)
-        # constraints.append(r_variables[k] >= r_lower[k])
-        constraints.append(
-            r_variables[k] <= r_upper[k],
+    with trace("or.constraints"):
+        constraints = list()
+        # Add constraints, Eq 9 of the paper
+        # r_variables[k] <= np.ones_like(r_variables[k]),
+        # r_variables[k] >= np.zeros_like(r_variables[k])
+        for k in range(K):
+            constraints.append(r_variables[k] >= 0)
+            # constraints.append(r_variables[k] >= r_lower[k])
+            constraints.append(
+                r_variables[k] <= r_upper[k],
+            )
+        logging.info(
+            "-----> Defined the range constraints (Eq. 12/13): #%s",
+            N,
         )
-    logging.info(
-        "-----> Defined the range constraints (Eq. 12/13): #%s",
-        N,
-    )
 
-    for e in range(E):
-        # The groups that pass the link e
-        link_groups = get_link_groups(e, fl_s_holder, fcg_holder, cg_container, K, Nks)
-        total_occupy = cp.sum([r_variables[k][n] for k, n in link_groups])
-        link_capacity = link_container.item_obj(e).capacity
-        constraints.append(total_occupy <= link_capacity)
-
-    logging.info(
-        "-----> Defined the link capacity constrains: #%s",
-        E,
-    )
+        for e in range(E):
+            # The groups that pass the link e
+            link_groups = problem_index.link_kn_groups(e)
+            total_occupy = cp.sum([r_variables[k][n] for k, n in link_groups])
+            link_capacity = link_container.item_obj(e).capacity
+            constraints.append(total_occupy <= link_capacity)
+
+        logging.info(
+            "-----> Defined the link capacity constrains: #%s",
+            E,
+        )
 
     # Define LP problem based on Theorem 1 of the paper
     prob = cp.Problem(objective, constraints)
@@ -306,7 +332,12 @@ def optimize_lp_flow_rates(
     )
     # The problem data is written to an .lp file
     # prob.writeLP(os.path.join(save_path, "OptimizationModel.lp"))
-    prob.solve()
+    solve_start = time.time()
+    with trace("or.solve"):
+        prob.solve()
+    if phase_times is not None:
+        phase_times["build"] = solve_start - build_start
+        phase_times["solve"] = time.time() - solve_start
     # for k in range(K):
     #     print(f"r_variables[{k}] values: {r_variables[k].value}")
     # exit()
@@ -314,29 +345,200 @@ def optimize_lp_flow_rates(
         "%s Solved the LP Optimization (OR) with cvxpy",
         "*" * 15,
     )
-    optimized_big_R = list()
-    for k in range(K):
-        optimized_big_R.append(r_variables[k].value)
+    with trace("or.extract"):
+        optimized_big_R = list()
+        for k in range(K):
+            optimized_big_R.append(r_variables[k].value)
 
-    optimal_obj = compute_average_completion_time(
-        optimized_big_R, fcg_holder, cg_container, flow_datas, K, Nks
+        optimal_obj = compute_average_completion_time(
+            optimized_big_R, fcg_holder, cg_container, flow_datas, K, Nks, problem_index
+        )
+        optimal_solution = (optimized_big_R, optimal_obj)
+        save_alloc_solutions(
+            os.path.join(save_path, "optimized_flow_rates.json"),
+            [optimal_solution],
+        )
+        logging.info("-----> Optimal flows: %s.", optimal_solution[0])
+        logging.info("-----> Optimal objective: %s.", optimal_solution[1])
+
+        # As the ablation study, we also save the flow rates and obj of the OP
+        op_big_R_obj = compute_average_completion_time(
+            op_big_R, fcg_holder, cg_container, flow_datas, K, Nks, problem_index
+        )
+        ablation_solution = (op_big_R, op_big_R_obj)
+        save_alloc_solutions(
+            os.path.join(save_path, "ablation_flow_rates.json"),
+            [ablation_solution],
+        )
+
+    return optimal_solution, ablation_solution, None
+
+
+def _solve_lp_scenarios(
+    incidence: np.ndarray,
+    groups_data: np.ndarray,
+    r_upper: np.ndarray,
+    Nks: List[int],
+    capacity_scenarios: np.ndarray,
+):
+    """
+    Solving the (OR_l) for a chunk of capacity scenarios.
+
+    The problem is built once with the link capacities as a parameter so that
+    cvxpy only canonicalizes it for the first scenario.
+    """
+    K = len(Nks)
+    S, _ = capacity_scenarios.shape
+    offsets = np.concatenate(([0], np.cumsum(Nks)))
+
+    r_variables = cp.Variable(len(groups_data), "R")
+    capacities = cp.Parameter(incidence.shape[0], nonneg=True, name="capacities")
+
+    # Objective function, Eq. 12 of the paper, written as in `optimize_lp_flow_rates`
+    objective = cp.Minimize(
+        cp.sum(
+            [
+                cp.max(
+                    cp.inv_pos(r_variables[offsets[k] : offsets[k + 1]])
+                    @ groups_data[offsets[k] : offsets[k + 1]]
+                )
+                for k in range(K)
+            ]
+        )
+        * (1.0 / K)
     )
-    optimal_solution = (optimized_big_R, optimal_obj)
-    save_alloc_solutions(
-        os.path.join(save_path, "optimized_flow_rates.json"),
-        [optimal_solution],
+    constraints = [
+        r_variables >= 0,
+        r_variables <= r_upper,
+        incidence @ r_variables <= capacities,
+    ]
+    prob = cp.Problem(objective, constraints)
+
+    rates = np.full((S, len(groups_data)), np.nan)
+    for s in range(S):
+        capacities.value = capacity_scenarios[s]
+        try:
+            prob.solve()
+        except cp.error.SolverError as error:
+            logging.warning("-----> Scenario %s failed: %s.", s, error)
+            continue
+        if prob.status in (cp.OPTIMAL, cp.OPTIMAL_INACCURATE):
+            rates[s] = r_variables.value
+        else:
+            logging.warning("-----> Scenario %s solved with status: %s.", s, prob.status)
+    return rates
+
+
+def optimize_batch_lp_flow_rates(
+    flow_container: BaseContainer,
+    big_tau: List[List[int]],
+    link_container: BaseContainer,
+    fl_s_holder: FlowLinkSendHolder,
+    cg_container: CollectiveGroupContainer,
+    fcg_holder: FlowCGHolder,
+    capacity_scenarios: np.ndarray,
+    opt_parameters: dict,
+    problem_index: ProblemIndex = None,
+):
+    """
+    Optimizing the flow rates of groups under a batch of link capacity scenarios,
+    such as link failures or derated links, with the (OR_l) of `optimize_lp_flow_rates`.
+
+    :param capacity_scenarios: A matrix with shape [S, E], each row holding the
+     link capacities of one scenario.
+    :param opt_parameters: Besides the parameters of `optimize_lp_flow_rates`, it
+     can have:
+     - n_workers: the number of processes solving chunks of scenarios in parallel.
+
+    :return rates: A matrix with shape [S, N] holding the group flow rates of each
+     scenario, where groups are flattened in the collective order. Rows of the
+     scenarios that can not be solved are nan.
+    :return objectives: The average completion time of each scenario, with shape [S].
+    :return throughput: The number of scenarios solved per second.
+    """
+    # Set the save path
+    save_path = os.path.join(opt_parameters["model_path"], "AllocationOptimization")
+    os.makedirs(save_path, exist_ok=True)
+
+    if problem_index is None:
+        problem_index = create_problem_index(
+            flow_container, link_container, fl_s_holder, cg_container, fcg_holder
+        )
+
+    start_time = time.time()
+
+    # Get the basic numbers
+    K = cg_container.K
+    Nks = cg_container.Nks
+    N = cg_container.N
+    E = fl_s_holder.fl_holder.E
+
+    capacity_scenarios = np.atleast_2d(np.asarray(capacity_scenarios, dtype=float))
+    assert capacity_scenarios.shape[1] == E
+    S = capacity_scenarios.shape[0]
+
+    logging.info(
+        "%s %s %s", "*" * 15, "Optimizing Group Flow Rates in Batch", "*" * 15
     )
-    logging.info("-----> Optimal flows: %s.", optimal_solution[0])
-    logging.info("-----> Optimal objective: %s.", optimal_solution[1])
+    logging.info("-----> Scenarios: #%s, N: %s, E: %s", S, N, E)
 
-    # As the ablation study, we also save the flow rates and obj of the OP
-    op_big_R_obj = compute_average_completion_time(
-        op_big_R, fcg_holder, cg_container, flow_datas, K, Nks
+    # Step 1. Compute the data and the initial flow rates of groups
+    groups_data = problem_index.group_datas
+    op_big_R = groups_data / np.array(
+        [big_tau[k][n] for k in range(K) for n in range(Nks[k])], dtype=float
     )
-    ablation_solution = (op_big_R, op_big_R_obj)
-    save_alloc_solutions(
-        os.path.join(save_path, "ablation_flow_rates.json"),
-        [ablation_solution],
+    total_lambda = float(
+        opt_parameters["small_lambda"] * opt_parameters["jump_range"]
+    )
+    r_upper = op_big_R + total_lambda
+
+    # Step 2. Build the group-link incidence shared by all scenarios
+    offsets = problem_index.group_offsets
+    incidence = np.zeros((E, N))
+    for e in range(E):
+        incidence[e, problem_index.link_groups(e)] = 1
+
+    # Step 3. Solve the scenarios, in chunks when several workers are used
+    n_workers = max(1, min(int(opt_parameters.get("n_workers", 1)), S))
+    logging.info("%s Start solving #%s scenarios with cvxpy", "*" * 15, S)
+    if n_workers == 1:
+        rates = _solve_lp_scenarios(
+            incidence, groups_data, r_upper, Nks, capacity_scenarios
+        )
+    else:
+        chunks = np.array_split(capacity_scenarios, n_workers)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            rates = np.vstack(
+                list(
+                    executor.map(
+                        _solve_lp_scenarios,
+                        [incidence] * n_workers,
+                        [groups_data] * n_workers,
+                        [r_upper] * n_workers,
+                        [Nks] * n_workers,
+                        chunks,
+                    )
+                )
+            )
+
+    # Step 4. Compute the average completion time of each scenario
+    group_times = groups_data / rates
+    objectives = np.maximum.reduceat(group_times, offsets[:-1], axis=1).mean(axis=1)
+
+    solve_time = time.time() - start_time
+    throughput = S / solve_time
+    logging.info(
+        "%s Solved #%s scenarios in %.3fs (%.2f scenarios/s)",
+        "*" * 15,
+        S,
+        solve_time,
+        throughput,
+    )
+
+    save_results(
+        os.path.join(save_path, "batch_flow_rates.json"),
+        ["rates", "objectives", "scenarios_per_second"],
+        [rates.tolist(), objectives.tolist(), throughput],
     )
 
-    return optimal_solution, op_big_R, None
+    return rates, objectives, throughput
@@ -0,0 +1,585 @@
+"""
+An offline benchmark of the phases of the methods on the shipped configs.
+
+The phases of each config are run one after another in a child process, i.e.,
+parsing the config, building and solving the OP, the OR by cvxpy and by the
+grid search, the competitors, both flow-chunk models and computing the
+average completion time. Each phase sends its time back as soon as it is
+done, so that a phase exceeding the timeout only loses the phases after it.
+
+The results are saved as JSON, and two results can be compared to flag the
+phases that regress beyond a threshold:
+```bash
+$ python benchmark.py run -s benchmark-base.json
+$ python benchmark.py run -s benchmark-new.json
+$ python benchmark.py compare benchmark-base.json benchmark-new.json -t 0.2
+```
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import logging
+import platform
+import statistics
+import subprocess
+import tempfile
+import timeit
+import multiprocessing
+from typing import List
+
+import numpy as np
+
+from run_sweep import get_config_names
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+# The configs benchmarked by default
+DEFAULT_CONFIGS = [
+    "Abilene_RAR/Abilene_*-RAR.json",
+    "Abilene_random/*.json",
+    "Napnet_RAR/*.json",
+    "topo_exp/*.json",
+]
+
+# The phases of each benchmark, in the order they are run
+BENCHMARK_PHASES = {
+    "parse": ["parse"],
+    "op": ["op_build", "op_solve"],
+    "or_cvxpy": ["or_cvxpy_build", "or_cvxpy_solve"],
+    "or_grid": ["or_grid"],
+    "average_completion_time": ["average_completion_time"],
+    "competitors": ["averageAlloc", "barrierAwareAlloc", "dataAwareAlloc"],
+    "flow_chunk": ["flowChunk", "flowChunkNew"],
+}
+
+# The benchmarks of the methods run on the generated configs, without the
+# grid search of the OR, whose grid grows exponentially with the groups
+SMOKE_BENCHMARKS = [name for name in BENCHMARK_PHASES if name != "or_grid"]
+
+# The benchmarks whose outputs are required by the others
+BENCHMARK_DEPENDENCIES = {
+    "or_cvxpy": ["op"],
+    "or_grid": ["op"],
+    "average_completion_time": ["op", "or_cvxpy"],
+}
+
+
+def _run_phases(
+    config_folder_path: str,
+    config_name: str,
+    optconfig_name: str,
+    benchmarks: List[str],
+    results: multiprocessing.Queue,
+    verbose: bool,
+):
+    """
+    Run the phases of the benchmarks on one config in a child process, and
+    put the (phase, seconds) or (phase, error) of each phase to the results.
+    """
+    # pylint: disable=import-outside-toplevel
+    if not verbose:
+        # Silence the solvers, which write to the file descriptors directly
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        logging.disable(logging.CRITICAL)
+
+    from stellar import extract_information
+    from priority import optimize_completion_time
+    from allocation import optimize_lp_flow_rates, optimize_flow_rates
+    from opt_utils import compute_average_completion_time
+    from competitors import (
+        baseline_allocation,
+        barrier_aware_allocation,
+        data_aware_allocation,
+    )
+    from flow_chunk_competitor import flow_chunk_optimization
+    from optimized_flow_chunk_competitor import (
+        flow_chunk_optimization as new_flow_chunk_optimization,
+    )
+    from new_setting import get_flow_info, get_dependency_order, fid_to_order
+
+    def report(phase, function, *args, **kwargs):
+        """Run and time one phase, where a failed phase is reported with its error."""
+        start_time = time.perf_counter()
+        try:
+            output = function(*args, **kwargs)
+        except Exception as error:  # pylint: disable=broad-except
+            results.put((phase, {"error": repr(error)}))
+            return None
+        results.put((phase, time.perf_counter() - start_time))
+        return output
+
+    def report_call(phase, function, *args):
+        """Time one call of a fast phase, averaged over enough calls to be measurable."""
+        try:
+            timer = timeit.Timer(lambda: function(*args))
+            n_calls, seconds = timer.autorange()
+        except Exception as error:  # pylint: disable=broad-except
+            results.put((phase, {"error": repr(error)}))
+            return
+        results.put((phase, seconds / n_calls))
+
+    def report_phases(phases, function, *args, **kwargs):
+        """Run one phase split by the function into the given phases."""
+        phase_times = dict()
+        try:
+            output = function(*args, phase_times=phase_times, **kwargs)
+        except Exception as error:  # pylint: disable=broad-except
+            for phase in phases:
+                results.put((phase, {"error": repr(error)}))
+            return None
+        for phase in phases:
+            results.put((phase, phase_times[phase.rsplit("_", 1)[-1]]))
+        return output
+
+    with tempfile.TemporaryDirectory() as model_path:
+        with open(
+            os.path.join(config_folder_path, optconfig_name), "r", encoding="utf-8"
+        ) as f:
+            opt_parameters = json.load(f)
+        opt_parameters["model_path"] = model_path
+        opt_parameters["quiet"] = True
+
+        info = report("parse", extract_information, config_folder_path, config_name)
+        if info is None:
+            return
+        holders, problem_index = info[:5], info[5]
+        flow_container, link_container, fl_s_holder, cg_container, fcg_holder = holders
+
+        big_tau = big_R = None
+        if "op" in benchmarks:
+            op_output = report_phases(
+                BENCHMARK_PHASES["op"],
+                optimize_completion_time,
+                link_container,
+                fl_s_holder,
+                cg_container,
+                fcg_holder,
+                opt_parameters,
+                problem_index=problem_index,
+            )
+            big_tau = None if op_output is None else op_output[2]
+        if big_tau is not None and "or_cvxpy" in benchmarks:
+            or_output = report_phases(
+                BENCHMARK_PHASES["or_cvxpy"],
+                optimize_lp_flow_rates,
+                flow_container,
+                big_tau,
+                link_container,
+                fl_s_holder,
+                cg_container,
+                fcg_holder,
+                opt_parameters,
+                problem_index=problem_index,
+            )
+            big_R = None if or_output is None else or_output[0][0]
+        if big_tau is not None and "or_grid" in benchmarks:
+            report(
+                "or_grid",
+                optimize_flow_rates,
+                flow_container,
+                big_tau,
+                link_container,
+                fl_s_holder,
+                cg_container,
+                fcg_holder,
+                opt_parameters,
+                problem_index=problem_index,
+            )
+        if big_R is not None and "average_completion_time" in benchmarks:
+            report_call(
+                "average_completion_time",
+                compute_average_completion_time,
+                big_R,
+                fcg_holder,
+                cg_container,
+                problem_index.flow_datas,
+                cg_container.K,
+                cg_container.Nks,
+                problem_index,
+            )
+
+        if "competitors" in benchmarks:
+            report(
+                "averageAlloc",
+                baseline_allocation,
+                *holders,
+                opt_parameters,
+                problem_index=problem_index,
+            )
+            for phase, allocation in (
+                ("barrierAwareAlloc", barrier_aware_allocation),
+                ("dataAwareAlloc", data_aware_allocation),
+            ):
+                report(phase, allocation, *holders, opt_parameters, problem_index=problem_index)
+
+        if "flow_chunk" in benchmarks:
+            report(
+                "flowChunk",
+                flow_chunk_optimization,
+                *holders,
+                opt_parameters,
+                problem_index=problem_index,
+            )
+            with open(
+                os.path.join(config_folder_path, config_name), "r", encoding="utf-8"
+            ) as f:
+                info_data = json.load(f)
+
+            def run_new_flow_chunk():
+                flow_info = get_flow_info(info_data)
+                dependency_order = get_dependency_order(flow_info)
+                return new_flow_chunk_optimization(
+                    flow_info,
+                    info_data["link_capacities"],
+                    dependency_order,
+                    fid_to_order(dependency_order),
+                    {"quiet": True},
+                )
+
+            report("flowChunkNew", run_new_flow_chunk)
+
+
+def benchmark_config(
+    config_folder_path: str,
+    config_name: str,
+    optconfig_name: str,
+    benchmarks: List[str],
+    timeout: float,
+    verbose: bool = False,
+) -> dict:
+    """
+    Benchmark the phases on one config in a child process.
+
+    :param timeout: The seconds each phase can take, after which the child
+     is stopped and the remaining phases are reported as timed out.
+    :return phase_times: A dict holding the seconds, or the error, of each phase.
+    """
+    benchmarks = {"parse", *benchmarks}
+    for name in list(benchmarks):
+        benchmarks.update(BENCHMARK_DEPENDENCIES.get(name, []))
+    phases = [phase for name in BENCHMARK_PHASES if name in benchmarks for phase in BENCHMARK_PHASES[name]]
+    results = multiprocessing.Queue()
+    child = multiprocessing.Process(
+        target=_run_phases,
+        args=(config_folder_path, config_name, optconfig_name, benchmarks, results, verbose),
+    )
+    child.start()
+    phase_times = dict()
+    while len(phase_times) < len(phases):
+        try:
+            phase, seconds = results.get(timeout=timeout)
+        except queue.Empty:
+            if child.is_alive():
+                child.terminate()
+                for phase in phases:
+                    phase_times.setdefault(phase, {"error": f"timeout after {timeout}s"})
+            break
+        phase_times[phase] = seconds
+        if not child.is_alive() and results.empty():
+            break
+    child.join()
+    # The phases depending on a failed phase are not run
+    for phase in phases:
+        phase_times.setdefault(phase, {"error": "skipped"})
+    return phase_times
+
+
+def get_environment() -> dict:
+    """Get the environment of the benchmark, to tell the results apart."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmarks(
+    config_folder_path: str,
+    config_names: List[str],
+    benchmarks: List[str],
+    repeat: int = 1,
+    timeout: float = 600,
+    verbose: bool = False,
+) -> dict:
+    """
+    Benchmark the phases on the configs, each repeated `repeat` times.
+
+    :return results: A dict holding the environment, and the times of each
+     phase of each config with their median and minimum.
+    """
+    results = {"environment": get_environment(), "repeat": repeat, "configs": dict()}
+    for config_name in config_names:
+        optconfig_name = f"{os.path.splitext(config_name)[0]}_optimization.json"
+        if not os.path.exists(os.path.join(config_folder_path, optconfig_name)):
+            logging.warning("Skipping %s without %s", config_name, optconfig_name)
+            continue
+        runs = [
+            benchmark_config(
+                config_folder_path, config_name, optconfig_name, benchmarks, timeout, verbose
+            )
+            for _ in range(repeat)
+        ]
+        config_results = dict()
+        for phase in runs[0]:
+            times = [run[phase] for run in runs if not isinstance(run[phase], dict)]
+            if len(times) < len(runs):
+                config_results[phase] = next(run[phase] for run in runs if isinstance(run[phase], dict))
+                continue
+            config_results[phase] = {
+                "times": times,
+                "median": statistics.median(times),
+                "min": min(times),
+            }
+        results["configs"][config_name] = config_results
+        logging.info(
+            "%s %s: %s",
+            "*" * 15,
+            config_name,
+            ", ".join(
+                f"{phase} {result['median']:.4g}s" if "median" in result else f"{phase} {result['error']}"
+                for phase, result in config_results.items()
+            ),
+        )
+    return results
+
+
+def smoke_generated_configs(
+    save_folder: str, timeout: float = 120, verbose: bool = False
+) -> dict:
+    """
+    Run the phases of `SMOKE_BENCHMARKS` on one small config generated by
+    `workload_generator.py` for each topology and pattern, checking that no
+    flow parses to no data.
+
+    :return results: A dict holding the number of flows without data and the
+     seconds, or the error, of each phase of each generated config.
+    """
+    # pylint: disable=import-outside-toplevel
+    from stellar import extract_information
+    from workload_generator import (
+        DEFAULT_OPTIMIZATION,
+        create_topology,
+        generate_workload,
+        pattern_factory,
+        topology_factory,
+    )
+
+    os.makedirs(save_folder, exist_ok=True)
+    topology_args = argparse.Namespace(k=4, dims=[3, 3], nodes=20, degree=3.0)
+    results = dict()
+    for topology_name in topology_factory:
+        for pattern_name in pattern_factory:
+            config_name = f"{topology_name}_{pattern_name}.json"
+            rng = np.random.default_rng(0)
+            generate_workload(
+                os.path.join(save_folder, config_name),
+                create_topology(topology_name, topology_args, rng),
+                pattern_name,
+                n_collectives=2,
+                n_participants=4,
+                n_chunks=2,
+                rng=rng,
+                chain=4,
+            )
+            optconfig_name = f"{os.path.splitext(config_name)[0]}_optimization.json"
+            with open(os.path.join(save_folder, optconfig_name), "w", encoding="utf-8") as f:
+                json.dump(DEFAULT_OPTIMIZATION, f, indent=4)
+
+            flow_container = extract_information(save_folder, config_name)[0]
+            config_results = {
+                "zero_data_flows": sum(
+                    flow.data_volume == 0 for flow in flow_container.item_objs
+                )
+            }
+            config_results.update(
+                benchmark_config(
+                    save_folder,
+                    config_name,
+                    optconfig_name,
+                    SMOKE_BENCHMARKS,
+                    timeout,
+                    verbose,
+                )
+            )
+            results[config_name] = config_results
+            failed = [
+                phase for phase, result in config_results.items() if isinstance(result, dict)
+            ]
+            logging.info(
+                "%s %s: %d flows without data, %s",
+                "*" * 15,
+                config_name,
+                config_results["zero_data_flows"],
+                f"failed {failed}" if failed else "all phases passed",
+            )
+    return results
+
+
+def compare_benchmarks(base: dict, new: dict, threshold: float, min_seconds: float) -> List[tuple]:
+    """
+    Compare the median times of the phases of two benchmarks.
+
+    A phase regresses when its median grows by more than the threshold, e.g.
+    0.2 for 20%, and by more than `min_seconds`, which ignores the noise of
+    the fast phases.
+
+    :return rows: A list of (config, phase, base median, new median, ratio,
+     regressed), one per phase timed in both benchmarks.
+    """
+    rows = list()
+    for config_name, base_phases in base["configs"].items():
+        new_phases = new["configs"].get(config_name, dict())
+        for phase, base_result in base_phases.items():
+            new_result = new_phases.get(phase)
+            if new_result is None or "median" not in base_result or "median" not in new_result:
+                continue
+            base_median, new_median = base_result["median"], new_result["median"]
+            ratio = new_median / base_median if base_median > 0 else float("inf")
+            regressed = (
+                new_median > base_median * (1 + threshold)
+                and new_median - base_median > min_seconds
+            )
+            rows.append((config_name, phase, base_median, new_median, ratio, regressed))
+    return rows
+
+
+def _main():
+    """Run or compare the benchmarks."""
+    parser = argparse.ArgumentParser(description="Benchmark the phases of the methods.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument(
+        "-s", "--save", type=str, required=True, help="Path to save the results (JSON)"
+    )
+    run_parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        nargs="+",
+        default=DEFAULT_CONFIGS,
+        help="Glob patterns of the config files under configs",
+    )
+    run_parser.add_argument(
+        "-b",
+        "--benchmarks",
+        type=str,
+        nargs="+",
+        default=list(BENCHMARK_PHASES),
+        choices=list(BENCHMARK_PHASES),
+        help="Benchmarks to run, all by default",
+    )
+    run_parser.add_argument(
+        "-n", "--repeat", type=int, default=1, help="Number of runs of each config"
+    )
+    run_parser.add_argument(
+        "-t", "--timeout", type=float, default=600, help="Seconds each phase can take"
+    )
+    run_parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Show the output of the solvers"
+    )
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two results")
+    compare_parser.add_argument("base", type=str, help="Path to the base results")
+    compare_parser.add_argument("new", type=str, help="Path to the new results")
+    compare_parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative growth of the median flagged as a regression",
+    )
+    compare_parser.add_argument(
+        "-m",
+        "--min-seconds",
+        type=float,
+        default=0.05,
+        help="Absolute growth of the median below which no regression is flagged",
+    )
+
+    smoke_parser = subparsers.add_parser(
+        "smoke", help="Run the methods on small generated configs of each topology and pattern"
+    )
+    smoke_parser.add_argument(
+        "-s",
+        "--save",
+        type=str,
+        default=None,
+        help="Folder to save the generated configs, a temporary folder by default",
+    )
+    smoke_parser.add_argument(
+        "-t", "--timeout", type=float, default=120, help="Seconds each phase can take"
+    )
+    smoke_parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Show the output of the solvers"
+    )
+
+    args = parser.parse_args()
+    if args.command == "smoke":
+        if args.save is None:
+            with tempfile.TemporaryDirectory() as save_folder:
+                results = smoke_generated_configs(save_folder, args.timeout, args.verbose)
+        else:
+            results = smoke_generated_configs(args.save, args.timeout, args.verbose)
+        n_failed = sum(
+            config_results["zero_data_flows"] > 0
+            or any(isinstance(result, dict) for result in config_results.values())
+            for config_results in results.values()
+        )
+        logging.info("%s %d of %d generated configs failed.", "*" * 15, n_failed, len(results))
+        if n_failed:
+            sys.exit(1)
+        return
+
+    if args.command == "run":
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        config_folder_path = os.path.join(base_path, "configs")
+        results = run_benchmarks(
+            config_folder_path,
+            get_config_names(config_folder_path, args.config),
+            args.benchmarks,
+            repeat=args.repeat,
+            timeout=args.timeout,
+            verbose=args.verbose,
+        )
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+        logging.info("%s Benchmarks saved at %s", "*" * 15, args.save)
+        return
+
+    with open(args.base, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    rows = compare_benchmarks(base, new, args.threshold, args.min_seconds)
+    n_regressed = 0
+    for config_name, phase, base_median, new_median, ratio, regressed in rows:
+        flag = "REGRESSED" if regressed else ""
+        print(f"{config_name:45s} {phase:25s} {base_median:10.4g} {new_median:10.4g} {ratio:7.2f}x {flag}")
+        n_regressed += regressed
+    logging.info("%s %d of %d phases regressed.", "*" * 15, n_regressed, len(rows))
+    if n_regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,237 @@
+"""
+The compact outputs of the optimized flow rates (bps) of a config.
+
+Writing the whole config back with the bps of each flow may cost more than
+the allocation itself for the large configs. The bps can instead be written
+as a table of the flow ids and their bps, in one of `BPS_TABLE_FORMATS`,
+which refers to the SHA-256 of its source config, or patched into a copy of
+the config by streaming it in blocks, without loading it.
+
+A table is applied to its config by `apply_bps_table`, e.g. by the `-b` of
+`simulator.py`.
+"""
+
+import re
+import csv
+import json
+import logging
+from typing import List
+
+import numpy as np
+
+from generic import BaseContainer, ProblemIndex
+from results_store import get_config_hash
+
+# The formats of the tables, with their file extensions
+BPS_TABLE_FORMATS = {"npz": ".npz", "csv": ".csv", "jsonl": ".jsonl"}
+
+# The tokens of the JSON text which change the flow being patched: the
+# strings (with the colon of the keys, and without their closing quote when
+# they are cut by the end of a block) and the brackets
+_TOKEN = re.compile(rb'"((?:[^"\\]|\\.)*)("?)(\s*:)?|[{\[]|[}\]]')
+_NUMBER = re.compile(rb"\s*(-?[0-9.eE+\-]+)")
+# A flow without nested objects and lists, e.g. of all the shipped and generated
+# configs, which is patched at once, and the bps value in it
+_FLAT_OBJECT = re.compile(
+    rb'\s*\{[^{}\[\]"]*(?:(?:"[^"\\]*(?:\\.[^"\\]*)*"|\[[^{}\[\]"]*\])[^{}\[\]"]*)*\}'
+)
+_BPS_VALUE = re.compile(rb'[{,]\s*"bps"\s*:\s*(-?[0-9.eE+\-]+)')
+_BLOCK_SIZE = 1 << 20
+
+
+def get_flow_bps(
+    optimized_kn_rates: List[np.ndarray],
+    flow_container: BaseContainer,
+    problem_index: ProblemIndex,
+):
+    """
+    Get the bps of each flow from the optimized rates (MB/s) of its group.
+
+    :return flow_ids: The ids of the flows, in the order of the flow container.
+    :return bps: The bps of the flows, as int64.
+    """
+    group_rates = np.concatenate(
+        [np.asarray(rates, dtype=float).ravel() for rates in optimized_kn_rates]
+    )
+    bps = np.round(group_rates * 8 * 1024 * 1024).astype(np.int64)
+    flow_ids = [str(flow.id) for flow in flow_container.item_objs]
+    return flow_ids, bps[problem_index.flow_group_idxes]
+
+
+def save_bps_table(
+    save_path: str, flow_ids: List[str], bps: np.ndarray, config_path: str, fmt: str = "npz"
+) -> str:
+    """
+    Save the bps of the flows as a table at `<save_path><extension>`.
+
+    The "npz" table holds the `flow_ids`, `bps`, `config` and `config_hash`
+    arrays, the "csv" table starts by a `# config: <path> sha256: <hash>`
+    line, and the first line of the "jsonl" table holds the config and its
+    hash, followed by one `{"flow_id": ..., "bps": ...}` line per flow.
+
+    :return table_path: The path of the saved table.
+    """
+    if fmt not in BPS_TABLE_FORMATS:
+        raise ValueError(f"Unknown bps table format {fmt}, one of {list(BPS_TABLE_FORMATS)}")
+    table_path = save_path + BPS_TABLE_FORMATS[fmt]
+    config_hash = get_config_hash(config_path)
+    if fmt == "npz":
+        np.savez(
+            table_path,
+            flow_ids=np.array(flow_ids),
+            bps=np.asarray(bps, dtype=np.int64),
+            config=np.array(config_path),
+            config_hash=np.array(config_hash),
+        )
+    elif fmt == "csv":
+        with open(table_path, "w", encoding="utf-8", newline="") as f:
+            f.write(f"# config: {config_path} sha256: {config_hash}\n")
+            writer = csv.writer(f)
+            writer.writerow(["flow_id", "bps"])
+            writer.writerows(zip(flow_ids, bps.tolist()))
+    else:
+        with open(table_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"config": config_path, "config_hash": config_hash}) + "\n")
+            f.writelines(
+                f'{{"flow_id": {json.dumps(flow_id)}, "bps": {value}}}\n'
+                for flow_id, value in zip(flow_ids, bps.tolist())
+            )
+    return table_path
+
+
+def load_bps_table(table_path: str):
+    """
+    Load a table saved by `save_bps_table`, given its format by its extension.
+
+    :return flow_bps: A dict holding the bps of each flow id.
+    :return source: A dict holding the `config` path and the `config_hash`.
+    """
+    if table_path.endswith(".npz"):
+        with np.load(table_path) as table:
+            flow_bps = dict(zip(table["flow_ids"].tolist(), table["bps"].tolist()))
+            source = {
+                "config": str(table["config"]),
+                "config_hash": str(table["config_hash"]),
+            }
+    elif table_path.endswith(".csv"):
+        with open(table_path, "r", encoding="utf-8", newline="") as f:
+            matched = re.match(r"# config: (.*) sha256: (\w+)", f.readline())
+            source = {"config": matched.group(1), "config_hash": matched.group(2)}
+            reader = csv.reader(f)
+            next(reader)
+            flow_bps = {flow_id: int(value) for flow_id, value in reader}
+    else:
+        with open(table_path, "r", encoding="utf-8") as f:
+            source = json.loads(f.readline())
+            flow_bps = dict()
+            for line in f:
+                row = json.loads(line)
+                flow_bps[row["flow_id"]] = row["bps"]
+    return flow_bps, source
+
+
+def apply_bps_table(
+    info_data: dict, flow_bps: dict, source: dict = None, config_path: str = None
+):
+    """
+    Set the bps of each flow of the loaded config from a table, warning when
+    the config is not the source of the table.
+    """
+    if (
+        source is not None
+        and config_path is not None
+        and get_config_hash(config_path) != source["config_hash"]
+    ):
+        logging.warning(
+            "!----> %s is not the config of the bps table, made from %s.",
+            config_path,
+            source["config"],
+        )
+    for flow_id, bps in flow_bps.items():
+        info_data[flow_id]["bps"] = bps
+    return info_data
+
+
+def stream_patch_bps(
+    config_path: str, save_path: str, flow_bps: dict, block_size: int = _BLOCK_SIZE
+):
+    """
+    Copy the config to save_path with the bps of its flows, reading it by
+    blocks of block_size bytes, so that it is never loaded as a whole. The
+    text of the config is kept besides the bps values, and the flows without
+    a bps get one before their closing brace.
+
+    :param flow_bps: A dict holding the bps of each flow id.
+    """
+    flow_bps = {
+        str(flow_id).encode("utf-8"): str(int(bps)).encode("ascii")
+        for flow_id, bps in flow_bps.items()
+    }
+    depth = 0
+    # The bps of the flow (the object at depth 2) being copied, and whether it has its bps
+    flow_value = None
+    has_bps = False
+    with open(config_path, "rb") as src, open(save_path, "wb") as dst:
+        buffer = b""
+        is_end = False
+        while not is_end:
+            block = src.read(block_size)
+            is_end = not block
+            buffer += block
+            pos = 0
+            written = 0
+            while True:
+                matched = _TOKEN.search(buffer, pos)
+                if matched is None:
+                    break
+                token = matched.group(0)
+                if token[:1] == b'"':
+                    # A string cut by the end of the block, or a key whose colon may follow
+                    if not is_end and (
+                        not matched.group(2)
+                        or (not matched.group(3) and not buffer[matched.end() :].strip())
+                    ):
+                        break
+                    if matched.group(3):
+                        if depth == 1:
+                            flow_value = flow_bps.get(matched.group(1))
+                            has_bps = False
+                            flat = _FLAT_OBJECT.match(buffer, matched.end())
+                            if flat is not None:
+                                if flow_value is not None:
+                                    number = _BPS_VALUE.search(buffer, matched.end(), flat.end())
+                                    if number is not None:
+                                        dst.write(buffer[written : number.start(1)])
+                                        written = number.end(1)
+                                    else:
+                                        dst.write(buffer[written : flat.end() - 1])
+                                        flow_value = b', "bps": ' + flow_value
+                                        written = flat.end() - 1
+                                    dst.write(flow_value)
+                                    flow_value = None
+                                pos = flat.end()
+                                continue
+                        elif depth == 2 and flow_value is not None and matched.group(1) == b"bps":
+                            number = _NUMBER.match(buffer, matched.end())
+                            if number is None or (not is_end and number.end() == len(buffer)):
+                                break
+                            dst.write(buffer[written : number.start(1)])
+                            dst.write(flow_value)
+                            written = pos = number.end()
+                            has_bps = True
+                            continue
+                elif token in (b"{", b"["):
+                    depth += 1
+                else:
+                    if depth == 2 and token == b"}" and flow_value is not None and not has_bps:
+                        dst.write(buffer[written : matched.start()])
+                        dst.write(b', "bps": ' + flow_value)
+                        written = matched.start()
+                    depth -= 1
+                    if depth == 1:
+                        flow_value = None
+                pos = matched.end()
+            # The text after the last complete token is kept for the next block
+            dst.write(buffer[written:pos])
+            buffer = buffer[pos:]
+        dst.write(buffer)
@@ -2,8 +2,18 @@
 Commonly used utilities for the stellar function.
 """
 
+import os
+from typing import List
+
 import numpy as np
 
+from utils import save_chunk_schedule
+from opt_utils import (
+    create_dependency_lists,
+    create_dependency_index,
+    get_group_lower_bounds,
+)
+
 
 def get_link_groups(fl_matrix, fcg_matrix, link_idx, collective_ids, group_ids):
     """Get all groups that pass the link"""
@@ -23,3 +33,247 @@ def get_link_groups(fl_matrix, fcg_matrix, link_idx, collective_ids, group_ids):
         coll_groups_idx.append((col_idx, group_idx))
 
     return coll_groups, coll_groups_idx
+
+
+def get_conflict_pairs(flow_links: list) -> np.ndarray:
+    """
+    Get the pairs of flows that share at least one link.
+
+    An inverted link -> flows index is built first, so that the candidate
+    pairs are only emitted within the bucket of each link.
+
+    :param flow_links: A list holding the links of each flow.
+    :return: An array with shape [P, 2] holding the unique pairs (i, j) of
+     flow positions with i < j, sorted by i and then by j.
+    """
+    n_flows = len(flow_links)
+    link_flows = dict()
+    for flow_pos, links in enumerate(flow_links):
+        for link in set(links):
+            link_flows.setdefault(link, []).append(flow_pos)
+
+    pair_codes = list()
+    for flows in link_flows.values():
+        if len(flows) < 2:
+            continue
+        flows = np.array(flows, dtype=np.int64)
+        rows, cols = np.triu_indices(len(flows), k=1)
+        pair_codes.append(flows[rows] * n_flows + flows[cols])
+    if not pair_codes:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    pair_codes = np.unique(np.concatenate(pair_codes))
+    return np.column_stack((pair_codes // n_flows, pair_codes % n_flows))
+
+
+def get_conflict_neighbors(flow_links: list) -> List[List[int]]:
+    """
+    Get, for each flow, the positions of the other flows sharing at least one
+    link with it, in the order of the flows.
+    """
+    pairs = get_conflict_pairs(flow_links)
+    directed = np.concatenate((pairs, pairs[:, ::-1]))
+    directed = directed[np.lexsort((directed[:, 1], directed[:, 0]))]
+    bounds = np.searchsorted(directed[:, 0], np.arange(len(flow_links) + 1))
+    return [
+        directed[bounds[pos] : bounds[pos + 1], 1].tolist()
+        for pos in range(len(flow_links))
+    ]
+
+
+def get_chunk_time_windows(flow_parts, dependency_pairs, conflict_pairs):
+    """
+    Get the window of the time slots that each flow of the chunk-based
+    scheduling can be sent in.
+
+    Shifting every flow to the earliest slot left by its dependencies and by
+    the flows sharing links with it never increases the completion times, so
+    an optimal schedule exists where the flows of a connected component of
+    the dependency and conflict pairs finish within the sum of their parts.
+    Then, the earliest start of a flow follows its longest dependency chain
+    and its latest finish is this component horizon minus the parts of its
+    longest chain of successors.
+
+    :param flow_parts: A list holding the number of parts of each flow.
+    :param dependency_pairs: A list of (i, j) where flow i is sent before flow j.
+    :param conflict_pairs: A list of (i, j) where flows i and j share a link.
+    :return earliest_starts: An array with shape [F] holding the first
+     time slot each flow can start at.
+    :return latest_finishes: An array with shape [F] holding the last
+     time slot each flow can finish at.
+    """
+    flow_parts = np.asarray(flow_parts, dtype=np.int64)
+    n_flows = len(flow_parts)
+
+    # The horizon of each connected component
+    parents = list(range(n_flows))
+
+    def find(pos):
+        while parents[pos] != pos:
+            parents[pos] = parents[parents[pos]]
+            pos = parents[pos]
+        return pos
+
+    for idx_i, idx_j in list(dependency_pairs) + list(conflict_pairs):
+        root_i, root_j = find(int(idx_i)), find(int(idx_j))
+        if root_i != root_j:
+            parents[root_i] = root_j
+    roots = np.array([find(pos) for pos in range(n_flows)], dtype=np.int64)
+    horizons = np.bincount(roots, weights=flow_parts, minlength=n_flows)
+    horizons = horizons.astype(np.int64)[roots]
+
+    # The longest dependency chains, in a topological order
+    successors = [[] for _ in range(n_flows)]
+    in_degrees = np.zeros(n_flows, dtype=np.int64)
+    for idx_i, idx_j in dependency_pairs:
+        successors[int(idx_i)].append(int(idx_j))
+        in_degrees[int(idx_j)] += 1
+    topo_order = [pos for pos in range(n_flows) if in_degrees[pos] == 0]
+    for pos in topo_order:
+        for succ in successors[pos]:
+            in_degrees[succ] -= 1
+            if in_degrees[succ] == 0:
+                topo_order.append(succ)
+
+    earliest_starts = np.ones(n_flows, dtype=np.int64)
+    for pos in topo_order:
+        for succ in successors[pos]:
+            earliest_starts[succ] = max(
+                earliest_starts[succ], earliest_starts[pos] + flow_parts[pos]
+            )
+    latest_finishes = horizons.copy()
+    for pos in reversed(topo_order):
+        for succ in successors[pos]:
+            latest_finishes[pos] = min(
+                latest_finishes[pos], latest_finishes[succ] - flow_parts[succ]
+            )
+    return earliest_starts, latest_finishes
+
+
+def get_chunk_lower_bounds(flow_parts, dependency_pairs, flow_groups, flow_links, release_times=None):
+    """
+    Get the lower bound of the time slot we send the last part of each
+    collective, from the dependency DAG and the links of its groups.
+
+    :param flow_parts: A list holding the number of parts of each flow.
+    :param dependency_pairs: A list of (i, j) where flow i is sent before flow j.
+    :param flow_groups: A list holding the (collective, group) of each flow.
+    :param flow_links: A list holding the links of each flow.
+    :param release_times: An optional list holding the first time slot each
+     flow can start at.
+    :return lower_bounds: A dict holding the lower bound of each collective.
+    """
+    flow_parts = np.asarray(flow_parts, dtype=float)
+    group_positions = dict()
+    flow_group_idxes = np.array(
+        [group_positions.setdefault(key, len(group_positions)) for key in flow_groups],
+        dtype=np.int64,
+    )
+    link_positions = dict()
+    flow_link_lists = [
+        [link_positions.setdefault(str(link), len(link_positions)) for link in set(links)]
+        for links in flow_links
+    ]
+    flow_link_indptr = np.concatenate(([0], np.cumsum([len(links) for links in flow_link_lists])))
+    flow_link_indices = np.array(
+        [link for links in flow_link_lists for link in links], dtype=np.int64
+    )
+
+    N = len(group_positions)
+    dependency_index = create_dependency_index(
+        *create_dependency_lists(dependency_pairs, len(flow_parts)),
+        flow_parts,
+        flow_group_idxes,
+        N,
+    )
+    # The last slot of a flow starting at its release time r is r - 1 + parts
+    flow_offsets = None
+    if release_times is not None:
+        flow_offsets = np.asarray(release_times, dtype=float) - 1
+    group_bounds = get_group_lower_bounds(
+        dependency_index,
+        flow_parts,
+        flow_group_idxes,
+        flow_link_indptr,
+        flow_link_indices,
+        N,
+        flow_offsets,
+    )
+    lower_bounds = dict()
+    for (k, _), group_idx in group_positions.items():
+        lower_bounds[k] = max(lower_bounds.get(k, 0), int(round(group_bounds[group_idx])))
+    return lower_bounds
+
+
+# The columns of the schedule of the chunk-based scheduling
+SCHEDULE_COLUMNS = (
+    "flow_id", "collective", "group", "source", "dest", "order", "part", "arriving_time"
+)
+
+
+def get_chunk_schedule(flow_ids, collectives, groups, sources, dests, orders, flow_parts, start_times):
+    """
+    Collect the arriving time of each part of the flows into the columns of
+    the schedule, where the parts of each flow are sent in consecutive time
+    slots from its start time.
+
+    :param flow_parts: The number of parts of each flow.
+    :param start_times: The time slot we send the first part of each flow.
+    :return schedule: A dict holding an array of each column, with one row per part.
+    """
+    flow_parts = np.asarray(flow_parts, dtype=np.int64)
+    parts = np.arange(flow_parts.sum()) - np.repeat(np.cumsum(flow_parts) - flow_parts, flow_parts) + 1
+    schedule = {
+        name: np.repeat(np.asarray(column), flow_parts)
+        for name, column in zip(
+            SCHEDULE_COLUMNS[:6], (flow_ids, collectives, groups, sources, dests, orders)
+        )
+    }
+    schedule["flow_id"] = schedule["flow_id"].astype(str)
+    schedule["part"] = parts
+    schedule["arriving_time"] = np.repeat(np.asarray(start_times, dtype=float), flow_parts) + parts - 1
+    return schedule
+
+
+def get_part_schedule(part_keys, arriving_times):
+    """
+    Collect the arriving time of each part into the columns of the schedule.
+
+    :param part_keys: The (flow_id, k, n, i, j, o, p) of each part.
+    :param arriving_times: The arriving time of each part.
+    """
+    if not part_keys:
+        return {name: np.zeros(0) for name in SCHEDULE_COLUMNS}
+    schedule = {
+        name: np.array(column) for name, column in zip(SCHEDULE_COLUMNS[:7], zip(*part_keys))
+    }
+    schedule["flow_id"] = schedule["flow_id"].astype(str)
+    schedule["arriving_time"] = np.asarray(arriving_times, dtype=float)
+    return schedule
+
+
+def print_chunk_schedule(schedule):
+    """Display the arriving time of each part of the flows."""
+    for fid, k, n, i, j, o, p, arriving_time in zip(
+        *(schedule[name].tolist() for name in SCHEDULE_COLUMNS)
+    ):
+        print((fid, k, n, i, j, o, p))
+        print(f"Flow(k={k}, n={n}, order={o}, part={p}) Arriving time: {arriving_time:.1f}")
+
+
+def report_chunk_schedule(schedule, opt_config, header=True):
+    """
+    Display the schedule unless `quiet` in the opt_config, and save it under
+    the `model_path` of the opt_config if given, in the `schedule_formats`
+    (csv and npz by default).
+    """
+    if opt_config.get("quiet", False) not in (True, "True", "true"):
+        if header:
+            print("\n========= Var Values =========")
+        print_chunk_schedule(schedule)
+    if "model_path" in opt_config:
+        save_chunk_schedule(
+            os.path.join(opt_config["model_path"], "schedule"),
+            schedule,
+            opt_config.get("schedule_formats", ("csv", "npz")),
+        )
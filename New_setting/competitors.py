@@ -12,10 +12,18 @@ from generic import (
     FlowLinkSendHolder,
     CollectiveGroupContainer,
     FlowCGHolder,
+    ProblemIndex,
+)
+from opt_utils import (
+    v_kne,
+    compute_average_completion_time,
+    get_group_flows,
+    create_adjacency_lists,
+    create_problem_index,
 )
-from opt_utils import v_kne, compute_average_completion_time, get_group_flows
 from utils import save_alloc_solutions
-from common_utils import get_link_groups
+from solution_cache import lookup_solution, store_solution
+from tracing import traced
 
 baseline_factory = ["averageAlloc", "dataAwareAlloc", "groupdataAwareAlloc"]
 
@@ -82,12 +90,18 @@ def baseline_allocation(
     fcg_holder: FlowCGHolder,
     opt_config: dict,
     method_name: str = "averageAlloc",
+    problem_index: ProblemIndex = None,
 ):
     """Allocating the bandwidth equally among group."""
     # Set the save path
     save_path = opt_config["model_path"]
     os.makedirs(save_path, exist_ok=True)
 
+    if problem_index is None:
+        problem_index = create_problem_index(
+            flow_container, link_container, fl_s_holder, cg_container, fcg_holder
+        )
+
     start_time = time.time()
 
     link_ids = link_container.item_objs
@@ -124,24 +138,14 @@ def baseline_allocation(
         if len(flow_indxes) <= 1:
             continue
 
-        # 3. Get the groups for these flows
-        # with shape [len(flow_indxes), 2]
-        # [:,0]: collective id, [: 1]: group id
-        coll_groups = fcg_holder.matrix[flow_indxes, :2]
-        coll_groups = np.unique(coll_groups, axis=0)
-        print("coll_groups: ", coll_groups)
+        # 3. Get the (k, n) indexes of the groups for these flows
+        coll_groups_idx = problem_index.link_kn_groups(link_idx)
+        print("coll_groups_idx: ", coll_groups_idx)
         # We skip the allocation once the there is no compete
         # in the link
-        if len(coll_groups) == 1:
+        if len(coll_groups_idx) == 1:
             continue
 
-        # get their indexes
-        coll_groups_idx = []
-        for coll_id, group_id in coll_groups:
-            col_idx = np.where(cg_container.collective_ids == coll_id)[0][0]
-            group_idx = np.where(cg_container.group_ids[col_idx] == group_id)[0][0]
-            coll_groups_idx.append((col_idx, group_idx))
-
         # 3.1. Check if the groups are already allocated and minus the capacity by them
         allocated_capacity = sum(
             [big_R[coll_idx][group_idx] for coll_idx, group_idx in coll_groups_idx]
@@ -168,20 +172,20 @@ def baseline_allocation(
                 fl_s_holder,
                 min_capacity,
             )
-        print("allocations: ", allocations)
         if method_name == "averageAlloc":
             allocations = average_bandwidth(
                 min_capacity, len(to_allocated_groups), len(to_allocated_groups)
             )
+        print("allocations: ", allocations)
 
         for i, (coll_idx, group_idx) in enumerate(to_allocated_groups):
             if big_R[coll_idx][group_idx] == 0:
                 big_R[coll_idx][group_idx] = allocations[i]
 
-    flow_datas = np.array([flow.data_volume for flow in flow_container.item_objs])
+    flow_datas = problem_index.flow_datas
 
     big_R_obj = compute_average_completion_time(
-        big_R, fcg_holder, cg_container, flow_datas, K, Nks
+        big_R, fcg_holder, cg_container, flow_datas, K, Nks, problem_index
     )
     solution = (big_R, big_R_obj)
     save_alloc_solutions(
@@ -194,6 +198,7 @@ def baseline_allocation(
     return big_R, end_time - start_time
 
 
+@traced("competitors.barrier_aware_allocation")
 def barrier_aware_allocation(
     flow_container: BaseContainer,
     link_container: BaseContainer,
@@ -201,9 +206,14 @@ def barrier_aware_allocation(
     cg_container: CollectiveGroupContainer,
     fcg_holder: FlowCGHolder,
     opt_config: dict,
+    problem_index: ProblemIndex = None,
 ):
     """
     Performing the allocation based on the barrier-aware approach.
+
+    This is a progressive filling over the [N, E] group-link data, where each
+    round picks the links with the minimum capacity per unit of data left by the
+    remaining collectives, and sets the rates of the groups crossing them.
     """
     start_time = time.time()
 
@@ -215,97 +225,100 @@ def barrier_aware_allocation(
     K = cg_container.K
     Nks = cg_container.Nks
     N = cg_container.N
-    F = fl_s_holder.fl_holder.F
     E = fl_s_holder.fl_holder.E
 
-    capacities = np.array([link.capacity for link in link_container.item_objs])
+    if problem_index is None:
+        problem_index = create_problem_index(
+            flow_container, link_container, fl_s_holder, cg_container, fcg_holder
+        )
+
+    canonical, cached = lookup_solution(
+        opt_config, "barrierAwareAlloc", problem_index, fl_s_holder.fl_holder.matrix
+    )
+    if cached is not None:
+        save_alloc_solutions(
+            os.path.join(save_path, "optimized_flow_rates.json"),
+            [(cached["rates"], cached["objective"])],
+        )
+        return cached["rates"], cached["objective"], time.time() - start_time
+
+    capacities = problem_index.link_capacities.copy()
     print("capacities: ", capacities)
-    big_R = [[0 for _ in range(Nks[k])] for k in range(K)]
-    allocated_collectives = []
-    visited_link_indexes = []
-    while len(allocated_collectives) != K:
-
-        # Always reduce the link capacity for those allocated collectives and groups
-        for k in range(K):
-            for n in range(Nks[k]):
-                if big_R[k][n] != 0:
-                    for e in range(E):
-                        for flow_idx in get_group_flows(
-                            k, n, fcg_holder.matrix, cg_container
-                        ):
-                            if fl_s_holder.data_matrix[flow_idx, e] > 0:
-                                capacities[e] -= big_R[k][n]
-
-        left_link_indexes = [e for e in range(E) if e not in visited_link_indexes]
-
-        left_collective_indexes = [
-            k for k in range(K) if k not in allocated_collectives
-        ]
 
-        a_E = np.zeros(len(left_link_indexes), dtype=float)
-        b_E = np.zeros(len(left_link_indexes), dtype=float)
-
-        for idx, e in enumerate(left_link_indexes):
-            capacity = capacities[e]
-            for k in left_collective_indexes:
-                for n in range(Nks[k]):
-                    for flow_idx in range(F):
-                        group_flows = get_group_flows(
-                            k, n, fcg_holder.matrix, cg_container
-                        )
-                        if flow_idx in group_flows:
-                            if fl_s_holder.data_matrix[flow_idx, e] > 0:
-                                # find the e in the position of left_link_indexes
-                                a_E[idx] += fl_s_holder.data_matrix[flow_idx, e]
-
-            # We need to replace the 0 term in a_E (when no flow is sent on the link)
-            a_E[idx] = 0.1 if a_E[idx] == 0 else a_E[idx]
-            b_E[idx] = capacity / a_E[idx]
+    volumes = problem_index.group_link_volumes
+    counts = problem_index.group_link_counts
+    min_datas = problem_index.group_link_min_datas
+    max_datas = problem_index.group_link_max_datas
+    max_counts = counts.max(axis=1, initial=0)
+    group_collectives = problem_index.group_collectives
+
+    rates = np.zeros(N)
+    is_allocated_group = np.zeros(N, dtype=bool)
+    left_collectives = np.ones(K, dtype=bool)
+    left_links = np.ones(E, dtype=bool)
+    while left_collectives.any():
+
+        # Always reduce the link capacity for those allocated collectives and groups,
+        # once for each of their flows sending data on the link
+        for group_idx in np.flatnonzero(rates != 0):
+            for count in range(max_counts[group_idx]):
+                on_link = counts[group_idx] > count
+                capacities[on_link] = capacities[on_link] - rates[group_idx]
+
+        left_link_indexes = np.flatnonzero(left_links)
+        left_groups = left_collectives[group_collectives]
+
+        a_E = volumes[left_groups][:, left_link_indexes].sum(axis=0)
+        # We need to replace the 0 term in a_E (when no flow is sent on the link)
+        a_E[a_E == 0] = 0.1
+        b_E = capacities[left_link_indexes] / a_E
 
         lambda_optimal = np.min(b_E)
 
         # Obtain Bottleneck Links the that satisfies: b_e == lambda_optimal
-        bottle_link_indexes = [
-            e for idx, e in enumerate(left_link_indexes) if b_E[idx] == lambda_optimal
-        ]
+        bottle_link_indexes = left_link_indexes[b_E == lambda_optimal]
 
         # Obtain Bottleneck groups containing the flows that traverse the bottleneck links;
-        bottle_collectives = []
-        for k in left_collective_indexes:
-            for n in range(Nks[k]):
-                group_flows = get_group_flows(k, n, fcg_holder.matrix, cg_container)
-                rates = []
-                for e_idx in bottle_link_indexes:
-                    for flow_idx in group_flows:
-                        group_link_data = fl_s_holder.data_matrix[flow_idx, e_idx]
-                        if group_link_data > 0:
-                            if k not in bottle_collectives:
-                                bottle_collectives.append(k)
-                            rates.append(lambda_optimal * group_link_data)
-                if len(rates) != 0:
-                    big_R[k][n] = min(rates)
-
-        # Remove the bottleneck collectives by setting that they are the allocated collectives
-        allocated_collectives.extend(bottle_collectives)
-        # Remove the bottleneck links by setting that they are the visited links
-        visited_link_indexes.extend(bottle_link_indexes)
-
-    flow_datas = np.array([flow.data_volume for flow in flow_container.item_objs])
+        # each one gets the minimum rate among its flows on these links
+        bottle_groups = left_groups & (counts[:, bottle_link_indexes] > 0).any(axis=1)
+        if lambda_optimal >= 0:
+            group_datas = min_datas[bottle_groups][:, bottle_link_indexes].min(axis=1)
+        else:
+            group_datas = max_datas[bottle_groups][:, bottle_link_indexes].max(axis=1)
+        rates[bottle_groups] = lambda_optimal * group_datas
+        is_allocated_group[bottle_groups] = True
+
+        # Remove the bottleneck collectives and the bottleneck links
+        left_collectives[group_collectives[bottle_groups]] = False
+        left_links[bottle_link_indexes] = False
+
+    offsets = problem_index.group_offsets
+    big_R = [
+        [
+            rates[offsets[k] + n] if is_allocated_group[offsets[k] + n] else 0
+            for n in range(Nks[k])
+        ]
+        for k in range(K)
+    ]
+
+    flow_datas = problem_index.flow_datas
 
     big_R_obj = compute_average_completion_time(
-        big_R, fcg_holder, cg_container, flow_datas, K, Nks
+        big_R, fcg_holder, cg_container, flow_datas, K, Nks, problem_index
     )
     solution = (big_R, big_R_obj)
     save_alloc_solutions(
         os.path.join(save_path, "optimized_flow_rates.json"),
         [solution],
     )
+    store_solution(opt_config, canonical, "barrierAwareAlloc", big_R, big_R_obj)
 
     end_time = time.time()
 
-    return big_R, end_time - start_time
+    return big_R, big_R_obj, end_time - start_time
 
 
+@traced("competitors.data_aware_allocation")
 def data_aware_allocation(
     flow_container: BaseContainer,
     link_container: BaseContainer,
@@ -313,14 +326,35 @@ def data_aware_allocation(
     cg_container: CollectiveGroupContainer,
     fcg_holder: FlowCGHolder,
     opt_config: dict,
+    problem_index: ProblemIndex = None,
 ):
-    """Allocating the bandwidth equally among group."""
+    """Allocating the bandwidth based on the data of groups on each link."""
     # Set the save path
     save_path = opt_config["model_path"]
     os.makedirs(save_path, exist_ok=True)
 
     start_time = time.time()
 
+    if problem_index is None:
+        problem_index = create_problem_index(
+            flow_container, link_container, fl_s_holder, cg_container, fcg_holder
+        )
+
+    # The greedy allocation visits the groups in order, so the cache keeps it
+    canonical, cached = lookup_solution(
+        opt_config,
+        "dataAwareAlloc",
+        problem_index,
+        fl_s_holder.fl_holder.matrix,
+        keep_order=True,
+    )
+    if cached is not None:
+        save_alloc_solutions(
+            os.path.join(save_path, "optimized_flow_rates.json"),
+            [(cached["rates"], cached["objective"])],
+        )
+        return cached["rates"], cached["objective"], time.time() - start_time
+
     link_ids = link_container.item_objs
     capacities = np.array(
         [link_container.item_objs[idx].capacity for idx in range(len(link_ids))]
@@ -340,74 +374,54 @@ def data_aware_allocation(
 
     big_R = [[0 for _ in range(Nks[k])] for k in range(K)]
 
+    # The group -> links adjacency lists, for the links on which the group
+    # sends data and for the links passed by the group
+    volumes = problem_index.group_link_volumes
+    data_indptr, data_links = create_adjacency_lists(problem_index.group_link_counts)
+
+    # The link -> groups lists are only visited through two aggregates of each link:
+    # the allocated bandwidth of its groups and the data of its groups not yet allocated
+    link_allocated = np.zeros(E)
+    link_to_allocate_data = volumes.sum(axis=0)
+
+    offsets = problem_index.group_offsets
+
     # Start from any group to search for the data-aware allocation
     for k in range(K):
         for n in range(Nks[k]):
-
-            # Get all flow indexes of the group
-            group_flow_idxes = get_group_flows(k, n, fcg_holder.matrix, cg_container)
-            # Get the links that this group is using
-            group_link_idxes = list()
-            for e in range(E):
-                if any(
-                    [fl_s_holder.data_matrix[idx, e] > 0 for idx in group_flow_idxes]
-                ):
-                    group_link_idxes.append(e)
-
-            # Visit these links to obtain the data-aware allocation
-            link_allocations = list()
-            for e_idx in group_link_idxes:
-                link_capacity = capacities[e_idx]
-                # Get all other groups that are using this link
-                coll_groups, coll_groups_idxes = get_link_groups(
-                    fl_s_holder.fl_holder.matrix,
-                    fcg_holder.matrix,
-                    e_idx,
-                    cg_container.collective_ids,
-                    cg_container.group_ids,
-                )
-                # Check if the group passing the link has been allocated
-                allocated = [
-                    (big_R[coll_idx][group_idx], i)
-                    for i, (coll_idx, group_idx) in enumerate(coll_groups_idxes)
-                    if big_R[coll_idx][group_idx] != 0
-                ]
-                # Remove the allocated bandwidth from the link capacity
-                link_capacity -= sum([a for a, _ in allocated])
-                # Remove the allocated groups from the list
-                to_allocate_groups = [
-                    (coll_idx, group_idx)
-                    for j, (coll_idx, group_idx) in enumerate(coll_groups_idxes)
-                    if j not in [i for _, i in allocated]
-                ]
-                # Get the data of the group on the link
-                allocations = data_aware_link_allocation(
-                    to_allocate_groups,
-                    e_idx,
-                    fcg_holder,
-                    cg_container,
-                    fl_s_holder,
-                    link_capacity,
-                )
-                # Get the alloc of this group
-                loc = to_allocate_groups.index((k, n))
-                link_allocations.append(allocations[loc])
+            group_idx = offsets[k] + n
+
+            # Visit the links this group is using to obtain the data-aware allocation,
+            # i.e., its data share of the capacity left by the allocated groups
+            group_links = data_links[data_indptr[group_idx] : data_indptr[group_idx + 1]]
+            link_allocations = (
+                volumes[group_idx, group_links]
+                / link_to_allocate_data[group_links]
+                * (capacities[group_links] - link_allocated[group_links])
+            )
 
             # Get the minimum allocation from all links as the capacity of this group
-            min_alloc = min(link_allocations)
+            min_alloc = min(list(link_allocations))
             big_R[k][n] = min_alloc
 
-    flow_datas = np.array([flow.data_volume for flow in flow_container.item_objs])
+            # Groups allocated with a zero rate remain to be allocated
+            if min_alloc != 0:
+                group_links = problem_index.group_links(group_idx)
+                link_allocated[group_links] += min_alloc
+                link_to_allocate_data[group_links] -= volumes[group_idx, group_links]
+
+    flow_datas = problem_index.flow_datas
 
     big_R_obj = compute_average_completion_time(
-        big_R, fcg_holder, cg_container, flow_datas, K, Nks
+        big_R, fcg_holder, cg_container, flow_datas, K, Nks, problem_index
     )
     solution = (big_R, big_R_obj)
     save_alloc_solutions(
         os.path.join(save_path, "optimized_flow_rates.json"),
         [solution],
     )
+    store_solution(opt_config, canonical, "dataAwareAlloc", big_R, big_R_obj)
 
     end_time = time.time()
 
-    return big_R, end_time - start_time
+    return big_R, big_R_obj, end_time - start_time
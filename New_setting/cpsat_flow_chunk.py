@@ -0,0 +1,165 @@
+"""
+The chunk-based scheduling solved as a disjunctive scheduling problem
+with the CP-SAT solver of OR-Tools.
+
+Each flow is an interval of num_part time slots, the flows sent on a same
+link can not overlap and the flows of a group are sent in their dependency
+order. OR-Tools is an optional dependency, only required by this method.
+"""
+
+import math
+import time
+import logging
+
+try:
+    from ortools.sat.python import cp_model
+except ImportError:
+    cp_model = None
+
+from optimized_flow_chunk_competitor import (
+    get_bottleneck_link_capacity,
+    get_flows_with_same_links,
+)
+from common_utils import (
+    get_chunk_time_windows,
+    get_chunk_lower_bounds,
+    report_chunk_schedule,
+)
+from list_scheduling import get_flow_chunk_schedule
+
+
+def flow_chunk_cpsat_optimization(
+    flow_info, link_cap, dependency_order, fid_to_order_dict, opt_config=None,
+    start_times=None,
+):
+    """
+    Schedule the parts of each flow to minimize the completion time of the
+    collectives, with one interval variable per flow.
+
+    The result is the same as `flow_chunk_optimization`.
+    :param opt_config: The optional `time_limit` (seconds) and `num_workers`
+     of the CP-SAT solver.
+    :param start_times: The start time of each flow in a feasible schedule,
+     e.g. by the list scheduler, given to CP-SAT as a solution hint, whose
+     objective also tightens the time windows of the flows.
+    :return objective_value: The average completion time of the collectives.
+    :return time_cost: The time cost of building and solving the model.
+    """
+    if cp_model is None:
+        raise ImportError(
+            "The CP-SAT method requires OR-Tools, install it by `pip install ortools`."
+        )
+    start_time = time.time()
+    logging.info('**** Start Flow Chunk Optimization with CP-SAT ****')
+    opt_config = {} if opt_config is None else opt_config
+    last_key = next(reversed(flow_info))
+    K = flow_info[last_key]['collective']
+
+    # Number of parts, dependency and conflict pairs of the flows
+    flow_ids = list(flow_info)
+    flow_positions = {flow_id: pos for pos, flow_id in enumerate(flow_ids)}
+    flow_parts = []
+    dependency_pairs = []
+    for flow_id, flow in flow_info.items():
+        flow_parts.append(
+            math.ceil(flow["data_size"]/get_bottleneck_link_capacity(link_set=flow["links"], link_cap=link_cap))
+        )
+        order = fid_to_order_dict[flow_id]
+        if order > 1:
+            prev_flow_id = dependency_order[(flow['collective'], flow['group'])][order - 2]
+            dependency_pairs.append((flow_positions[prev_flow_id], flow_positions[flow_id]))
+    conflict_pairs = [
+        (flow_positions[fid], flow_positions[other_flow])
+        for fid, other_list in get_flows_with_same_links(flow_info).items()
+        for other_flow in other_list
+    ]
+    earliest_starts, latest_finishes = get_chunk_time_windows(
+        flow_parts, dependency_pairs, conflict_pairs
+    )
+    lower_bounds = get_chunk_lower_bounds(
+        flow_parts,
+        dependency_pairs,
+        [(flow['collective'], flow['group']) for flow in flow_info.values()],
+        [flow['links'] for flow in flow_info.values()],
+    )
+    if start_times is not None:
+        # No schedule better than the hint finishes a collective later than
+        # its objective minus the lower bounds of the other collectives
+        completion_times = {}
+        for pos, (flow_id, flow) in enumerate(flow_info.items()):
+            finish = int(start_times[flow_id]) + flow_parts[pos] - 1
+            completion_times[flow['collective']] = max(completion_times.get(flow['collective'], 0), finish)
+        upper_bound = sum(completion_times.values())
+        total_lower_bound = sum(lower_bounds.values())
+        for pos, flow in enumerate(flow_info.values()):
+            latest_finishes[pos] = min(
+                latest_finishes[pos],
+                upper_bound - (total_lower_bound - lower_bounds[flow['collective']]),
+            )
+
+    # One interval [S, S + num_part) per flow, where S is the time slot we send the first part
+    model = cp_model.CpModel()
+    starts, intervals = [], []
+    for pos, flow_id in enumerate(flow_ids):
+        num_part = flow_parts[pos]
+        start_var = model.NewIntVar(
+            int(earliest_starts[pos]), int(latest_finishes[pos]) - num_part + 1, f"s_fid_{flow_id}"
+        )
+        starts.append(start_var)
+        intervals.append(
+            model.NewFixedSizeIntervalVar(start_var, num_part, f"interval_fid_{flow_id}")
+        )
+
+    # Non-concurrent constraints: the flows sent on a same link do not overlap
+    link_intervals = {}
+    for pos, flow in enumerate(flow_info.values()):
+        for link in set(flow["links"]):
+            link_intervals.setdefault(link, []).append(intervals[pos])
+    for link_interval_list in link_intervals.values():
+        if len(link_interval_list) > 1:
+            model.AddNoOverlap(link_interval_list)
+
+    # Dependency constraints: first part of the current flow should be later than the last part of the previous flow
+    for prev_pos, pos in dependency_pairs:
+        model.Add(starts[pos] >= starts[prev_pos] + flow_parts[prev_pos])
+
+    # Objective function: min sum(T_k), where T_k >= the time we send the last part of the flows in collective k
+    horizon = int(max(latest_finishes))
+    T = {
+        k: model.NewIntVar(lower_bounds.get(k, 0), max(horizon, lower_bounds.get(k, 0)), f"T_k{k}")
+        for k in range(1, K + 1)
+    }
+    for pos, flow in enumerate(flow_info.values()):
+        model.Add(T[flow['collective']] >= starts[pos] + flow_parts[pos] - 1)
+    model.Minimize(sum(T.values()))
+    if start_times is not None:
+        for pos, flow_id in enumerate(flow_ids):
+            model.AddHint(starts[pos], int(start_times[flow_id]))
+
+    logging.info("-----> Building CP-SAT model for chunk-based scheduling done, start solving...")
+    solver = cp_model.CpSolver()
+    if "time_limit" in opt_config:
+        solver.parameters.max_time_in_seconds = float(opt_config["time_limit"])
+    if "num_workers" in opt_config:
+        solver.parameters.num_workers = int(opt_config["num_workers"])
+    status = solver.Solve(model)
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        time_cost = time.time() - start_time
+        logging.info(f"Solver status: {solver.StatusName(status).lower()}, no schedule found, time cost: {time_cost}")
+        return None, time_cost
+
+    report_chunk_schedule(
+        get_flow_chunk_schedule(
+            flow_info,
+            fid_to_order_dict,
+            dict(zip(flow_ids, flow_parts)),
+            {flow_id: solver.Value(starts[pos]) for pos, flow_id in enumerate(flow_ids)},
+        ),
+        opt_config,
+        header=status == cp_model.OPTIMAL,
+    )
+    objective_value = solver.ObjectiveValue() / K
+    end_time = time.time()
+    time_cost = end_time - start_time
+    logging.info(f"Solver status: {solver.StatusName(status).lower()}, objective value: {objective_value}, time cost: {time_cost}")
+    return objective_value, time_cost
@@ -0,0 +1,283 @@
+"""
+A headless pipeline rendering the figures of the experiments from the
+results store.
+
+Each figure plots the time costs of the methods over the configs of its
+experiment, queried from the results store, or read from the CSV file of the
+experiment when the store does not hold them. The figures are rendered on the
+Agg backend across a process pool, and a figure is only rendered again when
+the hash of its data and its spec changes, given by the manifest saved next
+to the figures.
+
+Render all figures under `./figures` by:
+    $ python figures.py -o ./figures -j 4
+"""
+
+import os
+import json
+import hashlib
+import logging
+import argparse
+from dataclasses import dataclass, asdict
+from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from results_store import load_time_cost_table
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+MANIFEST_NAME = "figures_manifest.json"
+
+
+@dataclass
+class Experiment:
+    """The configs of an experiment, with the CSV file of its time costs."""
+
+    # The label of each config, e.g. `2-RAR`, on the x axis
+    labels: List[str]
+    # The file name of the config of each label
+    config_names: List[str]
+    csv_path: str
+
+
+@dataclass
+class FigureSpec:
+    """A figure plotting the time costs of the methods on an experiment."""
+
+    experiment: str
+    filename: str
+    figure_size: Tuple[float, float]
+    # The label, the summed columns of the time cost table and the style of each line
+    lines: List[Tuple[str, Tuple[str, ...], dict]]
+    ylabel: str = "Problem Solving Time (s)"
+
+
+_N_COLLECTIVES = ["2-RAR", "4-RAR", "6-RAR", "8-RAR"]
+_TOPOLOGIES = [
+    "Arpanet196912",
+    "Napnet",
+    "HiberniaIreland",
+    "Cesnet1993",
+    "TLex",
+    "Nordu1997",
+    "HostwayInternational",
+]
+
+EXPERIMENTS = {
+    "experiment1": Experiment(
+        labels=_N_COLLECTIVES,
+        config_names=[f"Abilene_{label}.json" for label in _N_COLLECTIVES],
+        csv_path="./results/experiment1_time_cost.csv",
+    ),
+    "experiment2": Experiment(
+        labels=_TOPOLOGIES,
+        config_names=[f"{label}_5-RAR.json" for label in _TOPOLOGIES],
+        csv_path="./results/experiment2_time_cost.csv",
+    ),
+}
+
+# The methods compared with stellar, and the two stages of stellar
+_METHOD_LINES = [
+    ("DataAware", ("Data Aware",), {"marker": ".", "color": "#B3B3B3", "linewidth": 1}),
+    ("Barrier", ("Barrier",), {"marker": "o", "color": "#6C8EBF", "linewidth": 2}),
+    (
+        "Optimal",
+        ("Stellar OP", "Stellar OR"),
+        {"marker": "*", "color": "#B85450", "linewidth": 3},
+    ),
+]
+_STAGE_LINES = [
+    ("OP", ("Stellar OP",), {"marker": ".", "color": "#B3B3B3", "linewidth": 3}),
+    ("OR", ("Stellar OR",), {"marker": "o", "color": "#6C8EBF", "linewidth": 2}),
+    (
+        "Full",
+        ("Stellar OP", "Stellar OR"),
+        {"marker": "x", "linestyle": "dashed", "color": "#D3D3D3", "linewidth": 1},
+    ),
+]
+
+FIGURES = {
+    "experiment21": FigureSpec("experiment1", "experiment21-results.pdf", (5, 4), _METHOD_LINES),
+    "experiment22": FigureSpec("experiment2", "experiment22-results.pdf", (8, 4), _METHOD_LINES),
+    "experiment31": FigureSpec("experiment1", "experiment31-results.pdf", (5, 4), _STAGE_LINES),
+    "experiment32": FigureSpec("experiment2", "experiment32-results.pdf", (8, 4), _STAGE_LINES),
+}
+
+
+def load_experiment_tables(experiment_names: List[str], db_path: str, params: dict = None) -> dict:
+    """Load the time cost table of each experiment, see `load_time_cost_table`."""
+    tables = dict()
+    for name in experiment_names:
+        experiment = EXPERIMENTS[name]
+        tables[name] = load_time_cost_table(
+            db_path, experiment.labels, experiment.config_names, experiment.csv_path, params
+        )
+    return tables
+
+
+def get_figure_hash(spec: FigureSpec, table: dict) -> str:
+    """Get the hash of the data and the spec of a figure."""
+    columns = sorted({column for _, line_columns, _ in spec.lines for column in line_columns})
+    data = {
+        "spec": asdict(spec),
+        "labels": EXPERIMENTS[spec.experiment].labels,
+        "columns": {column: [float(value) for value in table[column]] for column in columns},
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def render_figure(spec: FigureSpec, table: dict, figure_path: str) -> str:
+    """
+    Render a figure to figure_path on the Agg backend.
+
+    matplotlib is only imported by the processes rendering the figures.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.font_manager import FontProperties
+    from matplotlib.ticker import MaxNLocator
+
+    labels = EXPERIMENTS[spec.experiment].labels
+    fig, axis = plt.subplots(figsize=spec.figure_size)
+    fig.subplots_adjust(
+        left=0.133, bottom=0.13, right=0.952, top=0.96, hspace=0.2, wspace=0.2
+    )
+    axis.xaxis.set_major_locator(MaxNLocator(integer=True))
+    for label, columns, style in spec.lines:
+        values = np.sum([np.asarray(table[column], dtype=float) for column in columns], axis=0)
+        axis.plot(labels, values, label=label, **style)
+
+    # change font and size
+    label_font = FontProperties()
+    label_font.set_family("Source Sans Pro")
+    label_font.set_weight("semibold")
+    label_font.set_size("12")
+
+    axis.set_ylabel(spec.ylabel, fontproperties=label_font)
+    axis.tick_params(labelsize=12)
+    axis.grid(True)
+    axis.legend(prop=label_font, loc="best")
+    fig.savefig(figure_path)
+    plt.close(fig)
+    return figure_path
+
+
+def render_figures(
+    figure_names: List[str] = None,
+    output_path: str = ".",
+    db_path: str = "./results/results.db",
+    n_workers: int = None,
+    force: bool = False,
+    params: dict = None,
+) -> dict:
+    """
+    Render the figures whose data or spec changed since they were last
+    rendered under output_path, all figures by default.
+
+    :param params: The optional optimization parameters of the plotted
+     results, see `load_time_cost_table`.
+    :return rendered: A dict holding the path of each rendered figure.
+    """
+    figure_names = list(FIGURES) if figure_names is None else figure_names
+    os.makedirs(output_path, exist_ok=True)
+    manifest_path = os.path.join(output_path, MANIFEST_NAME)
+    manifest = dict()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    tables = load_experiment_tables(
+        sorted({FIGURES[name].experiment for name in figure_names}), db_path, params
+    )
+    todo = dict()
+    for name in figure_names:
+        spec = FIGURES[name]
+        figure_hash = get_figure_hash(spec, tables[spec.experiment])
+        figure_path = os.path.join(output_path, spec.filename)
+        if not force and manifest.get(name) == figure_hash and os.path.exists(figure_path):
+            logging.info("-----> %s is up to date.", figure_path)
+            continue
+        todo[name] = figure_hash
+
+    rendered = dict()
+    if todo:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {
+                executor.submit(
+                    render_figure,
+                    FIGURES[name],
+                    tables[FIGURES[name].experiment],
+                    os.path.join(output_path, FIGURES[name].filename),
+                ): name
+                for name in todo
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                rendered[name] = future.result()
+                manifest[name] = todo[name]
+                logging.info("-----> Rendered %s.", rendered[name])
+                with open(manifest_path, "w", encoding="utf-8") as f:
+                    json.dump(manifest, f, indent=4)
+    logging.info(
+        "%s Rendered %d of %d figures under %s.",
+        "*" * 15,
+        len(rendered),
+        len(figure_names),
+        output_path,
+    )
+    return rendered
+
+
+def _main():
+    """Render the figures."""
+    parser = argparse.ArgumentParser(description="Render the figures of the experiments.")
+    parser.add_argument(
+        "-o", "--output", type=str, default=".", help="Path to save the figures"
+    )
+    parser.add_argument(
+        "-f",
+        "--figures",
+        type=str,
+        nargs="+",
+        default=None,
+        help=f"Figures to render, or all of {list(FIGURES)}",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of processes rendering the figures concurrently",
+    )
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=str,
+        default="./results/results.db",
+        help="Path to the results store",
+    )
+    parser.add_argument(
+        "-p",
+        "--params",
+        type=json.loads,
+        default=None,
+        help="JSON of the optimization parameters of the plotted results, "
+        "e.g. the configuration of the optimization",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Render the figures even if they are up to date"
+    )
+    args = parser.parse_args()
+
+    unknown = set(args.figures or ()) - set(FIGURES)
+    if unknown:
+        parser.error(f"Unknown figures {sorted(unknown)}, choose from {list(FIGURES)}")
+    render_figures(args.figures, args.output, args.database, args.jobs, args.force, args.params)
+
+
+if __name__ == "__main__":
+    _main()
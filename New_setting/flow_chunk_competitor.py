@@ -12,9 +12,17 @@ from generic import (
     FlowLinkSendHolder,
     CollectiveGroupContainer,
     FlowCGHolder,
+    ProblemIndex,
 )
 from utils import save_alloc_solutions
-from opt_utils import get_group_flows
+from opt_utils import get_group_flows, create_problem_index
+from tracing import trace
+from common_utils import (
+    get_conflict_neighbors,
+    get_chunk_time_windows,
+    get_part_schedule,
+    report_chunk_schedule,
+)
 
 def get_bottleneck_link_capacity(fl_s_holder: FlowLinkSendHolder, flow_idx): # get bottleneck link capacity
     link_capacity = min([c for c in fl_s_holder.capacity_matrix[flow_idx] if c!=0])
@@ -22,74 +30,48 @@ def get_bottleneck_link_capacity(fl_s_holder: FlowLinkSendHolder, flow_idx): # g
         return 0
     return link_capacity
 
-def flow_chunk_optimization(
-    flow_container: BaseContainer,
-    link_container: BaseContainer,
-    fl_s_holder: FlowLinkSendHolder,
-    cg_container: CollectiveGroupContainer,
-    fcg_holder: FlowCGHolder,
-    opt_config: dict,
-):
+def get_chunk_dependency_pairs(edge_keys):
     """
-    Divide each flow into several parts
-      1. Each F(k,n,i,j) will be divided into datasize/bottleneck parts
-      2. X(k,n,i,j,o,p) > X(k,n,i,j,o,p-1)
-      3. Dependency constraints
-      4. Link constraints
+    Get the dependency pairs (i, j) of the flows, where flow i should be sent
+    before flow j: the flows of a higher order in a group are sent before the
+    order-0 flow of this group.
     """
-    start_time = time.time()
-    logging.info("**** Start Flow Chunk Optimization ****")
-    save_path = opt_config.get("model_path", "./")
-    os.makedirs(save_path, exist_ok=True)
+    dependency_pairs = []
+    current_k, current_n, current_order = 0, 0, 0 # just initialize
+    for pos, (k, n, i, j, o) in enumerate(edge_keys):
+        if o == 0:
+            current_order = 0
+            current_k, current_n = k, n
+            current_dependency_pos = pos
+        if o > current_order and k == current_k and n == current_n:
+            dependency_pairs.append((pos, current_dependency_pos))
+            current_order = o
+    return dependency_pairs
 
-    # 1 Basic settings
-    K = cg_container.K             # Number of collective
-    Nks = cg_container.Nks         # Number of groups
-    F = fl_s_holder.fl_holder.F    # Total number of flows
-    E = fl_s_holder.fl_holder.E    # Number of links
-    flow_objs = flow_container.item_objs
-    link_objs = link_container.item_objs
+def build_chunk_model(
+    flow_keys, flow_parts, edge_keys, edge_positions, edge_neighbors, K,
+    time_windows=None, big_m=1000,
+):
+    """
+    Build the chunk-based scheduling with one variable X(k,n,i,j,o,p) per part.
 
-    # 2. Create vars: X(k,n,i,j,o,t)
+    :param time_windows: The (earliest_starts, latest_finishes) of the flows
+     in edge_keys, which bound the parts and give the big M of each pair of
+     flows. Without them, the fixed `big_m` is used.
+    :return x: A dict of the sending time variable of each part.
+    :return T: A dict of the helper variable T_k of each collective.
+    :return constraints: A list of the constraints.
+    """
     x = {}
-    f2l = fl_s_holder.fl_holder.f2l_mapper
-    flow_datas = np.array([flow.data_volume for flow in flow_objs]) #[150  50  50 100]
-
     constraints = []
-    edge_record = {}
     link_constraint_check_list = {}
-    for flow_idx, flow in enumerate(fcg_holder.matrix):
-        k = flow[0]
-        n = flow[1]
-        order = flow[2]
-        flow_key = fl_s_holder.fl_holder.flow_ids[flow_idx]
-        source_link, dest_link = f2l[flow_key][0], f2l[flow_key][-1]
-        num_part = math.ceil(flow_datas[flow_idx]/get_bottleneck_link_capacity(fl_s_holder, flow_idx))
-        edge_record[(k, n, source_link, dest_link, order)] = fl_s_holder.f2l_mapper[f"{k}-{n}-{flow_idx + 1}"] # f2l_mapper={'1-1-1': [1, 2, 3, 4], '1-2-2': [5, 6, 2, 7, 9], '1-2-3': [5, 10, 11], '2-3-4': [12, 10, 11]}
-
-    for flow_idx, flow in enumerate(fcg_holder.matrix): #array([[1, 1, 0], [1, 2, 0], [1, 2, 1],[2, 3, 0]]))
-        k = flow[0]
-        n = flow[1]
-        order = flow[2]
-        flow_key = fl_s_holder.fl_holder.flow_ids[flow_idx]
-        source_link, dest_link = f2l[flow_key][0], f2l[flow_key][-1]
-        num_part = math.ceil(flow_datas[flow_idx]/get_bottleneck_link_capacity(fl_s_holder, flow_idx))
-        key1 = (k, n, source_link, dest_link, order) #Current key
-        # edge_record[key1] = fl_s_holder.f2l_mapper[f"{k}-{n}-{flow_idx + 1}"]
+    for key1, num_part in zip(flow_keys, flow_parts):
+        k, n, source_link, dest_link, order = key1 #Current key
+        neighbor_keys = [edge_keys[idx] for idx in edge_neighbors[edge_positions[key1]]]
         for part in range(1, int(num_part) + 1):
             x[(k, n, source_link, dest_link, order, part)] = cp.Variable(nonneg=True, name=f"x_k{k}_n{n}_i{source_link}_j{dest_link}_o{order}_p{part}")
-            for key2 in edge_record: #check if the other flows have the same linke with the current flow
-                if key1 != key2:
-                    common_elements = set(edge_record[key1]) & set(edge_record[key2])
-                    if common_elements:
-                        #print(f"key1:{key1},key2:{key2}")
-                        if key2 not in link_constraint_check_list:
-                            # link_constraint_check_list.setdefault(key2, set()).add(key1 + (part,)) 
-                            link_constraint_check_list[key2] = []
-                            link_constraint_check_list[key2].append(key1 + (part,))
-                        else:
-                            # link_constraint_check_list.setdefault(key2, set()).add(key1 + (part,))
-                            link_constraint_check_list[key2].append(key1 + (part,))
+            for key2 in neighbor_keys: # the other flows having the same link with the current flow
+                link_constraint_check_list.setdefault(key2, []).append(key1 + (part,))
     # print(link_constraint_check_list)
 
     #print(f"x example:{x[(1,1,1,4,0,1)]}")
@@ -107,16 +89,27 @@ def flow_chunk_optimization(
             prev_var = x[(k, n, i, j, o, p-1)]
             constraints.append(x_var == prev_var + 1) 
             # current_record = x_var
+        if time_windows is not None:
+            earliest_starts, latest_finishes = time_windows
+            pos = edge_positions[(k, n, i, j, o)]
+            if p == 1:
+                constraints.append(x_var >= earliest_starts[pos])
+            if (k, n, i, j, o, p+1) not in x:
+                constraints.append(x_var <= latest_finishes[pos])
         b = [cp.Variable(boolean=True) for _ in range(100)]
-        M = 1000
         count = 0
         if (k, n, i, j, o) in link_constraint_check_list:
             if link_constraint_check_list[(k, n, i, j, o)] != []:
                 #print(f"x var now is:{x_var}")
                 for var in link_constraint_check_list[(k, n, i, j, o)]:
                     #print(f"each var:{var}")
-                    constraints.append((x_var - x[var]) >= 1 - M*(1-b[count]))
-                    constraints.append((x_var - x[var]) <= -1 + M*b[count])
+                    M_1 = M_2 = big_m
+                    if time_windows is not None:
+                        other_pos = edge_positions[var[:5]]
+                        M_1 = int(latest_finishes[other_pos] + 1 - earliest_starts[pos])
+                        M_2 = int(latest_finishes[pos] + 1 - earliest_starts[other_pos])
+                    constraints.append((x_var - x[var]) >= 1 - M_1*(1-b[count]))
+                    constraints.append((x_var - x[var]) <= -1 + M_2*b[count])
                     count += 1
 
         if o == 0:
@@ -134,6 +127,157 @@ def flow_chunk_optimization(
                 if (k, n, i, j, o, p+1) not in x:
                     current_order = o
 
+    return x, T, constraints
+
+def build_compact_chunk_model(
+    edge_keys, edge_parts, edge_neighbors, K, time_windows=None, big_m=1000
+):
+    """
+    Build the chunk-based scheduling with one start time S(k,n,i,j,o) per flow.
+
+    The parts of a flow are sent at consecutive time slots, thus
+    X(k,n,i,j,o,p) = S(k,n,i,j,o) + p - 1 and
+      1. T_k >= S + num_part - 1
+      2. the per-part dependency constraints reduce to the last part
+      3. the per-part non-concurrent constraints of two flows sharing a link
+         reduce to one disjunction on their sending intervals
+    :param time_windows: The (earliest_starts, latest_finishes) of the flows
+     in edge_keys, which bound the start times and give the big M of each
+     pair of flows. Without them, the fixed `big_m` is used.
+    :return x: A dict of the sending time of each part, as expressions of S.
+    :return T: A dict of the helper variable T_k of each collective.
+    :return constraints: A list of the constraints.
+    """
+    constraints = []
+    T = {}
+    for k_idx in range(K):
+        T[k_idx + 1] = cp.Variable(nonneg=True, name=f"T_k{k_idx + 1}")
+
+    S = []
+    x = {}
+    for (k, n, i, j, o), num_part in zip(edge_keys, edge_parts):
+        S.append(cp.Variable(nonneg=True, name=f"s_k{k}_n{n}_i{i}_j{j}_o{o}"))
+        for part in range(1, num_part + 1):
+            x[(k, n, i, j, o, part)] = S[-1] + (part - 1)
+        constraints.append(S[-1] >= 1) # sending completion constraint (trivial)
+        constraints.append(T[k] >= S[-1] + (num_part - 1)) # helper for objective function
+    if time_windows is not None:
+        earliest_starts, latest_finishes = time_windows
+        for pos, num_part in enumerate(edge_parts):
+            constraints.append(S[pos] >= earliest_starts[pos])
+            constraints.append(S[pos] + (num_part - 1) <= latest_finishes[pos])
+
+    # Non-concurrent constraints: |X_a,p - X_b,q| >= 1 for all the parts of
+    # two flows sharing a link, i.e. one sending interval ends before the other
+    for pos_1 in range(len(edge_keys)):
+        for pos_2 in edge_neighbors[pos_1]:
+            if pos_2 <= pos_1:
+                continue
+            M_12 = M_21 = big_m
+            if time_windows is not None:
+                M_12 = int(latest_finishes[pos_1] + 1 - earliest_starts[pos_2])
+                M_21 = int(latest_finishes[pos_2] + 1 - earliest_starts[pos_1])
+            b = cp.Variable(boolean=True)
+            # if b==1, flow 2 is sent after flow 1; otherwise, flow 1 is sent after flow 2
+            constraints.append(S[pos_1] + edge_parts[pos_1] <= S[pos_2] + M_12*(1 - b))
+            constraints.append(S[pos_2] + edge_parts[pos_2] <= S[pos_1] + M_21*b)
+
+    # Dependency constraints, 1 first 0 later
+    for pos_1, pos_2 in get_chunk_dependency_pairs(edge_keys):
+        constraints.append(S[pos_1] + edge_parts[pos_1] <= S[pos_2])
+
+    return x, T, constraints
+
+def flow_chunk_optimization(
+    flow_container: BaseContainer,
+    link_container: BaseContainer,
+    fl_s_holder: FlowLinkSendHolder,
+    cg_container: CollectiveGroupContainer,
+    fcg_holder: FlowCGHolder,
+    opt_config: dict,
+    problem_index: ProblemIndex = None,
+):
+    """
+    Divide each flow into several parts
+      1. Each F(k,n,i,j) will be divided into datasize/bottleneck parts
+      2. X(k,n,i,j,o,p) > X(k,n,i,j,o,p-1)
+      3. Dependency constraints
+      4. Link constraints
+    """
+    start_time = time.time()
+    logging.info("**** Start Flow Chunk Optimization ****")
+    save_path = opt_config.get("model_path", "./")
+    os.makedirs(save_path, exist_ok=True)
+
+    if problem_index is None:
+        problem_index = create_problem_index(
+            flow_container, link_container, fl_s_holder, cg_container, fcg_holder
+        )
+
+    # 1 Basic settings
+    K = cg_container.K             # Number of collective
+    Nks = cg_container.Nks         # Number of groups
+    F = fl_s_holder.fl_holder.F    # Total number of flows
+    E = fl_s_holder.fl_holder.E    # Number of links
+    flow_objs = flow_container.item_objs
+    link_objs = link_container.item_objs
+
+    # 2. Create vars: X(k,n,i,j,o,t)
+    f2l = fl_s_holder.fl_holder.f2l_mapper
+    flow_datas = problem_index.flow_datas #[150  50  50 100]
+    bottleneck_capacities = problem_index.flow_bottleneck_capacities
+
+    edge_record = {}
+    edge_flow_ids = {}  # the id of the flow of each key (k,n,i,j,o)
+    flow_keys = []  # the key (k,n,i,j,o) of each flow
+    flow_parts = []  # the number of parts of each flow
+    for flow_idx, flow in enumerate(fcg_holder.matrix): #array([[1, 1, 0], [1, 2, 0], [1, 2, 1],[2, 3, 0]]))
+        k = flow[0]
+        n = flow[1]
+        order = flow[2]
+        flow_key = fl_s_holder.fl_holder.flow_ids[flow_idx]
+        source_link, dest_link = f2l[flow_key][0], f2l[flow_key][-1]
+        edge_flow_ids.setdefault((k, n, source_link, dest_link, order), flow_key)
+        edge_record[(k, n, source_link, dest_link, order)] = f2l[flow_key] # f2l_mapper={'1-1-1': [1, 2, 3, 4], '1-2-2': [5, 6, 2, 7, 9], '1-2-3': [5, 10, 11], '2-3-4': [12, 10, 11]}
+        flow_keys.append((k, n, source_link, dest_link, order))
+        flow_parts.append(int(math.ceil(flow_datas[flow_idx]/bottleneck_capacities[flow_idx])))
+
+    # The flows sharing links with each flow, from the link -> flows index
+    edge_keys = list(edge_record)
+    edge_positions = {key: pos for pos, key in enumerate(edge_keys)}
+    edge_neighbors = get_conflict_neighbors(list(edge_record.values()))
+
+    edge_parts = [0] * len(edge_keys)
+    for key, num_part in zip(flow_keys, flow_parts):
+        edge_parts[edge_positions[key]] = max(edge_parts[edge_positions[key]], num_part)
+
+    # Big M of the non-concurrent constraints: a fixed `big_m` of the
+    # opt_config, or the largest gap between the time windows of two flows
+    big_m = opt_config.get("big_m", None)
+    time_windows = None
+    if big_m is None:
+        conflict_pairs = [
+            (pos, other_pos)
+            for pos, neighbors in enumerate(edge_neighbors)
+            for other_pos in neighbors if other_pos > pos
+        ]
+        time_windows = get_chunk_time_windows(
+            edge_parts, get_chunk_dependency_pairs(edge_keys), conflict_pairs
+        )
+    else:
+        big_m = float(big_m)
+
+    with trace("chunk.build"):
+        if opt_config.get("compact_model", False) in (True, "True", "true"):
+            x, T, constraints = build_compact_chunk_model(
+                edge_keys, edge_parts, edge_neighbors, K, time_windows, big_m
+            )
+        else:
+            x, T, constraints = build_chunk_model(
+                flow_keys, flow_parts, edge_keys, edge_positions, edge_neighbors, K,
+                time_windows, big_m,
+            )
+
     objective = cp.Minimize(cp.sum([T[k] for k in range(1, K+1)])) # minimize the completion time of all collectives
 
     # Solve
@@ -141,14 +285,19 @@ def flow_chunk_optimization(
     logging.info("-----> Building MILP for chunk-based scheduling done, start solving...")
     # solver_name = opt_config.get("solver", "HIGHS") 
     # prob.solve(solver=solver_name)
-    prob.solve()
+    with trace("chunk.solve"):
+        prob.solve()
     # print("b values:", [b_i.value for b_i in b])
 
-    if prob.status == cp.OPTIMAL:
-        print("\n========= Var Values =========")
-    for (k, n, i, j, o, p), var in x.items():
-        print((k, n, i, j, o, p))
-        print(f"Flow(k={k}, n={n}, order={o}, part={p}) Arriving time: {var.value:.1f}")
+    with trace("chunk.report"):
+        report_chunk_schedule(
+            get_part_schedule(
+                [(edge_flow_ids[key[:5]],) + key for key in x],
+                [float(var.value) for var in x.values()],
+            ),
+            opt_config,
+            header=prob.status == cp.OPTIMAL,
+        )
     objective_value = prob.value / K
     end_time = time.time()
     time_cost = end_time - start_time
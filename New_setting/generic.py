@@ -3,10 +3,33 @@ The generic items used to perform the stellar function.
 """
 
 from typing import List, Dict
+from collections import OrderedDict
 from dataclasses import dataclass
 
 import numpy as np
-from transformers.utils import ModelOutput as FieldFrozenContainer
+from transformers.utils import ModelOutput
+
+from memory_utils import check_memory_budget
+
+
+def _rebuild_container(cls, items: dict, attributes: dict):
+    """Rebuild a pickled container without calling its __init__."""
+    container = cls.__new__(cls)
+    OrderedDict.update(container, items)
+    container.__dict__.update(attributes)
+    return container
+
+
+class FieldFrozenContainer(ModelOutput):
+    """
+    The base of all containers.
+
+    It can be pickled, e.g., to be sent to worker processes, by its items and
+    attributes, as the __init__ of the containers requires their fields.
+    """
+
+    def __reduce__(self):
+        return _rebuild_container, (self.__class__, dict(self), vars(self))
 
 
 def create_indicator_matrix(
@@ -15,6 +38,7 @@ def create_indicator_matrix(
     """Create a indicator matrix presenting the alignment of ids."""
     num_rows = len(row_ids)
     num_cols = len(col_ids)
+    check_memory_budget("indicator matrix", num_rows * num_cols * 8)
     matrix = np.zeros((num_rows, num_cols))
     for row_idx in range(num_rows):
         row_id = row_ids[row_idx]
@@ -100,13 +124,6 @@ class BaseFlow(FieldFrozenContainer):
             for flow_id in self.dependent_flow_ids
         ]
 
-    def get_dependency_order(self):
-        """
-        Get the order of the flow in the dependent flows.
-        The order starts from 0.
-        """
-        return len(self.dependent_flow_ids)
-
 
 @dataclass
 class BaseLink(FieldFrozenContainer):
@@ -287,3 +304,155 @@ class FlowCGHolder(FieldFrozenContainer):
     # With shape [N, 3], where
     # [:, 0]: collective id, [:, 1]: group id, [:, 2]: send order,
     matrix: np.ndarray = None
+
+
+@dataclass
+class DependencyIndex(FieldFrozenContainer):
+    """
+    A holder for the dependency DAG of the flows.
+
+    As a flow only depends on the flows of its group, the DAG of each
+    group is the part of it on the flows of the group.
+    """
+
+    # The flows that each flow depends on, in the CSR form
+    dependency_indptr: np.ndarray = None
+    dependency_indices: np.ndarray = None
+
+    # The topological level of each flow, i.e., the number of flows on its
+    # longest dependency chain before it, with shape [F]
+    flow_levels: np.ndarray = None
+    # The flows sorted by their levels, where the flows of the level l are
+    # level_flows[level_indptr[l]:level_indptr[l+1]]
+    level_indptr: np.ndarray = None
+    level_flows: np.ndarray = None
+
+    # The data of the heaviest dependency chain ending at each flow,
+    # including the flow, with shape [F]
+    flow_critical_volumes: np.ndarray = None
+    # The number of levels and the data of the heaviest dependency chain
+    # of each group, with shape [N]
+    group_depths: np.ndarray = None
+    group_critical_volumes: np.ndarray = None
+
+    def critical_paths(self, flow_weights, flow_offsets=None):
+        """
+        Get the weight of the heaviest dependency chain ending at each flow,
+        including the flow, computed level by level.
+
+        :param flow_offsets: The optional offset each flow starts after, e.g.
+         its release time, where the chain ending at a flow weighs at least
+         its offset plus its weight.
+        """
+        flow_weights = np.asarray(flow_weights, dtype=float)
+        paths = flow_weights.copy()
+        if flow_offsets is not None:
+            paths += flow_offsets
+        for level in range(1, len(self.level_indptr) - 1):
+            flows = self.level_flows[self.level_indptr[level] : self.level_indptr[level + 1]]
+            starts = self.dependency_indptr[flows]
+            counts = self.dependency_indptr[flows + 1] - starts
+            bounds = np.cumsum(counts) - counts
+            entries = np.repeat(starts - bounds, counts) + np.arange(counts.sum())
+            paths[flows] = np.maximum(
+                paths[flows],
+                flow_weights[flows]
+                + np.maximum.reduceat(paths[self.dependency_indices[entries]], bounds),
+            )
+        return paths
+
+
+@dataclass
+class ProblemIndex(FieldFrozenContainer):
+    """
+    A holder for the compact arrays shared by all methods.
+
+    It is built once from the other holders so that running several methods
+    on one config pays the preprocessing cost only once.
+    Groups are flattened in the collective order, i.e., the n-th group of the
+    k-th collective has the index group_offsets[k] + n.
+    """
+
+    # The data volume of each flow, with shape [F]
+    flow_datas: np.ndarray = None
+    # The flattened group index of each flow, with shape [F]
+    flow_group_idxes: np.ndarray = None
+    # The capacity of the bottleneck link of each flow, with shape [F]
+    flow_bottleneck_capacities: np.ndarray = None
+
+    # The first flattened group index of each collective, with shape [K + 1]
+    group_offsets: np.ndarray = None
+    # The collective index of each group, with shape [N]
+    group_collectives: np.ndarray = None
+    # The total data of each group, with shape [N]
+    group_datas: np.ndarray = None
+    # The flows of each group in the CSR form
+    group_flow_indptr: np.ndarray = None
+    group_flow_indices: np.ndarray = None
+
+    # The statistics of the data each group sends on each link, with shape [N, E]
+    # The v^{k,n}_e of the paper
+    group_link_volumes: np.ndarray = None
+    # The number of flows sending data on the link
+    group_link_counts: np.ndarray = None
+    # The minimum (inf if none) and maximum (-inf if none) data of these flows
+    group_link_min_datas: np.ndarray = None
+    group_link_max_datas: np.ndarray = None
+
+    # The links passed by each group and the groups passing each link,
+    # in the CSR form
+    group_link_indptr: np.ndarray = None
+    group_link_indices: np.ndarray = None
+    link_group_indptr: np.ndarray = None
+    link_group_indices: np.ndarray = None
+
+    # The capacity of each link, with shape [E]
+    link_capacities: np.ndarray = None
+
+    # The dependency DAG of the flows
+    dependency_index: DependencyIndex = None
+
+    def group_index(self, coll_index, index):
+        """Get the flattened index of the group."""
+        return self.group_offsets[coll_index] + index
+
+    def group_flows(self, group_index):
+        """Get the flow indexes of the flattened group."""
+        return self.group_flow_indices[
+            self.group_flow_indptr[group_index] : self.group_flow_indptr[
+                group_index + 1
+            ]
+        ]
+
+    def group_links(self, group_index):
+        """Get the link indexes passed by the flattened group."""
+        return self.group_link_indices[
+            self.group_link_indptr[group_index] : self.group_link_indptr[
+                group_index + 1
+            ]
+        ]
+
+    def link_groups(self, link_index):
+        """Get the flattened group indexes passing the link."""
+        return self.link_group_indices[
+            self.link_group_indptr[link_index] : self.link_group_indptr[
+                link_index + 1
+            ]
+        ]
+
+    def link_kn_groups(self, link_index):
+        """Get the (k, n) of the groups passing the link."""
+        return [
+            (int(k), int(group_index - self.group_offsets[k]))
+            for group_index, k in zip(
+                self.link_groups(link_index),
+                self.group_collectives[self.link_groups(link_index)],
+            )
+        ]
+
+    def nested(self, values):
+        """Convert the values of flattened groups to a list for each collective."""
+        return [
+            list(values[self.group_offsets[k] : self.group_offsets[k + 1]])
+            for k in range(len(self.group_offsets) - 1)
+        ]
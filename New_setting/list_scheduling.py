@@ -0,0 +1,174 @@
+"""
+A greedy list scheduler for the chunk-based scheduling.
+
+The flows are scheduled one by one, each at the earliest time slot its
+dependency and its links allow. The next flow to schedule is the ready flow
+that can start first, breaking the ties by the smallest remaining work of
+its collective, i.e. the number of parts of its flows not scheduled yet.
+"""
+
+import math
+import time
+import heapq
+import logging
+
+import numpy as np
+
+from optimized_flow_chunk_competitor import get_bottleneck_link_capacity
+from common_utils import get_chunk_schedule, report_chunk_schedule
+
+
+def get_flow_parts(flow_info, link_cap):
+    """Get the number of parts of each flow."""
+    return {
+        flow_id: math.ceil(flow["data_size"]/get_bottleneck_link_capacity(link_set=flow["links"], link_cap=link_cap))
+        for flow_id, flow in flow_info.items()
+    }
+
+
+def list_schedule(flow_info, flow_parts, dependency_order, fid_to_order_dict):
+    """
+    Schedule the flows by the earliest start first, and then by the smallest
+    remaining collective work first.
+
+    Each flow starts once its previous flow in the dependency order is
+    done and all of its links are free, where the next free time slot of
+    each link is held in an array. As the next free time slots only grow,
+    the earliest start of a ready flow is refreshed lazily when it is popped.
+    The remaining work of a collective shrinks instead, so the ready flows of
+    a collective are pushed again with its new work once one of its flows is
+    scheduled, and their older entries are skipped. A collective has at most
+    one ready flow per group, so it takes O((F G + P) log F) time, where G is
+    the largest number of groups of a collective and P the number of popped
+    flows whose links got busy since they were pushed.
+
+    :param flow_parts: A dict holding the number of parts of each flow.
+    :return start_times: A dict holding the time slot we send the first part
+     of each flow.
+    """
+    flow_positions = {flow_id: pos for pos, flow_id in enumerate(flow_info)}
+    link_positions = {}
+    flow_links = {}
+    remaining_works = {}
+    for flow_id, flow in flow_info.items():
+        flow_links[flow_id] = np.array(
+            [link_positions.setdefault(str(link), len(link_positions)) for link in flow["links"]],
+            dtype=np.int64,
+        )
+        k = flow["collective"]
+        remaining_works[k] = remaining_works.get(k, 0) + flow_parts[flow_id]
+    next_free_times = np.ones(len(link_positions), dtype=np.int64)
+
+    def earliest_start(flow_id, ready_time):
+        links = flow_links[flow_id]
+        if not len(links):
+            return ready_time
+        return max(ready_time, int(next_free_times[links].max()))
+
+    # The ready flows, keyed by (earliest start, remaining collective work, position),
+    # where the entries with an older work of their collective are stale
+    ready_heap = []
+    ready_times = {}
+    ready_flows = {}
+    for (k, n), order in dependency_order.items():
+        if order:
+            ready_times[order[0]] = 1
+            ready_flows.setdefault(k, set()).add(order[0])
+            ready_heap.append((1, remaining_works[k], flow_positions[order[0]], order[0]))
+    heapq.heapify(ready_heap)
+
+    start_times = {}
+    while ready_heap:
+        start, work, pos, flow_id = heapq.heappop(ready_heap)
+        k = flow_info[flow_id]["collective"]
+        if flow_id in start_times or work != remaining_works[k]:
+            continue
+        current_start = earliest_start(flow_id, ready_times[flow_id])
+        if current_start != start:
+            heapq.heappush(ready_heap, (current_start, work, pos, flow_id))
+            continue
+        num_part = flow_parts[flow_id]
+        start_times[flow_id] = start
+        next_free_times[flow_links[flow_id]] = start + num_part
+        ready_flows[k].discard(flow_id)
+
+        # The next flow in the dependency order is ready once this flow is done
+        flow = flow_info[flow_id]
+        order = dependency_order[(flow["collective"], flow["group"])]
+        next_order = fid_to_order_dict[flow_id]
+        next_flow_ids = []
+        if next_order < len(order):
+            next_flow_id = order[next_order]
+            ready_times[next_flow_id] = start + num_part
+            ready_flows[k].add(next_flow_id)
+            next_flow_ids = [next_flow_id]
+        if num_part:
+            # Key the ready flows of the collective by its new remaining work
+            remaining_works[k] -= num_part
+            next_flow_ids = ready_flows[k]
+        for next_flow_id in next_flow_ids:
+            heapq.heappush(
+                ready_heap,
+                (
+                    earliest_start(next_flow_id, ready_times[next_flow_id]),
+                    remaining_works[k],
+                    flow_positions[next_flow_id],
+                    next_flow_id,
+                ),
+            )
+
+    return start_times
+
+
+def get_schedule_objective(flow_info, flow_parts, start_times):
+    """Get sum(T_k) of a schedule, where T_k is the time we send the last part of collective k."""
+    completion_times = {}
+    for flow_id, flow in flow_info.items():
+        k = flow["collective"]
+        finish = start_times[flow_id] + flow_parts[flow_id] - 1
+        completion_times[k] = max(completion_times.get(k, 0), finish)
+    return sum(completion_times.values())
+
+
+def get_flow_chunk_schedule(flow_info, fid_to_order_dict, flow_parts, start_times):
+    """Collect the arriving time of each part of the flows into the columns of the schedule."""
+    flow_ids = list(flow_info)
+    flows = flow_info.values()
+    return get_chunk_schedule(
+        flow_ids,
+        [flow["collective"] for flow in flows],
+        [flow["group"] for flow in flows],
+        [flow["source"] for flow in flows],
+        [flow["dest"] for flow in flows],
+        [fid_to_order_dict[flow_id] for flow_id in flow_ids],
+        [flow_parts[flow_id] for flow_id in flow_ids],
+        [start_times[flow_id] for flow_id in flow_ids],
+    )
+
+
+def flow_chunk_list_scheduling(
+    flow_info, link_cap, dependency_order, fid_to_order_dict, opt_config=None
+):
+    """
+    Schedule the parts of each flow by the greedy list scheduler.
+
+    :return objective_value: The average completion time of the collectives.
+    :return time_cost: The time cost of the scheduling.
+    """
+    start_time = time.time()
+    logging.info('**** Start Flow Chunk List Scheduling ****')
+    opt_config = {} if opt_config is None else opt_config
+    last_key = next(reversed(flow_info))
+    K = flow_info[last_key]['collective']
+
+    flow_parts = get_flow_parts(flow_info, link_cap)
+    start_times = list_schedule(flow_info, flow_parts, dependency_order, fid_to_order_dict)
+
+    report_chunk_schedule(
+        get_flow_chunk_schedule(flow_info, fid_to_order_dict, flow_parts, start_times), opt_config
+    )
+    objective_value = get_schedule_objective(flow_info, flow_parts, start_times) / K
+    end_time = time.time()
+    time_cost = end_time - start_time
+    logging.info(f"Solver status: heuristic, objective value: {objective_value}, time cost: {time_cost}")
+    return objective_value, time_cost
@@ -0,0 +1,95 @@
+"""
+The accounting of the memory of the phases of the methods, and the guard of
+a memory budget.
+
+The peak resident memory (RSS) of a phase is read from the high-water mark
+of the process, which is reset at the start of each phase on Linux. On the
+other systems, it is the peak of the process so far. The peak of the memory
+allocated by Python, e.g. the pulp and cvxpy models, is given by tracemalloc.
+
+With a budget set by `set_memory_budget`, the heavy phases, e.g. the dense
+matrices of the parsing, the pulp model and the grid search of the OR, check
+the memory they are about to allocate and raise a `MemoryBudgetError`
+instead of getting the process killed by the OOM killer.
+"""
+
+import os
+import re
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# The memory budget (MB) of the current process, None for no budget
+_budget_mb = None
+
+MB = 1024 * 1024
+
+
+class MemoryBudgetError(MemoryError):
+    """A phase would exceed the memory budget."""
+
+
+def set_memory_budget(budget_mb: float = None):
+    """Set the memory budget (MB) of the current process, None for no budget."""
+    global _budget_mb
+    _budget_mb = None if budget_mb is None else float(budget_mb)
+
+
+def get_memory_budget() -> float:
+    """Get the memory budget (MB) of the current process, None for no budget."""
+    return _budget_mb
+
+
+def get_rss() -> float:
+    """Get the resident memory (MB) of the current process, if available."""
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / MB
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_peak_rss() -> float:
+    """Get the peak resident memory (MB) of the current process since its last reset."""
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            matched = re.search(r"VmHWM:\s+(\d+) kB", f.read())
+        if matched is not None:
+            return int(matched.group(1)) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak resident memory of the current process, where supported."""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def check_memory_budget(phase: str, n_bytes: float = 0):
+    """
+    Check that the phase, allocating about n_bytes more, stays within the
+    memory budget, which does nothing without a budget.
+
+    :raise MemoryBudgetError: The memory in use and the n_bytes exceed the budget.
+    """
+    if _budget_mb is None:
+        return
+    in_use = get_rss() or 0.0
+    needed = n_bytes / MB
+    if in_use + needed > _budget_mb:
+        raise MemoryBudgetError(
+            f"The phase {phase} would exceed the memory budget of {_budget_mb:.0f} MB, "
+            f"with {in_use:.0f} MB in use and about {needed:.0f} MB more to allocate. "
+            "Raise `memory_budget` of the optimization config or use a smaller config."
+        )
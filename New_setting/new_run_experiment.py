@@ -13,6 +13,10 @@ import numpy as np
 from new_setting import *
 from stellar import perform_steller
 from optimized_flow_chunk_competitor import flow_chunk_optimization
+from cpsat_flow_chunk import flow_chunk_cpsat_optimization
+from list_scheduling import flow_chunk_list_scheduling, get_flow_parts, list_schedule
+from rolling_horizon import flow_chunk_rolling_horizon
+from results_store import append_result
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
 
@@ -50,6 +54,26 @@ def _main():
         required=True,
         help="Method used to optimize the flow rates",
     )
+    parser.add_argument(
+        "-o",
+        "--optconfig",
+        type=str,
+        default=None,
+        help="Path to the optional config file for the optimization",
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Do not display the arriving time of each part of the flows",
+    )
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=str,
+        default=None,
+        help="Path to the results store, <results>/results.db by default",
+    )
 
     # Get the directory of the current script
     script_path = os.path.abspath(__file__)
@@ -61,28 +85,55 @@ def _main():
     result_path = args.results
     proj_name = args.project
     config_name = args.config
-    # optconfig_name = args.optconfig
+    optconfig_name = args.optconfig
     method_name = args.method
 
     # Extract the basic settings
     config_folder_path = os.path.join(base_path, config_foldername)
-    optconfig_path = os.path.join(base_path, config_foldername) #, optconfig_name)
     info = extract_information(config_folder_path, config_name)
+    opt_config = dict()
+    if optconfig_name is not None:
+        opt_config = extract_information(config_folder_path, optconfig_name)
 
     flow_info = get_flow_info(info) # flow info in the order of each flow
     link_cap = info.get("link_capacities") # link capacities
-    dependency_order = get_dependency_order(flow_info) # dep orders, e.g. {(1, 1): ['1'], (1, 2): ['3', '2'], (2, 3): ['4']}
+    dependency_order = get_dependency_order(flow_info) # dep orders, e.g. {(1, 1): ['1'], (1, 2): ['2', '3'], (2, 3): ['4']}
     fid_to_order_dict = fid_to_order(dependency_order)
 
     project_path = os.path.join(result_path, proj_name, method_name)
     os.makedirs(project_path, exist_ok = True)  #./new/toyExample/flowChunk
+    # The schedule is saved next to the result
+    opt_config["model_path"] = project_path
+    if args.quiet:
+        opt_config["quiet"] = True
 
-    if method_name == "flowChunk":
-        result = flow_chunk_optimization(flow_info, link_cap, dependency_order, fid_to_order_dict)
+    # The schedule of the list scheduler as the start of the exact methods
+    start_times = None
+    if opt_config.get("warm_start", False) in (True, "True", "true"):
+        flow_parts = get_flow_parts(flow_info, link_cap)
+        start_times = list_schedule(flow_info, flow_parts, dependency_order, fid_to_order_dict)
+
+    if method_name == "flowChunk" and "rolling_window" in opt_config:
+        result = flow_chunk_rolling_horizon(flow_info, link_cap, dependency_order, fid_to_order_dict, opt_config)
+    elif method_name == "flowChunk":
+        result = flow_chunk_optimization(flow_info, link_cap, dependency_order, fid_to_order_dict, opt_config, start_times)
+    elif method_name == "flowChunkCPSAT":
+        result = flow_chunk_cpsat_optimization(flow_info, link_cap, dependency_order, fid_to_order_dict, opt_config, start_times)
+    elif method_name == "flowChunkList":
+        result = flow_chunk_list_scheduling(flow_info, link_cap, dependency_order, fid_to_order_dict, opt_config)
 
     output_file = os.path.join(project_path, "result.json")
     with open(output_file, "w", encoding="utf-8") as f:
         json.dump(result, f, indent=4)
+    objective_value, time_cost = result
+    append_result(
+        args.database or os.path.join(result_path, "results.db"),
+        os.path.join(config_folder_path, config_name),
+        method_name,
+        opt_config,
+        time_cost,
+        objective_value,
+    )
 
     logging.info("%s %s Done.", "*" * 15, proj_name)
 
@@ -25,71 +25,59 @@ def get_flow_info(info):
         flow_info.get(flow)['dest'] = info.get(flow)['dst']
         flow_info.get(flow)['data_size'] = info.get(flow)['total']/1024/1024/8
         flow_info.get(flow)['links'] = set(info.get(flow)['links'])
+        flow_info.get(flow)['dependencies'] = [str(dep) for dep in info.get(flow).get('dependencies', [])]
     return flow_info
 
-def dfs(current_flow, visited, graph, order):
-    if current_flow in visited:
-        return
-    visited.add(current_flow)
-    for depenency in graph[current_flow]:
-        dfs(depenency, visited, graph, order)
-    order.append(current_flow)
-    return order
-
 def get_dependency_order(flow_info):
     """
-    Get each flow group's dependency order
-    output -> {(1,1): ['1'], (1,2): ['3','2'], (2,3): ['4']}
+    Get each flow group's dependency order, where each flow is after the
+    flows of its group that it depends on.
+    output -> {(1,1): ['1'], (1,2): ['2','3'], (2,3): ['4']}
+
+    The order is built by Kahn's algorithm: the flows without pending
+    dependencies are sent first, in the order of the config, which takes
+    O(F + dependencies) time without recursion.
     """
-    groups = defaultdict(dict)
+    groups = defaultdict(list)
     for flow_id, flow in flow_info.items():
-        groups[(flow["collective"], flow["group"])][flow_id] = flow
+        groups[(flow["collective"], flow["group"])].append(flow_id)
 
     dependency_orders = {}
-    # key: (collective, group) value: flows
-    for group_key, flows in groups.items(): # e.g. (k=1, n=2), {'1': {'collective': 1, 'group': 1, 'source': 1, 'dest': 10, 'data_size': 150.0, 'links': {1, 2, 3, 4}, 'dependency_order': []}})
-        # Construct graph
-        graph = {flow_id: [] for flow_id in flows}
-        for flow_id, flow in flows.items():
-            for dep in flow.get("dependency_order", []):
-                # print("222: ", flow_id, dep)
-                dep_str = str(dep)  # keep the keys as the same type
-                if dep_str in flows:
-                    graph[flow_id].append(dep_str) # ex_graph = {'2': ['4'], '3': ['5'], '4': ['3'], '5': []}
-        visited = set()
+    # key: (collective, group) value: flow ids
+    for group_key, flow_ids in groups.items():
+        # Construct graph, e.g. {'2': ['3'], '3': []} when flow 3 depends on flow 2
+        dependents = {flow_id: [] for flow_id in flow_ids}
+        n_waitings = dict.fromkeys(flow_ids, 0)
+        for flow_id in flow_ids:
+            for dep in flow_info[flow_id].get("dependencies", []):
+                if dep in dependents:
+                    dependents[dep].append(flow_id)
+                    n_waitings[flow_id] += 1
+        ready = deque(flow_id for flow_id in flow_ids if not n_waitings[flow_id])
         order = []
-        for flow in graph:
-            if flow not in visited:
-                dfs(flow, visited, graph, order)
-        dependency_orders[group_key] = order[::-1]
+        while ready:
+            flow_id = ready.popleft()
+            order.append(flow_id)
+            for next_flow_id in dependents[flow_id]:
+                n_waitings[next_flow_id] -= 1
+                if not n_waitings[next_flow_id]:
+                    ready.append(next_flow_id)
+        if len(order) < len(flow_ids):
+            raise ValueError(
+                f"The dependencies of the flows in group {group_key} form a cycle, "
+                f"flows in or after the cycle: {[fid for fid in flow_ids if n_waitings[fid]]}"
+            )
+        dependency_orders[group_key] = order
 
     return dependency_orders
 
 def fid_to_order(dependency_orders):
     """
-    input -> {(1,1): ['1'], (1,2): ['3','2'], (2,3): ['4']}
-    output -> {'1': 1, '2': 2, '3': 1, '4': 1}
+    input -> {(1,1): ['1'], (1,2): ['2','3'], (2,3): ['4']}
+    output -> {'1': 1, '2': 1, '3': 2, '4': 1}
     """
-    dep = {}
-    for key, values in dependency_orders.items():
-        for flow in values:
-            dep.setdefault(flow, []).append(values.index(flow) + 1)
-    return dep
-
-            
-
-
-
-
-
-
-# visited = set()
-# order = []
-# dependency_orders = {}
-
-# ex_graph = {'2': ['4'], '3': ['5'], '4': ['3'], '5': []}
-# for u in ex_graph:
-#     if u not in visited:
-#         dfs(u, visited, ex_graph, order)
-# dependency_orders = order[::-1]
-# print(dependency_orders)
+    return {
+        flow: position
+        for values in dependency_orders.values()
+        for position, flow in enumerate(values, start=1)
+    }
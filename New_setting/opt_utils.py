@@ -4,7 +4,14 @@ Implemented utility functions for optimization.
 
 import numpy as np
 
-from generic import CollectiveGroupContainer
+from generic import (
+    BaseContainer,
+    FlowLinkSendHolder,
+    CollectiveGroupContainer,
+    FlowCGHolder,
+    ProblemIndex,
+    DependencyIndex,
+)
 
 
 def get_group_flows(
@@ -24,6 +31,255 @@ def get_group_flows(
     return flow_indexes
 
 
+def get_flow_group_indexes(
+    fcg_matrix: np.ndarray, cg_container: CollectiveGroupContainer
+) -> np.ndarray:
+    """
+    Get the flattened group index of each flow, where the n-th group of the
+    k-th collective has the index sum(Nks[:k]) + n.
+    """
+    offsets = np.concatenate(([0], np.cumsum(cg_container.Nks)))
+    coll_idxes = np.searchsorted(cg_container.collective_ids, fcg_matrix[:, 0])
+    group_idxes = np.zeros(len(fcg_matrix), dtype=int)
+    for k in range(cg_container.K):
+        is_collective = coll_idxes == k
+        group_idxes[is_collective] = offsets[k] + np.searchsorted(
+            cg_container.group_ids[k], fcg_matrix[is_collective, 1]
+        )
+    return group_idxes
+
+
+def compute_group_link_data(
+    data_matrix: np.ndarray, flow_group_idxes: np.ndarray, N: int
+):
+    """
+    Compute the per-group statistics of the data sent on each link.
+
+    :return volumes: [N, E], the v^{k,n}_e of each flattened group.
+    :return counts: [N, E], the number of flows of the group sending data on the link.
+    :return min_datas: [N, E], the minimum data of these flows, inf if there is none.
+    :return max_datas: [N, E], the maximum data of these flows, -inf if there is none.
+    """
+    E = data_matrix.shape[1]
+    is_sent = data_matrix > 0
+    volumes = np.zeros((N, E))
+    counts = np.zeros((N, E), dtype=int)
+    min_datas = np.full((N, E), np.inf)
+    max_datas = np.full((N, E), -np.inf)
+    np.add.at(volumes, flow_group_idxes, data_matrix)
+    np.add.at(counts, flow_group_idxes, is_sent)
+    np.minimum.at(min_datas, flow_group_idxes, np.where(is_sent, data_matrix, np.inf))
+    np.maximum.at(
+        max_datas, flow_group_idxes, np.where(is_sent, data_matrix, -np.inf)
+    )
+    return volumes, counts, min_datas, max_datas
+
+
+def create_adjacency_lists(matrix: np.ndarray):
+    """
+    Create the adjacency lists of the non-zero entries of each row of the matrix
+    in the CSR form, i.e., the columns of the row i are indices[indptr[i]:indptr[i+1]].
+    """
+    rows, cols = np.nonzero(matrix)
+    indptr = np.concatenate(
+        ([0], np.cumsum(np.bincount(rows, minlength=matrix.shape[0])))
+    )
+    return indptr, cols
+
+
+def create_dependency_lists(dependency_pairs, n_flows: int):
+    """
+    Create the flows that each flow depends on in the CSR form, from the
+    pairs (i, j) where flow j depends on flow i.
+    """
+    pairs = np.asarray(dependency_pairs, dtype=np.int64).reshape(-1, 2)
+    pairs = pairs[np.argsort(pairs[:, 1], kind="stable")]
+    indptr = np.concatenate(
+        ([0], np.cumsum(np.bincount(pairs[:, 1], minlength=n_flows)))
+    )
+    return indptr, pairs[:, 0]
+
+
+def get_flow_dependencies(flow_container: BaseContainer):
+    """Get the flows that each flow depends on, in the CSR form."""
+    flow_positions = {
+        flow_id: pos for pos, flow_id in enumerate(flow_container.item_ids)
+    }
+    dependencies = [
+        [flow_positions[flow_id] for flow_id in flow.dependent_flow_ids]
+        for flow in flow_container.item_objs
+    ]
+    indptr = np.concatenate(([0], np.cumsum([len(deps) for deps in dependencies])))
+    indices = np.array([pos for deps in dependencies for pos in deps], dtype=np.int64)
+    return indptr, indices
+
+
+def get_topological_levels(dependency_indptr: np.ndarray, dependency_indices: np.ndarray):
+    """
+    Get the topological level of each flow by Kahn's algorithm, where the
+    flows without dependencies are of the level 0.
+
+    :return flow_levels: The level of each flow, with shape [F].
+    :return level_indptr, level_flows: The flows of each level in the CSR form,
+     in the order of the flows within each level.
+    """
+    n_flows = len(dependency_indptr) - 1
+    n_waitings = np.diff(dependency_indptr).tolist()
+    dependents = [[] for _ in range(n_flows)]
+    for flow, dep in zip(
+        np.repeat(np.arange(n_flows), np.diff(dependency_indptr)).tolist(),
+        dependency_indices.tolist(),
+    ):
+        dependents[dep].append(flow)
+
+    flow_levels = [0] * n_flows
+    topo_order = [flow for flow in range(n_flows) if not n_waitings[flow]]
+    for flow in topo_order:
+        for next_flow in dependents[flow]:
+            flow_levels[next_flow] = max(flow_levels[next_flow], flow_levels[flow] + 1)
+            n_waitings[next_flow] -= 1
+            if not n_waitings[next_flow]:
+                topo_order.append(next_flow)
+    if len(topo_order) < n_flows:
+        raise ValueError(
+            "The dependencies of the flows form a cycle, flows in or after the cycle: "
+            f"{[flow for flow in range(n_flows) if n_waitings[flow]]}"
+        )
+
+    flow_levels = np.array(flow_levels, dtype=np.int64)
+    level_flows = np.argsort(flow_levels, kind="stable")
+    level_indptr = np.concatenate(
+        ([0], np.cumsum(np.bincount(flow_levels, minlength=1)))
+    )
+    return flow_levels, level_indptr, level_flows
+
+
+def create_dependency_index(
+    dependency_indptr: np.ndarray,
+    dependency_indices: np.ndarray,
+    flow_datas: np.ndarray,
+    flow_group_idxes: np.ndarray,
+    N: int,
+) -> DependencyIndex:
+    """Creating the index of the dependency DAG of the flows."""
+    flow_levels, level_indptr, level_flows = get_topological_levels(
+        dependency_indptr, dependency_indices
+    )
+    dependency_index = DependencyIndex(
+        dependency_indptr=np.asarray(dependency_indptr, dtype=np.int64),
+        dependency_indices=np.asarray(dependency_indices, dtype=np.int64),
+        flow_levels=flow_levels,
+        level_indptr=level_indptr,
+        level_flows=level_flows,
+    )
+    flow_critical_volumes = dependency_index.critical_paths(flow_datas)
+    group_depths = np.zeros(N, dtype=np.int64)
+    np.maximum.at(group_depths, flow_group_idxes, flow_levels + 1)
+    group_critical_volumes = np.zeros(N)
+    np.maximum.at(group_critical_volumes, flow_group_idxes, flow_critical_volumes)
+
+    dependency_index.flow_critical_volumes = flow_critical_volumes
+    dependency_index.group_depths = group_depths
+    dependency_index.group_critical_volumes = group_critical_volumes
+    return dependency_index
+
+
+def get_group_lower_bounds(
+    dependency_index: DependencyIndex,
+    flow_times: np.ndarray,
+    flow_group_idxes: np.ndarray,
+    flow_link_indptr: np.ndarray,
+    flow_link_indices: np.ndarray,
+    N: int,
+    flow_offsets: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Get the lower bound of the completion time of each group, given the
+    shortest time to send each flow, e.g. its data over its bottleneck capacity.
+
+    A group is not done before its heaviest dependency chain is sent one flow
+    after another, nor before all its flows sharing a link are sent through it.
+
+    :param flow_offsets: The optional time each flow can not start before.
+    :return lower_bounds: The lower bound of each group, with shape [N].
+    """
+    flow_times = np.asarray(flow_times, dtype=float)
+    lower_bounds = np.zeros(N)
+    np.maximum.at(
+        lower_bounds,
+        flow_group_idxes,
+        dependency_index.critical_paths(flow_times, flow_offsets),
+    )
+
+    # The time of the flows of each group on each link
+    n_links = np.diff(flow_link_indptr)
+    entry_flows = np.repeat(np.arange(len(flow_times)), n_links)
+    E = int(flow_link_indices.max()) + 1 if len(flow_link_indices) else 1
+    codes, inverse = np.unique(
+        flow_group_idxes[entry_flows] * E + flow_link_indices, return_inverse=True
+    )
+    link_times = np.bincount(inverse, weights=flow_times[entry_flows])
+    np.maximum.at(lower_bounds, codes // E, link_times)
+    return lower_bounds
+
+
+def create_problem_index(
+    flow_container: BaseContainer,
+    link_container: BaseContainer,
+    fl_s_holder: FlowLinkSendHolder,
+    cg_container: CollectiveGroupContainer,
+    fcg_holder: FlowCGHolder,
+) -> ProblemIndex:
+    """Creating the index of the arrays shared by all methods."""
+    N = cg_container.N
+    fl_matrix = fl_s_holder.fl_holder.matrix
+
+    flow_datas = np.array([flow.data_volume for flow in flow_container.item_objs])
+    flow_group_idxes = get_flow_group_indexes(fcg_holder.matrix, cg_container)
+    capacity_matrix = np.where(
+        fl_s_holder.capacity_matrix != 0, fl_s_holder.capacity_matrix, np.inf
+    )
+    flow_bottleneck_capacities = capacity_matrix.min(axis=1, initial=np.inf)
+
+    group_flow_indices = np.argsort(flow_group_idxes, kind="stable")
+    group_flow_indptr = np.concatenate(
+        ([0], np.cumsum(np.bincount(flow_group_idxes, minlength=N)))
+    )
+    group_datas = np.zeros(N)
+    np.add.at(group_datas, flow_group_idxes, flow_datas)
+
+    volumes, counts, min_datas, max_datas = compute_group_link_data(
+        fl_s_holder.data_matrix, flow_group_idxes, N
+    )
+    passed_links = np.zeros(volumes.shape, dtype=int)
+    np.add.at(passed_links, flow_group_idxes, fl_matrix)
+    group_link_indptr, group_link_indices = create_adjacency_lists(passed_links)
+    link_group_indptr, link_group_indices = create_adjacency_lists(passed_links.T)
+
+    return ProblemIndex(
+        flow_datas=flow_datas,
+        flow_group_idxes=flow_group_idxes,
+        flow_bottleneck_capacities=flow_bottleneck_capacities,
+        group_offsets=np.concatenate(([0], np.cumsum(cg_container.Nks))),
+        group_collectives=np.repeat(np.arange(cg_container.K), cg_container.Nks),
+        group_datas=group_datas,
+        group_flow_indptr=group_flow_indptr,
+        group_flow_indices=group_flow_indices,
+        group_link_volumes=volumes,
+        group_link_counts=counts,
+        group_link_min_datas=min_datas,
+        group_link_max_datas=max_datas,
+        group_link_indptr=group_link_indptr,
+        group_link_indices=group_link_indices,
+        link_group_indptr=link_group_indptr,
+        link_group_indices=link_group_indices,
+        link_capacities=np.array([link.capacity for link in link_container.item_objs]),
+        dependency_index=create_dependency_index(
+            *get_flow_dependencies(flow_container), flow_datas, flow_group_idxes, N
+        ),
+    )
+
+
 def v_kne(k, n, e, flow_links, fcg_matrix, cg_container):
     """The v^{k,n}_e defined in Lemma 4 of the paper."""
     return sum(
@@ -32,7 +288,7 @@ def v_kne(k, n, e, flow_links, fcg_matrix, cg_container):
 
 
 def compute_average_completion_time(
-    big_R, fcg_holder, cg_container, flow_datas, K, Nks
+    big_R, fcg_holder, cg_container, flow_datas, K, Nks, problem_index=None
 ):
     """
     Computing the average completion time of the collectives.
@@ -42,11 +298,13 @@ def compute_average_completion_time(
     for k in range(K):
         k_completion_times = list()
         for n in range(Nks[k]):
-            group_flows = get_group_flows(k, n, fcg_holder.matrix, cg_container)
-
-            group_flow_datas = flow_datas[group_flows]
+            if problem_index is not None:
+                group_data = problem_index.group_datas[problem_index.group_index(k, n)]
+            else:
+                group_flows = get_group_flows(k, n, fcg_holder.matrix, cg_container)
+                group_data = sum(flow_datas[group_flows])
             group_rate = big_R[k][n]
-            k_completion_times.append(sum(group_flow_datas) / group_rate)
+            k_completion_times.append(group_data / group_rate)
 
         completion_times.append(k_completion_times)
 
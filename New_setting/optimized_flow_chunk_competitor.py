@@ -11,6 +11,13 @@ import time
 
 from utils import save_alloc_solutions
 from opt_utils import get_group_flows
+from common_utils import (
+    get_conflict_pairs,
+    get_chunk_time_windows,
+    get_chunk_lower_bounds,
+    get_part_schedule,
+    report_chunk_schedule,
+)
 
 def get_bottleneck_link_capacity(link_set, link_cap): 
     """
@@ -24,16 +31,14 @@ def get_bottleneck_link_capacity(link_set, link_cap):
 
 def get_flows_with_same_links(flow_info):  # for a non-concurrent setting
     """
-    Get a dict of the flows that share a same link
+    Get a dict of the flows that share a same link, where each pair of flows is
+    recorded once, under the flow that comes first
     """
+    flow_ids = list(flow_info)
+    pairs = get_conflict_pairs([flow['links'] for flow in flow_info.values()])
     edge_record = {}
-    for idx_i, flow_info_i in flow_info.items():
-        for idx_j, flow_info_j in flow_info.items():
-            if idx_i < idx_j:  # only check once
-                common_links = flow_info_i['links'] & flow_info_j['links']
-                if common_links:
-                    # print(idx_i, idx_j)
-                    edge_record.setdefault(idx_i, []).append(idx_j)
+    for idx_i, idx_j in pairs:
+        edge_record.setdefault(flow_ids[idx_i], []).append(flow_ids[idx_j])
     return edge_record
 
 
@@ -44,16 +49,41 @@ def find_candidate_last_key(x_dict):
     candidate_key = max(x_dict.keys(), key=lambda k: k[6])
     return candidate_key
 
-def flow_chunk_optimization(flow_info, link_cap, dependency_order, fid_to_order_dict):
-    start_time = time.time()
-    logging.info('**** Start Flow Chunk Optimization ****')
-    last_key = next(reversed(flow_info))
-    K = flow_info[last_key]['collective']
-    
-    # Create Variables X(k,n,i,j,o,p)
+def build_flow_chunk_model(
+    flow_info, link_cap, dependency_order, fid_to_order_dict, K, opt_config,
+    release_times=None, busy_intervals=None, upper_bound=None,
+):
+    """
+    Build the variables and constraints of the flow-chunk MILP.
+
+    The flows can be a part of all the flows, e.g. a window of the rolling
+    horizon, where the other flows are already fixed.
+    :param release_times: A dict holding the first time slot that a flow can
+     start at, e.g. after its previous flow which is fixed.
+    :param busy_intervals: A dict holding, for each link, the list of the
+     (first, last) time slots taken by the fixed flows.
+    :param upper_bound: The objective sum(T_k) of a feasible schedule, e.g.
+     by the list scheduler, which tightens the latest finishes of the flows.
+    :return x: A dict of the sending time of each part.
+    :return T: A dict of the helper variable T_k of each collective.
+    :return flow_starts: A dict of the time we send the first part of each flow.
+    :return flow_finishes: A dict of the time we send the last part of each flow.
+    :return constraints: A list of the constraints.
+    """
+    compact = opt_config.get("compact_model", False) in (True, "True", "true")
+    release_times = {} if release_times is None else release_times
+    busy_intervals = {} if busy_intervals is None else busy_intervals
+
+    # Create Variables X(k,n,i,j,o,p), or S(fid) in the compact model
     x = {}
     x_record = {} # for recording each flow's variable
+    flow_starts = {} # the time we send the first part of each flow
+    flow_finishes = {} # the time we send the last part of each flow
     constraints = []
+    T = {} # Construct a set of helper variables (T_k >= The time we send the last part of the flow in collective k)
+    for k_idx in range(K):
+        T[k_idx + 1] = cp.Variable(nonneg=True, name=f"T_k{k_idx + 1}")
+
     for flow_id, flow in flow_info.items():
         # print(flow)
         num_part = math.ceil(flow["data_size"]/get_bottleneck_link_capacity(link_set=flow["links"], link_cap=link_cap))
@@ -61,85 +91,178 @@ def flow_chunk_optimization(flow_info, link_cap, dependency_order, fid_to_order_
         n = flow['group']
         source = flow['source']
         dest = flow['dest']
-        order = fid_to_order_dict[flow_id][0]
+        order = fid_to_order_dict[flow_id]
         # order = depency_order[(k,n)].index(flow_id) + 1
         # print(f"flow:{flow}, order:{order}")
+        x_record[flow_id] = {}
+        if compact:
+            start_var = cp.Variable(nonneg = True, name = f"s_fid_{flow_id}_k{k}_n{n}_i{source}_j{dest}_o{order}")
+            for part in range(1, num_part + 1):
+                key_tuple = (flow_id, k, n, source, dest, order, part)
+                x[key_tuple] = start_var + (part - 1)
+                x_record[flow_id].setdefault(key_tuple, []).append(x[key_tuple])
+            flow_starts[flow_id] = start_var
+            flow_finishes[flow_id] = start_var + (num_part - 1)
+            constraints.append(start_var >= 1) # sending completion constraint (trivial)
+            constraints.append(T[k] >= flow_finishes[flow_id]) # helper for objective function
+            continue
         for part in range(1, num_part + 1):
             x[(flow_id, k, n, source, dest, order, part)] = cp.Variable(nonneg = True, name = f"x_fid_{flow_id}_k{k}_n{n}_i{source}_j{dest}_o{order}_p{part}")
-            if flow_id not in x_record:
-                x_record[flow_id] = {}
             key_tuple = (flow_id, k, n, source, dest, order, part)
             x_record[flow_id].setdefault(key_tuple, []).append(x[(flow_id, k, n, source, dest, order, part)])
             # constraints.append(x[(k, n, source, dest, order, part)] >= 1)
+        flow_starts[flow_id] = x[(flow_id, k, n, source, dest, order, 1)]
+        flow_finishes[flow_id] = x[find_candidate_last_key(x_record[flow_id])]
 
     # Objective function: min sum(T_k), where T_k >=X(k, n, i, j, o, p) for all n, i, j, o, p
-    T = {} # Construct a set of helper variables (T_k >= The time we send the last part of the flow in collective k)
-
-    for k_idx in range(K):
-        T[k_idx + 1] = cp.Variable(nonneg=True, name=f"T_k{k_idx + 1}")
-    current_k, current_n, current_order = 0, 0, 0 # just initialize
-
-    for (fid, k, n, i, j, o, p), x_var in x.items(): # (1 1 1 4 0 0): k, n, i, j, o, t
-        constraints.append(x_var >= 1) # sending completion constraint (trivial)
-        constraints.append(T[k] >= x_var) # helper for objective function
-        # if p == 1:
-        #     current_record = x_var # record x_var at current time
-        if p >= 2:
-            prev_var = x[(fid, k, n, i, j, o, p-1)]
-            constraints.append(x_var == prev_var + 1) # the time we send a larger part should be later than the time we send a previous part：>= or =? must be consecutive(?)
+    if not compact:
+        for (fid, k, n, i, j, o, p), x_var in x.items(): # (1 1 1 4 0 0): k, n, i, j, o, t
+            constraints.append(x_var >= 1) # sending completion constraint (trivial)
+            constraints.append(T[k] >= x_var) # helper for objective function
+            # if p == 1:
+            #     current_record = x_var # record x_var at current time
+            if p >= 2:
+                prev_var = x[(fid, k, n, i, j, o, p-1)]
+                constraints.append(x_var == prev_var + 1) # the time we send a larger part should be later than the time we send a previous part：>= or =? must be consecutive(?)
 
     # Dependency Constraints: first part of the current flow should be later than the last part of the previous flow
+    flow_positions = {flow_id: pos for pos, flow_id in enumerate(flow_info)}
+    dependency_pairs = []
     for flow_id, flow in flow_info.items():
         k = flow['collective']
         n = flow['group']
-        order = fid_to_order_dict[flow_id][0]
+        order = fid_to_order_dict[flow_id]
         # order = depency_order[(k,n)].index(flow_id) + 1
         # flow['dependency_order'] = order
         if order > 1: 
-            k = flow['collective']
-            n = flow['group']
-            source = flow['source']
-            dest = flow['dest']
             prev_flow_id = dependency_order[(k, n)][order - 2] # get id of the last flow based on depency_order
-            candidate_key = find_candidate_last_key(x_record[prev_flow_id]) # find the last part of the flow as a key from the previous flow
-            current_key = (flow_id, k, n, source, dest, order, 1)
-            constraints.append(x[current_key] >= x[candidate_key] + 1)
-
-    # b = [cp.Variable(boolean=True) for _ in range(50)]
-    # M = 1000
-    # count = 0
-    # for fid in edge_record:
-    #     for flow in edge_record[fid]:
-    #         print(f"each flow:{flow}")
-    #         print(x_record[fid][0], x_record[flow][0])
-    #         constraints.append((x_record[fid][0] - x_record[flow][0]) >= 1 - M*(1 - b[count]))
-    #         # print(x_record)
-    #         constraints.append((x_record[fid][0] - x_record[flow][0]) <= -1 + M*b[count])
-    #         count += 1
+            if prev_flow_id in flow_positions:
+                constraints.append(flow_starts[flow_id] >= flow_finishes[prev_flow_id] + 1)
+                dependency_pairs.append((flow_positions[prev_flow_id], flow_positions[flow_id]))
+        if flow_id in release_times:
+            constraints.append(flow_starts[flow_id] >= release_times[flow_id])
 
     # Non-concurrent Constraints
     edge_record = get_flows_with_same_links(flow_info)
-    M = 1000  
+    conflict_pairs = [
+        (flow_positions[fid], flow_positions[other_flow])
+        for fid, other_list in edge_record.items()
+        for other_flow in other_list
+    ]
+    # Big M of each pair: a fixed `big_m` of the opt_config, or the largest gap
+    # between the time windows of the two flows
+    fixed_m = opt_config.get("big_m", None)
+    flow_parts = [len(x_record[flow_id]) for flow_id in flow_info]
+    earliest_starts, latest_finishes = get_chunk_time_windows(
+        flow_parts, dependency_pairs, conflict_pairs
+    )
+    # The windows start after the release times and the fixed flows
+    base_time = max(
+        [1]
+        + list(release_times.values())
+        + [last + 1 for intervals in busy_intervals.values() for _, last in intervals]
+    )
+    for pos, flow_id in enumerate(flow_info):
+        earliest_starts[pos] = max(earliest_starts[pos], release_times.get(flow_id, 1))
+    latest_finishes = latest_finishes + base_time - 1
+
+    # T_k is not below the critical-path bound of the collective, and no
+    # schedule better than the upper bound finishes a collective later than
+    # the upper bound minus the lower bounds of the other collectives
+    lower_bounds = get_chunk_lower_bounds(
+        flow_parts,
+        dependency_pairs,
+        [(flow['collective'], flow['group']) for flow in flow_info.values()],
+        [flow['links'] for flow in flow_info.values()],
+        [release_times.get(flow_id, 1) for flow_id in flow_info],
+    )
+    for k, lower_bound in lower_bounds.items():
+        constraints.append(T[k] >= lower_bound)
+    if upper_bound is not None:
+        total_lower_bound = sum(lower_bounds.values())
+        for pos, flow in enumerate(flow_info.values()):
+            k = flow['collective']
+            latest_finishes[pos] = min(
+                latest_finishes[pos],
+                math.floor(upper_bound - (total_lower_bound - lower_bounds[k]) + 1e-9),
+            )
+    if fixed_m is None:
+        for pos, flow_id in enumerate(flow_info):
+            constraints.append(flow_starts[flow_id] >= earliest_starts[pos])
+            constraints.append(flow_finishes[flow_id] <= latest_finishes[pos])
     for fid, other_list in edge_record.items():
         # find the first part and the last part for flow fid
-        i_keys = list(x_record[fid].keys())
-        i_start_key = min(i_keys, key=lambda k: k[6])
-        i_finish_key = max(i_keys, key=lambda k: k[6])
-        i_start = x[i_start_key]
-        i_finish = x[i_finish_key]
+        i_start = flow_starts[fid]
+        i_finish = flow_finishes[fid]
+        i_pos = flow_positions[fid]
         for other_flow in other_list:
-            j_keys = list(x_record[other_flow].keys())
-            j_start_key = min(j_keys, key=lambda k: k[6])
-            j_finish_key = max(j_keys, key=lambda k: k[6])
-            j_start = x[j_start_key]
-            j_finish = x[j_finish_key]
-            
+            j_start = flow_starts[other_flow]
+            j_finish = flow_finishes[other_flow]
+            j_pos = flow_positions[other_flow]
+            if fixed_m is None:
+                M_ij = int(latest_finishes[i_pos] + 1 - earliest_starts[j_pos])
+                M_ji = int(latest_finishes[j_pos] + 1 - earliest_starts[i_pos])
+            else:
+                M_ij = M_ji = float(fixed_m)
+
             # Big M trick
             b = cp.Variable(boolean=True, name=f"order_{fid}_{other_flow}")
             # if y==1，current flow should be sent earlier than other_flow，where i_finish + 1 <= j_start
             # if y==0，other flow should be sent earlier than current flow，where j_finish + 1 <= i_start
-            constraints.append(i_finish + 1 <= j_start + M*(1 - b))
-            constraints.append(j_finish + 1 <= i_start + M*b)
+            constraints.append(i_finish + 1 <= j_start + M_ij*(1 - b))
+            constraints.append(j_finish + 1 <= i_start + M_ji*b)
+
+    # Non-concurrent Constraints with the fixed flows
+    for pos, (flow_id, flow) in enumerate(flow_info.items()):
+        fixed_intervals = set()
+        for link in flow["links"]:
+            fixed_intervals.update(busy_intervals.get(str(link), []))
+        for first, last in sorted(fixed_intervals):
+            if last < earliest_starts[pos] or first > latest_finishes[pos]:
+                continue # the windows do not overlap
+            if fixed_m is None:
+                M_1 = int(latest_finishes[pos] + 1 - first)
+                M_2 = int(last + 1 - earliest_starts[pos])
+            else:
+                M_1 = M_2 = float(fixed_m)
+            b = cp.Variable(boolean=True, name=f"order_{flow_id}_fixed_{first}")
+            constraints.append(flow_finishes[flow_id] + 1 <= first + M_1*(1 - b))
+            constraints.append(last + 1 <= flow_starts[flow_id] + M_2*b)
+
+    return x, T, flow_starts, flow_finishes, constraints
+
+
+def flow_chunk_optimization(flow_info, link_cap, dependency_order, fid_to_order_dict, opt_config=None, start_times=None):
+    """
+    Schedule the parts of each flow to minimize the completion time of the collectives.
+
+    As the parts of a flow are sent at consecutive time slots, the per-part
+    variables X(fid,k,n,i,j,o,p) can be collapsed into one start time S(fid)
+    with X(fid,...,p) = S(fid) + p - 1, which is enabled by the `compact_model`
+    of the opt_config. The two models have the same optimum.
+
+    :param start_times: The start time of each flow in a feasible schedule,
+     e.g. by the list scheduler, whose objective is given to HiGHS as the
+     cutoff of the branch and bound and tightens the big M of the pairs.
+    """
+    start_time = time.time()
+    logging.info('**** Start Flow Chunk Optimization ****')
+    opt_config = {} if opt_config is None else opt_config
+    last_key = next(reversed(flow_info))
+    K = flow_info[last_key]['collective']
+    upper_bound = None
+    if start_times is not None:
+        # Any schedule better than the given one has sum(T_k) <= its objective
+        completion_times = {}
+        for flow_id, flow in flow_info.items():
+            num_part = math.ceil(flow["data_size"]/get_bottleneck_link_capacity(link_set=flow["links"], link_cap=link_cap))
+            finish = start_times[flow_id] + num_part - 1
+            completion_times[flow['collective']] = max(completion_times.get(flow['collective'], 0), finish)
+        upper_bound = sum(completion_times.values())
+    x, T, flow_starts, flow_finishes, constraints = build_flow_chunk_model(
+        flow_info, link_cap, dependency_order, fid_to_order_dict, K, opt_config,
+        upper_bound=upper_bound,
+    )
 
     objective = cp.Minimize(cp.sum([T[k] for k in range(1, K+1)])) # minimize the completion time of all collectives
     
@@ -148,14 +271,17 @@ def flow_chunk_optimization(flow_info, link_cap, dependency_order, fid_to_order_
     logging.info("-----> Building MILP for chunk-based scheduling done, start solving...")
     #solver_name = opt_config.get("solver", "HIGHS")  # can change to "CBC"or "GLPK_MI"(?
     # prob.solve(solver=solver_name)
-    prob.solve()
+    if start_times is None:
+        prob.solve()
+    else:
+        prob.solve(solver=cp.HIGHS, objective_bound=upper_bound + 1)
     # print("b values:", [b_i.value for b_i in b])
 
-    if prob.status == cp.OPTIMAL:
-        print("\n========= Var Values =========")
-    for (fid, k, n, i, j, o, p), var in x.items():
-        print((fid, k, n, i, j, o, p))
-        print(f"Flow(k={k}, n={n}, order={o}, part={p}) Arriving time: {var.value:.1f}")
+    report_chunk_schedule(
+        get_part_schedule(list(x), [float(var.value) for var in x.values()]),
+        opt_config,
+        header=prob.status == cp.OPTIMAL,
+    )
     objective_value = prob.value / K
     end_time = time.time()
     time_cost = end_time - start_time
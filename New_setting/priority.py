@@ -3,10 +3,12 @@ Implementation of the optimization of the Theorem 1 of the paper.
 """
 
 import os
+import time
 import logging
 from typing import List
 import math
 
+import numpy as np
 import pulp
 
 from generic import (
@@ -14,9 +16,17 @@ from generic import (
     FlowLinkSendHolder,
     CollectiveGroupContainer,
     FlowCGHolder,
+    ProblemIndex,
 )
 from utils import save_results, save_dict_variables, save_constraints
-from opt_utils import v_kne
+from opt_utils import v_kne, create_adjacency_lists, get_group_lower_bounds
+from tracing import trace
+from memory_utils import check_memory_budget
+
+# The approximate memory (bytes) of a pulp variable and of a term of its
+# expressions, including the temporary lists of the building
+PULP_VARIABLE_BYTES = 1000
+PULP_TERM_BYTES = 150
 
 
 def knl_to_nested(variables, K: int, Nks: int, L: int):
@@ -31,9 +41,23 @@ def knl_to_nested(variables, K: int, Nks: int, L: int):
 
 
 def compute_link_throughput(
-    K: int, Nks: List[int], E: int, fl_s_holder, fcg_holder, cg_container
+    K: int,
+    Nks: List[int],
+    E: int,
+    fl_s_holder,
+    fcg_holder,
+    cg_container,
+    problem_index: ProblemIndex = None,
 ):
     """Compute the throughput of the flow groups."""
+    if problem_index is not None:
+        volumes = problem_index.group_link_volumes
+        return {
+            (k, n, e): volumes[problem_index.group_index(k, n), e]
+            for k in range(K)
+            for n in range(Nks[k])
+            for e in range(E)
+        }
     return {
         (k, n, e): v_kne(
             k,
@@ -55,6 +79,8 @@ def optimize_completion_time(
     cg_container: CollectiveGroupContainer,
     fcg_holder: FlowCGHolder,
     opt_parameters: dict,
+    problem_index: ProblemIndex = None,
+    phase_times: dict = None,
 ):
     """
     Optimizing the completion times of the flow groups.
@@ -67,6 +93,8 @@ def optimize_completion_time(
      the optimization. It has:
      - T: the upper bound of the time slot
      - is_segment: whether use the corollary 1 of the paper to create the time interval.
+    :param phase_times: An optional dict, filled with the time (seconds) to
+     `build` and to `solve` the model.
 
     Note that N = sum_{k}sum_{n} N^k.
 
@@ -75,6 +103,7 @@ def optimize_completion_time(
     :return lambda0:
     """
 
+    build_start = time.time()
     # Set the save path
     save_path = os.path.join(opt_parameters["model_path"], "PriorityOptimization")
     os.makedirs(save_path, exist_ok=True)
@@ -105,6 +134,29 @@ def optimize_completion_time(
     segment_base = opt_parameters["segment_base"]
     is_segment = opt_parameters["is_segment"]
 
+    # The lower bounds of the completion times of groups from the
+    # dependency chains and the link loads, at the bottleneck capacities
+    with trace("op.lower_bounds"):
+        lower_bounds = None
+        if problem_index is not None and problem_index.dependency_index is not None:
+            with np.errstate(divide="ignore"):
+                flow_times = problem_index.flow_datas / problem_index.flow_bottleneck_capacities
+            lower_bounds = get_group_lower_bounds(
+                problem_index.dependency_index,
+                flow_times,
+                problem_index.flow_group_idxes,
+                *create_adjacency_lists(fl_s_holder.fl_holder.matrix),
+                N,
+            )
+            if lower_bounds.max(initial=0) > T:
+                # No group can complete within the horizon otherwise
+                logging.info(
+                    "-----> Extend the horizon T from %s to the largest lower bound %s",
+                    T,
+                    lower_bounds.max(),
+                )
+                T = int(math.ceil(lower_bounds.max()))
+
     # Obtain the time intervals based on corollary 1 of the paper
     # Here T + 1 makes the last interval to be [T, T+1) that is slightly
     # larger than the T.
@@ -131,88 +183,121 @@ def optimize_completion_time(
     logging.info("%s Start building the LP Optimization (OP)", "*" * 15)
 
     # Compute the link throughput
-    link_throughput = compute_link_throughput(
-        K, Nks, E, fl_s_holder, fcg_holder, cg_container
-    )
-
-    # Define LP problem based on Theorem 1 of the paper
-    prob = pulp.LpProblem("Completion Time Minimization Model", pulp.LpMinimize)
+    with trace("op.link_throughput"):
+        link_throughput = compute_link_throughput(
+            K, Nks, E, fl_s_holder, fcg_holder, cg_container, problem_index
+        )
 
-    # Define decision variables based on Eq 12 and 14 of the paper
-    variables = [(k, n, l) for k in range(K) for n in range(Nks[k]) for l in range(L)]
-    c_variables = pulp.LpVariable.dicts(
-        "C",
-        variables,
-        lowBound=0,
-        cat=pulp.const.LpBinary,
-    )
-    lambda0_variables = pulp.LpVariable.dicts(
-        "Lambda0",
-        variables,
-        lowBound=0,
-        cat=pulp.const.LpBinary,
-    )
-    lambda1_variables = pulp.LpVariable.dicts(
-        "Lambda1",
-        variables,
-        lowBound=0,
-        cat=pulp.const.LpBinary,
-    )
-    logging.info(
-        "-----> Defined vars (Lemma 2). C: #%s, Lambda0: #%s, Lambda1: #%s",
-        len(c_variables),
-        len(lambda0_variables),
-        len(lambda1_variables),
+    # The variables and the terms of the objective and constraints, where
+    # the load constraint of a used link and a range sums up the earlier ranges
+    n_variables = 3 * N * L
+    n_used_links = int(np.count_nonzero(fl_s_holder.data_matrix.sum(axis=0)))
+    n_terms = 8 * N * L + n_used_links * N * L * (L + 1) // 2
+    check_memory_budget(
+        "op.build", n_variables * PULP_VARIABLE_BYTES + n_terms * PULP_TERM_BYTES
     )
 
-    # Objective function, Eq. 12 of the paper
-    prob += (
-        pulp.lpDot(
-            pulp.lpSum(
-                [
-                    lambda0_variables[(k, n, l)]
-                    + (N ** big_S[l][0]) * lambda1_variables[(k, n, l)]
-                    for k in range(K)
-                    for n in range(Nks[k])
-                    for l in range(L)
-                ]
+    with trace("op.variables"):
+        # Define LP problem based on Theorem 1 of the paper
+        prob = pulp.LpProblem("Completion Time Minimization Model", pulp.LpMinimize)
+
+        # Define decision variables based on Eq 12 and 14 of the paper
+        variables = [(k, n, l) for k in range(K) for n in range(Nks[k]) for l in range(L)]
+        c_variables = pulp.LpVariable.dicts(
+            "C",
+            variables,
+            lowBound=0,
+            cat=pulp.const.LpBinary,
+        )
+        lambda0_variables = pulp.LpVariable.dicts(
+            "Lambda0",
+            variables,
+            lowBound=0,
+            cat=pulp.const.LpBinary,
+        )
+        lambda1_variables = pulp.LpVariable.dicts(
+            "Lambda1",
+            variables,
+            lowBound=0,
+            cat=pulp.const.LpBinary,
+        )
+        logging.info(
+            "-----> Defined vars (Lemma 2). C: #%s, Lambda0: #%s, Lambda1: #%s",
+            len(c_variables),
+            len(lambda0_variables),
+            len(lambda1_variables),
+        )
+
+    with trace("op.objective"):
+        # Objective function, Eq. 12 of the paper
+        prob += (
+            pulp.lpDot(
+                pulp.lpSum(
+                    [
+                        lambda0_variables[(k, n, l)]
+                        + (N ** big_S[l][0]) * lambda1_variables[(k, n, l)]
+                        for k in range(K)
+                        for n in range(Nks[k])
+                        for l in range(L)
+                    ]
+                ),
+                1 / K,
             ),
-            1 / K,
-        ),
-        "Objective",
-    )
-    logging.info(
-        "-----> Set Objective.",
-    )
+            "Objective",
+        )
+        logging.info(
+            "-----> Set Objective.",
+        )
 
-    # Add constraints, Eq 13 of the paper
-    for k in range(K):
-        for n in range(Nks[k]):
-            for l in range(L):
-                prob += (
-                    c_variables[(k, n, l)] == lambda1_variables[(k, n, l)],
-                    f"c_lambda0_constraint_[{k}, {n}, {l}]",
-                )
+    with trace("op.constraints"):
+        # A group can not complete in the time ranges ending before its lower bound,
+        # whose pruning tightens the OP of the paper, so it is only done on request
+        if lower_bounds is not None and opt_parameters.get("prune_lower_bounds", False) in (
+            True,
+            "True",
+            "true",
+        ):
+            n_pruned = 0
+            for k in range(K):
+                for n in range(Nks[k]):
+                    lower_bound = lower_bounds[problem_index.group_index(k, n)]
+                    for l in range(L):
+                        if big_S[l][1] < lower_bound - 1e-9:
+                            c_variables[(k, n, l)].upBound = 0
+                            n_pruned += 1
+            logging.info(
+                "-----> Pruned the time ranges before the lower bounds: #%s",
+                n_pruned,
+            )
+
+        # Add constraints, Eq 13 of the paper
+        for k in range(K):
+            for n in range(Nks[k]):
+                for l in range(L):
+                    prob += (
+                        c_variables[(k, n, l)] == lambda1_variables[(k, n, l)],
+                        f"c_lambda0_constraint_[{k}, {n}, {l}]",
+                    )
+                    prob += (
+                        lambda0_variables[(k, n, l)] + lambda1_variables[(k, n, l)] == 1,
+                        f"c_lambda1_constraint_[{k}, {n}, {l}]",
+                    )
+        logging.info(
+            "-----> Defined c-lambda constraints. (Eq. 13): #%s",
+            N * L,
+        )
+
+        # Add constraints, Eq 9 of the paper
+        for k in range(K):
+            for n in range(Nks[k]):
                 prob += (
-                    lambda0_variables[(k, n, l)] + lambda1_variables[(k, n, l)] == 1,
-                    f"c_lambda1_constraint_[{k}, {n}, {l}]",
+                    pulp.lpSum([c_variables[(k, n, l)] for l in range(L)]) == 1,
+                    f"c_constraint_({k}, {n})",
                 )
-    logging.info(
-        "-----> Defined c-lambda constraints. (Eq. 13): #%s",
-        N * L,
-    )
-
-    # Add constraints, Eq 9 of the paper
-    for k in range(K):
-        for n in range(Nks[k]):
-            prob += (
-                pulp.lpSum([c_variables[(k, n, l)] for l in range(L)]) == 1,
-                f"c_constraint_({k}, {n})",
-            )
-    logging.info(
-        "-----> Defined single-completion-time constraints (Eq. 9): #%s",
-        N,
-    )
+        logging.info(
+            "-----> Defined single-completion-time constraints (Eq. 9): #%s",
+            N,
+        )
 
     # Add constraints, Eq 8 or Eq 10 of the paper
     # Using Eq 8 or Eq 10 depends on the is_segment
@@ -223,34 +308,41 @@ def optimize_completion_time(
     # u start from 1. Yet, in the real value access, we minus 1 from them to
     # access the correct value.
 
-    for l in range(1, L + 1):
-        for e in range(E):
-            if sum(fl_s_holder.data_matrix[:, e]) != 0:
-                prob += (
-                    pulp.lpSum(
-                        [
-                            c_variables[(k, n, u - 1)] * link_throughput[(k, n, e)]
-                            for k in range(K)
-                            for n in range(Nks[k])
-                            for u in range(1, l + 1)
-                        ]
+    with trace("op.load_constraints"):
+        for l in range(1, L + 1):
+            for e in range(E):
+                if sum(fl_s_holder.data_matrix[:, e]) != 0:
+                    prob += (
+                        pulp.lpSum(
+                            [
+                                c_variables[(k, n, u - 1)] * link_throughput[(k, n, e)]
+                                for k in range(K)
+                                for n in range(Nks[k])
+                                for u in range(1, l + 1)
+                            ]
+                        )
+                        <= big_S[l - 1][1] * link_container.item_obj(e).capacity,
+                        f"load_constraint_({l-1}, {e})",
                     )
-                    <= big_S[l - 1][1] * link_container.item_obj(e).capacity,
-                    f"load_constraint_({l-1}, {e})",
-                )
-    logging.info(
-        "-----> Defined load constraints. (Eq. 8/10): #%s",
-        L * E,
-    )
+        logging.info(
+            "-----> Defined load constraints. (Eq. 8/10): #%s",
+            L * E,
+        )
 
     # Solve problem
     logging.info(
         "%s Start solving the LP Optimization (OP) with pulp",
         "*" * 15,
     )
+    solve_start = time.time()
     # The problem data is written to an .lp file
-    prob.writeLP(os.path.join(save_path, "OptimizationModel.lp"))
-    prob.solve()
+    with trace("op.write_lp"):
+        prob.writeLP(os.path.join(save_path, "OptimizationModel.lp"))
+    with trace("op.solve"):
+        prob.solve()
+    if phase_times is not None:
+        phase_times["build"] = solve_start - build_start
+        phase_times["solve"] = time.time() - solve_start
     logging.info(
         "%s Solved the LP Optimization (OP) with pulp",
         "*" * 15,
@@ -258,74 +350,75 @@ def optimize_completion_time(
     logging.info("-----> Solved with status: %s.", pulp.LpStatus[prob.status])
     logging.info("-----> Solved with objective: %s.", pulp.value(prob.objective))
 
-    save_constraints(os.path.join(save_path, "constraints.json"), prob.constraints)
-    logging.info("!----> Saved constraints.")
-
-    save_dict_variables(os.path.join(save_path, "C_variables.json"), c_variables)
-    save_dict_variables(
-        os.path.join(save_path, "lambda0_variables.json"), lambda0_variables
-    )
-    save_dict_variables(
-        os.path.join(save_path, "lambda1_variables.json"), lambda1_variables
-    )
-    logging.info("!----> Saved variables.")
-
-    # Convert the flatten variables to a nested list that are
-    # easy to be accessed by using k, n, l
-    # Extract the optimized variables
+    with trace("op.extract"):
+        save_constraints(os.path.join(save_path, "constraints.json"), prob.constraints)
+        logging.info("!----> Saved constraints.")
 
-    big_C = knl_to_nested(c_variables, K, Nks, L)
-    lambda0 = knl_to_nested(lambda0_variables, K, Nks, L)
-    lambda1 = knl_to_nested(lambda1_variables, K, Nks, L)
+        save_dict_variables(os.path.join(save_path, "C_variables.json"), c_variables)
+        save_dict_variables(
+            os.path.join(save_path, "lambda0_variables.json"), lambda0_variables
+        )
+        save_dict_variables(
+            os.path.join(save_path, "lambda1_variables.json"), lambda1_variables
+        )
+        logging.info("!----> Saved variables.")
 
-    save_results(
-        os.path.join(save_path, "kn_C_variables.json"),
-        [f"collective {k}" for k in range(1, K + 1)],
-        big_C,
-    )
-    save_results(
-        os.path.join(save_path, "kn_lambda0_variables.json"),
-        [f"collective {k}" for k in range(1, K + 1)],
-        lambda0,
-    )
-    save_results(
-        os.path.join(save_path, "kn_lambda1_variables.json"),
-        [f"collective {k}" for k in range(1, K + 1)],
-        lambda1,
-    )
-    logging.info("!----> Saved formatted variables.")
+        # Convert the flatten variables to a nested list that are
+        # easy to be accessed by using k, n, l
+        # Extract the optimized variables
 
-    # Convert the big_C from R^+ to the specific completion time
-    # We use the maximum value of big_C' each group to determine the range
-    big_C_S = list()
-    for k in range(K):
-        big_C_S.append([big_C[k][n].index(max(big_C[k][n])) for n in range(Nks[k])])
-    save_results(
-        os.path.join(save_path, "kn_big_C_S.json"),
-        [f"collective {k}" for k in range(1, K + 1)],
-        big_C_S,
-    )
-    logging.info("!----> Saved optimized intervals.")
-    # Compute the completion times of flow groups
-    big_tau = list()
-    for k in range(K):
-        group_intervals = big_C_S[k]
-        taus = [big_S[group_intervals[n]][1] for n in range(Nks[k])]
-        big_tau.append(taus)
+        big_C = knl_to_nested(c_variables, K, Nks, L)
+        lambda0 = knl_to_nested(lambda0_variables, K, Nks, L)
+        lambda1 = knl_to_nested(lambda1_variables, K, Nks, L)
 
-    save_results(
-        os.path.join(save_path, "big_tau.json"),
-        [f"collective {k}" for k in range(1, K + 1)],
-        big_tau,
-    )
-    logging.info("!----> Saved optimized big tau.")
-    # constraints = prob.constraints
-    # print(f"The constraints are held in a {type(constraints)}")
-
-    # for name in constraints.keys():
-    #     value = constraints.get(name).value()
-    #     slack = constraints.get(name).slack
-    #     print(f"constraint {name} has value: {value:0.2e} and slack: {slack:0.2e}")
+        save_results(
+            os.path.join(save_path, "kn_C_variables.json"),
+            [f"collective {k}" for k in range(1, K + 1)],
+            big_C,
+        )
+        save_results(
+            os.path.join(save_path, "kn_lambda0_variables.json"),
+            [f"collective {k}" for k in range(1, K + 1)],
+            lambda0,
+        )
+        save_results(
+            os.path.join(save_path, "kn_lambda1_variables.json"),
+            [f"collective {k}" for k in range(1, K + 1)],
+            lambda1,
+        )
+        logging.info("!----> Saved formatted variables.")
+
+        # Convert the big_C from R^+ to the specific completion time
+        # We use the maximum value of big_C' each group to determine the range
+        big_C_S = list()
+        for k in range(K):
+            big_C_S.append([big_C[k][n].index(max(big_C[k][n])) for n in range(Nks[k])])
+        save_results(
+            os.path.join(save_path, "kn_big_C_S.json"),
+            [f"collective {k}" for k in range(1, K + 1)],
+            big_C_S,
+        )
+        logging.info("!----> Saved optimized intervals.")
+        # Compute the completion times of flow groups
+        big_tau = list()
+        for k in range(K):
+            group_intervals = big_C_S[k]
+            taus = [big_S[group_intervals[n]][1] for n in range(Nks[k])]
+            big_tau.append(taus)
+
+        save_results(
+            os.path.join(save_path, "big_tau.json"),
+            [f"collective {k}" for k in range(1, K + 1)],
+            big_tau,
+        )
+        logging.info("!----> Saved optimized big tau.")
+        # constraints = prob.constraints
+        # print(f"The constraints are held in a {type(constraints)}")
+
+        # for name in constraints.keys():
+        #     value = constraints.get(name).value()
+        #     slack = constraints.get(name).slack
+        #     print(f"constraint {name} has value: {value:0.2e} and slack: {slack:0.2e}")
 
     return (
         big_S,
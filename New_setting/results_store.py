@@ -0,0 +1,256 @@
+"""
+A SQLite store of the results of the experiments, shared by the drivers and
+the plot scripts.
+
+Each run of a method on a config appends one row, in its own transaction, so
+that the workers of a sweep can append to the same store concurrently. The
+plot scripts query the store directly, and fall back to the CSV files under
+`results/` when the store does not hold their results.
+"""
+
+import os
+import csv
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+from typing import List
+
+from memory_utils import get_peak_rss
+
+# The columns of the results besides the id, with their SQLite types
+RESULT_COLUMNS = (
+    ("created_at", "REAL"),
+    ("config", "TEXT"),
+    ("config_hash", "TEXT"),
+    ("method", "TEXT"),
+    ("params", "TEXT"),
+    ("objective", "REAL"),
+    ("time_cost", "REAL"),
+    ("op_time", "REAL"),
+    ("or_time", "REAL"),
+    ("peak_memory", "REAL"),
+    ("model_path", "TEXT"),
+)
+
+# The optimization parameters that do not change the results
+IGNORED_PARAMS = (
+    "model_path",
+    "results_db",
+    "quiet",
+    "trace",
+    "profile_memory",
+    "memory_budget",
+    "solution_cache",
+    "solution_cache_mb",
+    "bps_output",
+    "bps_format",
+)
+
+# The column of the time cost CSV files of the plots, given by the method and
+# the column of the results
+TIME_COST_COLUMNS = {
+    "Barrier": ("barrierAwareAlloc", "time_cost"),
+    "Stellar OP": ("steller", "op_time"),
+    "Stellar OR": ("steller", "or_time"),
+    "Data Aware": ("dataAwareAlloc", "time_cost"),
+}
+
+
+def open_results_store(db_path: str) -> sqlite3.Connection:
+    """
+    Open the store, creating its table and indexes if needed.
+
+    The store is in the WAL mode, where the readers do not block the writer,
+    and a writer waits up to 60 seconds for the others to commit.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    columns = ", ".join(f"{name} {sql_type}" for name, sql_type in RESULT_COLUMNS)
+    connection.execute(
+        f"CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY AUTOINCREMENT, {columns})"
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS results_config_method ON results (config_hash, method)"
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS results_method_config ON results (method, config)"
+    )
+    return connection
+
+
+def get_config_hash(config_path: str) -> str:
+    """Get the SHA-256 of the content of a config file."""
+    digest = hashlib.sha256()
+    with open(config_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_params_key(opt_parameters: dict) -> str:
+    """Get the canonical JSON of the optimization parameters changing the results."""
+    return json.dumps(
+        {
+            name: value
+            for name, value in opt_parameters.items()
+            if name not in IGNORED_PARAMS
+        },
+        sort_keys=True,
+        default=str,
+    )
+
+
+def append_result(
+    db_path: str,
+    config_path: str,
+    method_name: str,
+    opt_parameters: dict,
+    time_cost,
+    objective: float = None,
+    peak_memory: float = None,
+):
+    """
+    Append the result of a method on a config to the store in one transaction.
+
+    :param time_cost: The time cost of the method, or a dict holding the
+     `OP-Time` and `OR-Time` of steller.
+    :param objective: The optional average completion time of the collectives.
+    :param peak_memory: The peak resident memory (MB) of the run, by default
+     the peak of the process since its last `memory_utils.reset_peak_rss`,
+     which the workers running several jobs call at the start of each job.
+    """
+    op_time = or_time = None
+    if isinstance(time_cost, dict):
+        op_time = time_cost.get("OP-Time")
+        or_time = time_cost.get("OR-Time")
+        time_cost = sum(time_cost.values())
+    record = {
+        "created_at": time.time(),
+        "config": os.path.basename(config_path),
+        "config_hash": get_config_hash(config_path),
+        "method": method_name,
+        "params": get_params_key(opt_parameters),
+        "objective": None if objective is None else float(objective),
+        "time_cost": float(time_cost),
+        "op_time": op_time,
+        "or_time": or_time,
+        "peak_memory": get_peak_rss() if peak_memory is None else float(peak_memory),
+        "model_path": opt_parameters.get("model_path"),
+    }
+
+    connection = open_results_store(db_path)
+    try:
+        # Take the write lock at once, so the concurrent writers queue up
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                f"INSERT INTO results ({', '.join(record)}) "
+                f"VALUES ({', '.join('?' * len(record))})",
+                list(record.values()),
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+    finally:
+        connection.close()
+
+
+def query_results(
+    db_path: str, method_names: List[str] = None, config_names: List[str] = None
+) -> List[dict]:
+    """
+    Query the latest result of each config, method and optimization
+    parameters in the store.
+
+    :param method_names: The optional methods to query, all by default.
+    :param config_names: The optional file names of the configs to query,
+     all by default.
+    :return results: A list of dicts, one per result, in the order they are appended.
+    """
+    conditions, values = list(), list()
+    for column, names in (("method", method_names), ("config", config_names)):
+        if names is not None:
+            conditions.append(f"{column} IN ({', '.join('?' * len(names))})")
+            values.extend(names)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    connection = open_results_store(db_path)
+    try:
+        connection.row_factory = sqlite3.Row
+        rows = connection.execute(
+            f"SELECT * FROM results WHERE id IN ("
+            f"SELECT MAX(id) FROM results {where} GROUP BY config_hash, method, params"
+            f") ORDER BY id",
+            values,
+        ).fetchall()
+    finally:
+        connection.close()
+    return [dict(row) for row in rows]
+
+
+def _read_csv_table(csv_path: str) -> dict:
+    """Read a CSV file of the results, whose first column holds the labels of the rows."""
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    header, rows = rows[0], rows[1:]
+    table = {header[0] or "label": [row[0] for row in rows]}
+    for col_idx, name in enumerate(header[1:], start=1):
+        table[name] = [float(row[col_idx]) for row in rows]
+    return table
+
+
+def load_time_cost_table(
+    db_path: str,
+    labels: List[str],
+    config_names: List[str],
+    csv_path: str,
+    params: dict = None,
+) -> dict:
+    """
+    Load the time costs of the methods on the configs, in the columns of the
+    time cost CSV files, e.g. `Barrier`, `Stellar OP`, `Stellar OR` and `Data Aware`.
+
+    The table is queried from the store, or read from the CSV file when the
+    store is missing or does not hold all the configs and methods.
+
+    :param labels: The label of each row, e.g. `2-RAR`.
+    :param config_names: The file name of the config of each row.
+    :param params: The optional optimization parameters of the queried
+     results, needed when the store holds the results of a config and
+     method under several parameters.
+    :return table: A dict holding the list of each column, one item per row.
+    """
+    if db_path is not None and os.path.exists(db_path):
+        methods = sorted({method for method, _ in TIME_COST_COLUMNS.values()})
+        params_key = None if params is None else get_params_key(params)
+        latest = dict()
+        params_keys = dict()
+        for result in query_results(db_path, methods, config_names):
+            if params_key is not None and result["params"] != params_key:
+                continue
+            latest[(result["config"], result["method"])] = result
+            params_keys.setdefault((result["config"], result["method"]), set()).add(
+                result["params"]
+            )
+        mixed = sorted(key for key, keys in params_keys.items() if len(keys) > 1)
+        if mixed:
+            raise ValueError(
+                f"{db_path} holds the results of {mixed} under several parameters, "
+                "choose them by params"
+            )
+        if all(
+            (config_name, method) in latest
+            for config_name in config_names
+            for method in methods
+        ):
+            table = {"label": list(labels)}
+            for column, (method, result_column) in TIME_COST_COLUMNS.items():
+                table[column] = [
+                    latest[(config_name, method)][result_column] for config_name in config_names
+                ]
+            return table
+        logging.warning("%s does not hold all the results, reading %s", db_path, csv_path)
+    return _read_csv_table(csv_path)
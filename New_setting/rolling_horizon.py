@@ -0,0 +1,152 @@
+"""
+A rolling-horizon decomposition of the chunk-based scheduling.
+
+The flows whose dependencies can be met inside a time window are scheduled
+by the flow-chunk MILP, with the flows of the previous windows fixed. The
+flows starting before the overlap of the window are then fixed, and the
+window slides to the overlap.
+"""
+
+import time
+import logging
+
+import cvxpy as cp
+
+from optimized_flow_chunk_competitor import build_flow_chunk_model
+from list_scheduling import get_flow_parts, get_schedule_objective, get_flow_chunk_schedule
+from common_utils import report_chunk_schedule
+
+
+def flow_chunk_rolling_horizon(
+    flow_info, link_cap, dependency_order, fid_to_order_dict, opt_config
+):
+    """
+    Schedule the parts of each flow window by window.
+
+    :param opt_config: The `rolling_window` (time slots) and `rolling_overlap`
+     (time slots, 0 by default) of the windows, and the optional `time_limit`
+     (seconds) of HiGHS for each window, besides the options of the
+     flow-chunk MILP.
+    :return objective_value: The average completion time of the collectives.
+    :return time_cost: The time cost of the scheduling.
+    """
+    start_time = time.time()
+    logging.info('**** Start Flow Chunk Optimization with Rolling Horizon ****')
+    window = int(opt_config["rolling_window"])
+    overlap = int(opt_config.get("rolling_overlap", 0))
+    if window <= 0 or not 0 <= overlap < window:
+        raise ValueError(
+            f"Invalid rolling window {window} with overlap {overlap}, "
+            "where 0 <= overlap < window is required."
+        )
+    last_key = next(reversed(flow_info))
+    K = flow_info[last_key]['collective']
+    flow_positions = {flow_id: pos for pos, flow_id in enumerate(flow_info)}
+    flow_parts = get_flow_parts(flow_info, link_cap)
+
+    start_times = {}  # the fixed start time of each flow
+    busy_intervals = {}  # the (first, last) time slots taken on each link
+    completion_times = {k: 0 for k in range(1, K + 1)}
+    next_positions = {group_key: 0 for group_key in dependency_order}  # the first unfixed flow of each group
+    release_times = {order[0]: 1 for order in dependency_order.values() if order}
+    window_start = 1
+    n_windows = 0
+    while len(start_times) < len(flow_info):
+        window_end = window_start + window
+
+        # The flows whose dependencies can be met inside the window
+        window_flow_ids = []
+        for group_key, order in dependency_order.items():
+            position = next_positions[group_key]
+            if position == len(order):
+                continue
+            earliest_start = release_times[order[position]]
+            while position < len(order) and earliest_start < window_end:
+                window_flow_ids.append(order[position])
+                earliest_start += flow_parts[order[position]]
+                position += 1
+        if not window_flow_ids:
+            window_start = min(
+                release_times[order[next_positions[group_key]]]
+                for group_key, order in dependency_order.items()
+                if next_positions[group_key] < len(order)
+            )
+            continue
+        window_flow_ids.sort(key=flow_positions.get)
+        window_flows = {flow_id: flow_info[flow_id] for flow_id in window_flow_ids}
+
+        x, T, flow_starts, flow_finishes, constraints = build_flow_chunk_model(
+            window_flows,
+            link_cap,
+            dependency_order,
+            fid_to_order_dict,
+            K,
+            opt_config,
+            release_times={
+                flow_id: release_times[flow_id]
+                for flow_id in window_flow_ids
+                if flow_id in release_times
+            },
+            busy_intervals=busy_intervals,
+        )
+        for k in range(1, K + 1):
+            constraints.append(T[k] >= completion_times[k])
+        # Besides sum(T_k), send the flows as early as possible, with a weight
+        # that can not trade off one time slot of sum(T_k)
+        horizon = window_end + sum(flow_parts[flow_id] for flow_id in window_flow_ids)
+        tie_weight = 1 / (len(window_flow_ids) * horizon + 1)
+        objective = cp.Minimize(
+            cp.sum([T[k] for k in range(1, K + 1)])
+            + tie_weight * cp.sum([flow_finishes[flow_id] for flow_id in window_flow_ids])
+        )
+        prob = cp.Problem(objective, constraints)
+        if "time_limit" in opt_config:
+            prob.solve(solver=cp.HIGHS, time_limit=float(opt_config["time_limit"]))
+        else:
+            prob.solve()
+        n_windows += 1
+        if any(flow_starts[flow_id].value is None for flow_id in window_flow_ids):
+            raise RuntimeError(
+                f"No schedule found for the window [{window_start}, {window_end}) "
+                f"with solver status {prob.status}."
+            )
+
+        # Fix the flows starting before the overlap, or the first flow
+        window_starts = {
+            flow_id: int(round(float(flow_starts[flow_id].value)))
+            for flow_id in window_flow_ids
+        }
+        fixed_flow_ids = [
+            flow_id for flow_id in window_flow_ids
+            if window_starts[flow_id] < window_end - overlap
+        ]
+        if not fixed_flow_ids:
+            fixed_flow_ids = [min(window_flow_ids, key=window_starts.get)]
+        # In the order of the start times, i.e. the dependency order in each group
+        for flow_id in sorted(fixed_flow_ids, key=window_starts.get):
+            flow = flow_info[flow_id]
+            first = window_starts[flow_id]
+            last = first + flow_parts[flow_id] - 1
+            start_times[flow_id] = first
+            for link in flow["links"]:
+                busy_intervals.setdefault(str(link), []).append((first, last))
+            completion_times[flow["collective"]] = max(completion_times[flow["collective"]], last)
+            group_key = (flow["collective"], flow["group"])
+            order = dependency_order[group_key]
+            next_positions[group_key] += 1
+            if next_positions[group_key] < len(order):
+                release_times[order[next_positions[group_key]]] = last + 1
+        logging.info(
+            "-----> Window [%d, %d): %d flows, %d fixed, solver status: %s",
+            window_start, window_end, len(window_flow_ids), len(fixed_flow_ids), prob.status,
+        )
+        window_start = window_end - overlap
+
+    report_chunk_schedule(
+        get_flow_chunk_schedule(flow_info, fid_to_order_dict, flow_parts, start_times), opt_config
+    )
+    objective_value = get_schedule_objective(flow_info, flow_parts, start_times) / K
+    end_time = time.time()
+    time_cost = end_time - start_time
+    logging.info(f"Solver status: {n_windows} windows, objective value: {objective_value}, time cost: {time_cost}")
+    return objective_value, time_cost
@@ -7,6 +7,7 @@ import json
 import argparse
 import logging
 from typing import List
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 
@@ -17,12 +18,21 @@ from competitors import (
     barrier_aware_allocation,
 )
 
-from generic import BaseContainer, FlowCGHolder, CollectiveGroupContainer
+from generic import BaseContainer, FlowCGHolder, CollectiveGroupContainer, ProblemIndex
 from opt_utils import get_group_flows
+from bps_table import get_flow_bps, save_bps_table, stream_patch_bps
 from flow_chunk_competitor import flow_chunk_optimization
+from simulator import simulate_allocation
+from utils import save_results
+from results_store import append_result
+from tracing import trace, start_tracing, stop_tracing, get_tracer
+from memory_utils import MemoryBudgetError, set_memory_budget, reset_peak_rss
+from shm_utils import share_arrays, attach_arrays, release_arrays, restore_arrays
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
 
+method_factory = ["steller", "barrierAwareAlloc", "dataAwareAlloc", "flowChunk"]
+
 
 def add_bps_config(
     config_path: str,
@@ -32,125 +42,166 @@ def add_bps_config(
     fcg_holder: FlowCGHolder,
     cg_container: CollectiveGroupContainer,
     model_path: str,
+    problem_index: ProblemIndex = None,
+    output: str = "config",
+    fmt: str = "npz",
 ):
-    """Add the bps term (flow rate) to each flow of the config."""
+    """
+    Add the bps term (flow rate) to each flow of the config.
+
+    :param output: "config" to save the config with the bps of each flow,
+     "table" to save only the bps of each flow as a table in the format fmt
+     (see `bps_table.save_bps_table`), or "patch" to save the config patched
+     by streaming it, without loading it.
+    """
     file_path = os.path.join(config_path, filename)
-    with open(file_path, "r", encoding="utf-8") as f:
-        info_data = json.load(f)
-
-    K = cg_container.K
-    Nks = cg_container.Nks
-
-    for k in range(K):
-        for n in range(Nks[k]):
-            bps_mb = optimized_kn_rates[k][n]
-            # bps = bps_mb * 1000000
-            bps = round(bps_mb * 8 * 1024 * 1024)
-            flow_indxes = get_group_flows(k, n, fcg_holder.matrix, cg_container)
-            for idx in flow_indxes:
-                flow_id = flow_container.item_obj(idx).id
-                # Add the flow rate of each flow
-                info_data[flow_id]["bps"] = bps
-
-    # Save the new configuration to the result
     filename = os.path.basename(filename)
     result_path = os.path.join(model_path, f"Optimized-{filename}")
-    with open(result_path, "w", encoding="utf-8") as f:
-        json.dump(info_data, f, indent=4)
+
+    if problem_index is not None:
+        flow_ids, bps = get_flow_bps(optimized_kn_rates, flow_container, problem_index)
+        flow_bps = dict(zip(flow_ids, bps.tolist()))
+    else:
+        flow_bps = dict()
+        for k in range(cg_container.K):
+            for n in range(cg_container.Nks[k]):
+                bps_mb = optimized_kn_rates[k][n]
+                # bps = bps_mb * 1000000
+                bps = round(bps_mb * 8 * 1024 * 1024)
+                flow_indxes = get_group_flows(k, n, fcg_holder.matrix, cg_container)
+                for idx in flow_indxes:
+                    flow_bps[flow_container.item_obj(idx).id] = bps
+
+    if output == "table":
+        result_path = save_bps_table(
+            os.path.splitext(result_path)[0] + ".bps",
+            list(flow_bps),
+            np.fromiter(flow_bps.values(), dtype=np.int64, count=len(flow_bps)),
+            file_path,
+            fmt,
+        )
+    elif output == "patch":
+        stream_patch_bps(file_path, result_path, flow_bps)
+    else:
+        with open(file_path, "r", encoding="utf-8") as f:
+            info_data = json.load(f)
+        for flow_id, bps in flow_bps.items():
+            # Add the flow rate of each flow
+            info_data[flow_id]["bps"] = bps
+        # Save the new configuration to the result
+        with open(result_path, "w", encoding="utf-8") as f:
+            json.dump(info_data, f, indent=4)
 
     logging.info("%sOptimized %s saved at %s", "*" * 15, filename, result_path)
 
 
-def _main():
-    """Run the experiment."""
-    # Extract the parse arguments
-    parser = argparse.ArgumentParser(description="Process some files.")
-    # Define the -b and -c arguments
-    parser.add_argument(
-        "-r", "--results", type=str, required=True, help="Path to results"
-    )
-    parser.add_argument(
-        "-c", "--config", type=str, required=True, help="Path to config file"
-    )
-    parser.add_argument(
-        "-o",
-        "--optconfig",
-        type=str,
-        required=True,
-        help="Path to config file for the optimization",
-    )
-    parser.add_argument(
-        "-p",
-        "--project",
-        type=str,
-        required=True,
-        help="Path to config file for the optimization",
-    )
-    parser.add_argument(
-        "-m",
-        "--method",
-        type=str,
-        required=True,
-        help="Method used to optimize the flow rates",
-    )
+def start_opt_tracing(opt_parameters: dict, trace_events: List[dict] = None):
+    """
+    Start tracing the current process if the opt_parameters ask for the
+    `trace`, the `profile_memory` or a `memory_budget` (MB), and set the budget.
 
-    # Get the directory of the current script
-    script_path = os.path.abspath(__file__)
-    base_path = os.path.dirname(script_path)
-    config_foldername = "configs"
+    :return tracer: The started tracer, or None.
+    """
+    budget = opt_parameters.get("memory_budget", None)
+    set_memory_budget(budget)
+    profile_memory = opt_parameters.get("profile_memory", False) in (True, "True", "true")
+    if (
+        opt_parameters.get("trace", False) in (True, "True", "true")
+        or profile_memory
+        or budget is not None
+    ):
+        return start_tracing(trace_events, memory=profile_memory)
+    return None
 
-    # Parse the arguments
-    args = parser.parse_args()
-    result_path = args.results
-    proj_name = args.project
-    config_name = args.config
-    optconfig_name = args.optconfig
-    method_name = args.method
 
-    # Extract the basic settings
-    config_folder_path = os.path.join(base_path, config_foldername)
-    optconfig_path = os.path.join(base_path, config_foldername, optconfig_name)
-    info = extract_information(config_folder_path, config_name)
+def run_method(
+    method_name: str,
+    info: tuple,
+    config_folder_path: str,
+    config_name: str,
+    opt_parameters: dict,
+    trace_events: List[dict] = None,
+):
+    """
+    Run one method on the extracted information of the config.
+
+    The results are saved under the `model_path` of the opt_parameters, and
+    appended to the results store at its `results_db` if given. With `trace`
+    in the opt_parameters, the phases of the method are traced to the Chrome
+    trace `trace.json` under the `model_path`, and summed up under `trace`
+    of its `time_cost.json`. With `profile_memory`, the peak resident and
+    Python memory (MB) of each phase are saved under `memory` of its
+    `time_cost.json`, and with `memory_budget` (MB), the method stops by a
+    `MemoryBudgetError` before a phase exceeds the budget.
+
+    :param trace_events: The optional traced events of the parsing of the
+     config, put ahead of those of the method.
+    :return time_cost: The time cost of the method.
+    """
+    # The peak memory of this run, not of the earlier runs of the process
+    reset_peak_rss()
+    tracer = start_opt_tracing(opt_parameters, trace_events)
+    try:
+        return _run_method(
+            method_name, info, config_folder_path, config_name, opt_parameters
+        )
+    finally:
+        set_memory_budget(None)
+        if tracer is not None:
+            stop_tracing()
+            if opt_parameters.get("trace", False) in (True, "True", "true"):
+                tracer.save(os.path.join(opt_parameters["model_path"], "trace.json"))
 
-    # Extract the config for the optimization
-    with open(optconfig_path, "r", encoding="utf-8") as f:
-        opt_parameters = json.load(f)
 
-    project_path = os.path.join(result_path, proj_name, method_name)
-    opt_parameters["model_path"] = project_path
+def optimize_method(method_name: str, info: tuple, opt_parameters: dict):
+    """
+    Optimize the flow rates by one method on the extracted information of the
+    config, saving its intermediate results under the `model_path` of the
+    opt_parameters.
+
+    :return optimized_kn_rates: The optimized rates of the groups of each
+     collective, or None for "flowChunk".
+    :return objective_value: The objective of the method, i.e., the average
+     completion time of the collectives.
+    :return time_cost: The time cost of the method.
+    """
     os.makedirs(opt_parameters["model_path"], exist_ok=True)
+    optimized_kn_rates = objective_value = None
 
     if method_name == "steller":
         # Obtained the optimized flow rates for groups of collectives
         # len(optimized_kn_rates) == K, where K is the number of collectives
         # len(optimized_kn_rates[k]) == Nk, where Nk is the number of groups in the k-th collective
-        optimized_kn_rates, time_cost = perform_steller(
+        optimized_kn_rates, objective_value, time_cost = perform_steller(
             flow_container=info[0],
             link_container=info[1],
             fl_s_holder=info[2],
             cg_container=info[3],
             fcg_holder=info[4],
             opt_config=opt_parameters,
+            problem_index=info[5],
         )
 
     if method_name == "barrierAwareAlloc":
-        optimized_kn_rates, time_cost = barrier_aware_allocation(
+        optimized_kn_rates, objective_value, time_cost = barrier_aware_allocation(
             flow_container=info[0],
             link_container=info[1],
             fl_s_holder=info[2],
             cg_container=info[3],
             fcg_holder=info[4],
             opt_config=opt_parameters,
+            problem_index=info[5],
         )
 
     if method_name == "dataAwareAlloc":
-        optimized_kn_rates, time_cost = data_aware_allocation(
+        optimized_kn_rates, objective_value, time_cost = data_aware_allocation(
             flow_container=info[0],
             link_container=info[1],
             fl_s_holder=info[2],
             cg_container=info[3],
             fcg_holder=info[4],
             opt_config=opt_parameters,
+            problem_index=info[5],
         )
 
     if method_name == "flowChunk":
@@ -161,26 +212,290 @@ def _main():
             cg_container=info[3],
             fcg_holder=info[4],
             opt_config=opt_parameters,
+            problem_index=info[5],
         )
 
+    return optimized_kn_rates, objective_value, time_cost
+
+
+def _run_method(
+    method_name: str,
+    info: tuple,
+    config_folder_path: str,
+    config_name: str,
+    opt_parameters: dict,
+):
+    """Run one method on the extracted information of the config, see `run_method`."""
+    optimized_kn_rates, objective_value, time_cost = optimize_method(
+        method_name, info, opt_parameters
+    )
+
     if method_name != "flowChunk":
-        add_bps_config(
-            config_folder_path,
-            config_name,
-            optimized_kn_rates,
-            info[0],
-            info[4],
-            info[3],
-            opt_parameters["model_path"],
+        with trace("save.optimized_config"):
+            add_bps_config(
+                config_folder_path,
+                config_name,
+                optimized_kn_rates,
+                info[0],
+                info[4],
+                info[3],
+                opt_parameters["model_path"],
+                problem_index=info[5],
+                output=opt_parameters.get("bps_output", "config"),
+                fmt=opt_parameters.get("bps_format", "npz"),
+            )
+
+    if method_name != "flowChunk" and opt_parameters.get("simulate", False) in (
+        True,
+        "True",
+        "true",
+    ):
+        # Play the flows with the optimized rates, respecting their dependencies
+        # and the link sharing over time
+        with trace("simulate"):
+            completion_times = simulate_allocation(
+                optimized_kn_rates, *info[:5], problem_index=info[5]
+            )
+        logging.info(
+            "%s%s simulated average completion time: %s",
+            "*" * 15,
+            method_name,
+            np.average(completion_times),
         )
+        save_results(
+            os.path.join(opt_parameters["model_path"], "simulated_completion_times.json"),
+            ["average_completion_time", "completion_times"],
+            [float(np.average(completion_times)), completion_times.tolist()],
+        )
+        objective_value = float(np.average(completion_times))
 
     # Save the time cost of the optimization under results
+    time_cost_record = {"time_cost": time_cost}
+    tracer = get_tracer()
+    if opt_parameters.get("trace", False) in (True, "True", "true"):
+        time_cost_record["trace"] = tracer.summary()
+    if tracer is not None and tracer.memory:
+        time_cost_record["memory"] = tracer.memory_summary()
     with open(
         os.path.join(opt_parameters["model_path"], "time_cost.json"),
         "w",
         encoding="utf-8",
     ) as f:
-        json.dump({"time_cost": time_cost}, f, indent=4)
+        json.dump(time_cost_record, f, indent=4)
+
+    if opt_parameters.get("results_db") is not None:
+        # The spans of the memory tracer reset the peak of the process, so its
+        # largest peak is that of the run
+        total_memory = time_cost_record.get("memory", dict()).get("total", dict())
+        append_result(
+            opt_parameters["results_db"],
+            os.path.join(config_folder_path, config_name),
+            method_name,
+            opt_parameters,
+            time_cost,
+            objective_value,
+            peak_memory=total_memory.get("rss_peak"),
+        )
+
+    return time_cost
+
+
+def _run_shared_method(
+    method_name: str,
+    info: tuple,
+    config_folder_path: str,
+    config_name: str,
+    opt_parameters: dict,
+    trace_events: List[dict] = None,
+):
+    """Run one method in a worker, on the arrays held in the shared memory."""
+    blocks = attach_arrays(list(info))
+    try:
+        return run_method(
+            method_name, info, config_folder_path, config_name, opt_parameters,
+            trace_events,
+        )
+    finally:
+        # Drop the views before closing the blocks
+        del info
+        release_arrays(blocks)
+
+
+def run_methods(
+    method_names: List[str],
+    info: tuple,
+    config_folder_path: str,
+    config_name: str,
+    opt_parameters: dict,
+    project_path: str,
+    n_workers: int = None,
+    trace_events: List[dict] = None,
+):
+    """
+    Run the methods on the extracted information of one config.
+
+    Several methods are run concurrently in a process pool, where the arrays
+    of the information are shared with the workers through the shared memory.
+    Each method saves its results to `<project_path>/<method>`, and the time
+    costs of all methods are merged into `<project_path>/time_cost.json`.
+
+    :return time_costs: A dict holding the time cost of each method.
+    """
+    method_parameters = {
+        method_name: {
+            **opt_parameters,
+            "model_path": os.path.join(project_path, method_name),
+        }
+        for method_name in method_names
+    }
+
+    time_costs = dict()
+    if len(method_names) == 1:
+        method_name = method_names[0]
+        time_costs[method_name] = run_method(
+            method_name,
+            info,
+            config_folder_path,
+            config_name,
+            method_parameters[method_name],
+            trace_events,
+        )
+    else:
+        n_workers = n_workers or len(method_names)
+        blocks, replaced = share_arrays(list(info))
+        try:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = {
+                    method_name: executor.submit(
+                        _run_shared_method,
+                        method_name,
+                        info,
+                        config_folder_path,
+                        config_name,
+                        method_parameters[method_name],
+                        trace_events,
+                    )
+                    for method_name in method_names
+                }
+                for method_name, future in futures.items():
+                    time_costs[method_name] = future.result()
+                    logging.info("%s %s Done.", "*" * 15, method_name)
+        finally:
+            # The info of the caller gets its own arrays back
+            restore_arrays(replaced)
+            release_arrays(blocks, unlink=True)
+
+    # Merge the time costs with those of the previous runs of the project
+    merged_path = os.path.join(project_path, "time_cost.json")
+    merged = {"time_cost": dict()}
+    if os.path.exists(merged_path):
+        with open(merged_path, "r", encoding="utf-8") as f:
+            merged = json.load(f)
+    merged["time_cost"].update(time_costs)
+    with open(merged_path, "w", encoding="utf-8") as f:
+        json.dump(merged, f, indent=4)
+
+    return time_costs
+
+
+def _main():
+    """Run the experiment."""
+    # Extract the parse arguments
+    parser = argparse.ArgumentParser(description="Process some files.")
+    # Define the -b and -c arguments
+    parser.add_argument(
+        "-r", "--results", type=str, required=True, help="Path to results"
+    )
+    parser.add_argument(
+        "-c", "--config", type=str, required=True, help="Path to config file"
+    )
+    parser.add_argument(
+        "-o",
+        "--optconfig",
+        type=str,
+        required=True,
+        help="Path to config file for the optimization",
+    )
+    parser.add_argument(
+        "-p",
+        "--project",
+        type=str,
+        required=True,
+        help="Path to config file for the optimization",
+    )
+    parser.add_argument(
+        "-m",
+        "--method",
+        type=str,
+        nargs="+",
+        required=True,
+        help=f"Methods used to optimize the flow rates, or all of {method_factory}",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of processes running the methods concurrently",
+    )
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=str,
+        default=None,
+        help="Path to the results store, <results>/results.db by default",
+    )
+
+    # Get the directory of the current script
+    script_path = os.path.abspath(__file__)
+    base_path = os.path.dirname(script_path)
+    config_foldername = "configs"
+
+    # Parse the arguments
+    args = parser.parse_args()
+    result_path = args.results
+    proj_name = args.project
+    config_name = args.config
+    optconfig_name = args.optconfig
+    method_names = method_factory if args.method == ["all"] else args.method
+    for method_name in method_names:
+        if method_name not in method_factory:
+            parser.error(f"Unknown method {method_name}, choose from {method_factory}")
+
+    # Extract the basic settings
+    config_folder_path = os.path.join(base_path, config_foldername)
+    optconfig_path = os.path.join(base_path, config_foldername, optconfig_name)
+
+    # Extract the config for the optimization
+    with open(optconfig_path, "r", encoding="utf-8") as f:
+        opt_parameters = json.load(f)
+
+    # The parsing is traced here, ahead of the phases of each method
+    trace_events = None
+    try:
+        tracer = start_opt_tracing(opt_parameters)
+        try:
+            info = extract_information(config_folder_path, config_name)
+        finally:
+            set_memory_budget(None)
+            if tracer is not None:
+                trace_events = stop_tracing().events
+        opt_parameters["results_db"] = args.database or os.path.join(result_path, "results.db")
+
+        project_path = os.path.join(result_path, proj_name)
+        run_methods(
+            method_names,
+            info,
+            config_folder_path,
+            config_name,
+            opt_parameters,
+            project_path,
+            n_workers=args.jobs,
+            trace_events=trace_events,
+        )
+    except MemoryBudgetError as error:
+        logging.error("%s %s", "*" * 15, error)
+        raise SystemExit(1) from error
 
     logging.info("%s %s Done.", "*" * 15, proj_name)
 
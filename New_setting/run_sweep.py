@@ -0,0 +1,348 @@
+"""
+A sweep of the experiments over a grid of configs, methods and overrides of
+the optimization parameters, run across a process pool.
+
+Each cell of the grid, i.e., one config, one method and one set of
+overrides, is run by `run_method` of `run_experiment.py` and saves its
+results to `<results>/<project>/<config>[/<overrides>]/<method>`. The cells
+whose `time_cost.json` already exists are skipped, and the progress is
+checkpointed at `<results>/<project>/sweep_checkpoint.json` after each cell,
+so an interrupted sweep resumes where it stopped. The results of the cells
+are also appended to the results store, `<results>/results.db` by default.
+"""
+
+import os
+import csv
+import json
+import glob
+import argparse
+import logging
+import itertools
+from dataclasses import dataclass, field
+from typing import List
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from stellar import extract_information
+from run_experiment import method_factory, run_method
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+# The parsed configs of a worker, shared by the cells it runs
+_infos = dict()
+
+
+@dataclass
+class SweepCell:
+    """One config, one method and one set of overrides of the sweep."""
+
+    config_name: str
+    method_name: str
+    optconfig_name: str
+    overrides: dict = field(default_factory=dict)
+    # The path of the results under the sweep, e.g. `Abilene_1-RAR/steller`,
+    # which is also the key of the cell in the checkpoint
+    key: str = None
+    model_path: str = None
+
+
+def get_override_tag(overrides: dict) -> str:
+    """Get the folder name of a set of overrides, e.g. `T=20_jump_range=40`."""
+    return "_".join(f"{name}={value}" for name, value in sorted(overrides.items()))
+
+
+def get_config_names(config_folder_path: str, config_patterns: List[str]) -> List[str]:
+    """
+    Get the configs matched by the glob patterns under the config folder,
+    where the configs of the optimization are ignored.
+    """
+    config_names = list()
+    for pattern in config_patterns:
+        matched = sorted(glob.glob(os.path.join(config_folder_path, pattern)))
+        if not matched:
+            logging.warning("No config matches %s", pattern)
+        for path in matched:
+            config_name = os.path.relpath(path, config_folder_path)
+            if config_name.endswith("_optimization.json") or config_name in config_names:
+                continue
+            config_names.append(config_name)
+    return config_names
+
+
+def create_sweep_cells(
+    config_names: List[str],
+    method_names: List[str],
+    optconfig_pattern: str,
+    override_grid: dict,
+    sweep_path: str,
+) -> List[SweepCell]:
+    """
+    Create the cells of the grid of configs x methods x overrides.
+
+    :param optconfig_pattern: The config of the optimization, where `{name}`
+     is replaced by the path of the config without `.json`. By default, the
+     `<name>_optimization.json` next to each config.
+    :param override_grid: A dict holding the list of values of each overridden
+     optimization parameter, whose product is swept.
+    """
+    override_names = sorted(override_grid)
+    override_sets = [
+        dict(zip(override_names, values))
+        for values in itertools.product(*(override_grid[name] for name in override_names))
+    ]
+
+    cells = list()
+    for config_name in config_names:
+        name = os.path.splitext(config_name)[0]
+        for overrides in override_sets:
+            project_key = os.path.basename(name)
+            if overrides:
+                project_key = os.path.join(project_key, get_override_tag(overrides))
+            for method_name in method_names:
+                key = os.path.join(project_key, method_name)
+                cells.append(
+                    SweepCell(
+                        config_name=config_name,
+                        method_name=method_name,
+                        optconfig_name=optconfig_pattern.format(name=name),
+                        overrides=overrides,
+                        key=key,
+                        model_path=os.path.join(sweep_path, key),
+                    )
+                )
+    return cells
+
+
+def load_checkpoint(checkpoint_path: str) -> dict:
+    """Load the checkpoint of a sweep, holding its done and failed cells."""
+    if not os.path.exists(checkpoint_path):
+        return {"done": dict(), "failed": dict()}
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint_path: str, checkpoint: dict):
+    """Save the checkpoint atomically, so that an interruption never corrupts it."""
+    temp_path = f"{checkpoint_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=4)
+    os.replace(temp_path, checkpoint_path)
+
+
+def is_cell_done(cell: SweepCell, checkpoint: dict) -> bool:
+    """Whether the results of the cell already exist."""
+    return cell.key in checkpoint["done"] or os.path.exists(
+        os.path.join(cell.model_path, "time_cost.json")
+    )
+
+
+def run_cell(cell: SweepCell, config_folder_path: str, results_db: str = None) -> float:
+    """
+    Run the method of one cell in a worker, where each config is parsed once
+    per worker.
+
+    :return time_cost: The time cost of the method.
+    """
+    if cell.config_name not in _infos:
+        _infos[cell.config_name] = extract_information(config_folder_path, cell.config_name)
+    info = _infos[cell.config_name]
+    with open(
+        os.path.join(config_folder_path, cell.optconfig_name), "r", encoding="utf-8"
+    ) as f:
+        opt_parameters = json.load(f)
+    opt_parameters.update(cell.overrides)
+    opt_parameters["model_path"] = cell.model_path
+    opt_parameters["results_db"] = results_db
+    return run_method(
+        cell.method_name, info, config_folder_path, cell.config_name, opt_parameters
+    )
+
+
+def save_sweep_summary(summary_path: str, cells: List[SweepCell], checkpoint: dict):
+    """
+    Save the time cost of each cell of the sweep to a CSV file, where the
+    time costs of the phases, e.g. `OP-Time` and `OR-Time` of steller, have
+    their own columns besides the total.
+    """
+    time_costs = dict()
+    for cell in cells:
+        time_cost = checkpoint["done"].get(cell.key)
+        time_cost_path = os.path.join(cell.model_path, "time_cost.json")
+        if time_cost is None and os.path.exists(time_cost_path):
+            with open(time_cost_path, "r", encoding="utf-8") as f:
+                time_cost = json.load(f)["time_cost"]
+        if time_cost is not None:
+            time_costs[cell.key] = time_cost
+    override_names = sorted({name for cell in cells for name in cell.overrides})
+    phase_names = sorted(
+        {name for time_cost in time_costs.values() if isinstance(time_cost, dict) for name in time_cost}
+    )
+
+    with open(summary_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["config", "method", *override_names, "time_cost", *phase_names])
+        for cell in cells:
+            if cell.key not in time_costs:
+                continue
+            time_cost = time_costs[cell.key]
+            phases = time_cost if isinstance(time_cost, dict) else dict()
+            writer.writerow(
+                [
+                    cell.config_name,
+                    cell.method_name,
+                    *(cell.overrides.get(name, "") for name in override_names),
+                    sum(phases.values()) if phases else time_cost,
+                    *(phases.get(name, "") for name in phase_names),
+                ]
+            )
+
+
+def run_sweep(
+    cells: List[SweepCell],
+    config_folder_path: str,
+    sweep_path: str,
+    n_workers: int = None,
+    results_db: str = None,
+):
+    """
+    Run the cells of the sweep not done yet across a process pool.
+
+    :return checkpoint: A dict holding the time cost of each done cell, and
+     the error of each failed cell.
+    """
+    os.makedirs(sweep_path, exist_ok=True)
+    checkpoint_path = os.path.join(sweep_path, "sweep_checkpoint.json")
+    checkpoint = load_checkpoint(checkpoint_path)
+    todo_cells = [cell for cell in cells if not is_cell_done(cell, checkpoint)]
+    logging.info(
+        "%s Sweep of %d cells, %d done, %d to run.",
+        "*" * 15,
+        len(cells),
+        len(cells) - len(todo_cells),
+        len(todo_cells),
+    )
+
+    if todo_cells:
+        executor = ProcessPoolExecutor(max_workers=n_workers)
+        try:
+            futures = {
+                executor.submit(run_cell, cell, config_folder_path, results_db): cell
+                for cell in todo_cells
+            }
+            for n_done, future in enumerate(as_completed(futures), start=1):
+                cell = futures[future]
+                try:
+                    checkpoint["done"][cell.key] = future.result()
+                    checkpoint["failed"].pop(cell.key, None)
+                    logging.info("-----> [%d/%d] %s done.", n_done, len(todo_cells), cell.key)
+                except Exception as error:  # pylint: disable=broad-except
+                    # A failed cell does not stop the sweep and is retried on resume
+                    checkpoint["failed"][cell.key] = repr(error)
+                    logging.error("-----> [%d/%d] %s failed: %r", n_done, len(todo_cells), cell.key, error)
+                save_checkpoint(checkpoint_path, checkpoint)
+        finally:
+            # Drop the pending cells on an interruption, which are run on resume
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    save_sweep_summary(os.path.join(sweep_path, "sweep_time_cost.csv"), cells, checkpoint)
+    return checkpoint
+
+
+def _main():
+    """Run the sweep."""
+    parser = argparse.ArgumentParser(description="Run a sweep of the experiments.")
+    parser.add_argument(
+        "-r", "--results", type=str, required=True, help="Path to results"
+    )
+    parser.add_argument(
+        "-p", "--project", type=str, required=True, help="Name of the sweep"
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Glob patterns of the config files under configs, e.g. 'Abilene_RAR/*-RAR.json'",
+    )
+    parser.add_argument(
+        "-m",
+        "--method",
+        type=str,
+        nargs="+",
+        required=True,
+        help=f"Methods used to optimize the flow rates, or all of {method_factory}",
+    )
+    parser.add_argument(
+        "-o",
+        "--optconfig",
+        type=str,
+        default="{name}_optimization.json",
+        help="Config file for the optimization, where {name} is the config without .json",
+    )
+    parser.add_argument(
+        "-g",
+        "--grid",
+        type=str,
+        default=None,
+        help="JSON file holding the list of values of each overridden optimization parameter",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of processes running the cells concurrently",
+    )
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=str,
+        default=None,
+        help="Path to the results store, <results>/results.db by default",
+    )
+
+    # Get the directory of the current script
+    script_path = os.path.abspath(__file__)
+    base_path = os.path.dirname(script_path)
+    config_folder_path = os.path.join(base_path, "configs")
+
+    args = parser.parse_args()
+    method_names = method_factory if args.method == ["all"] else args.method
+    for method_name in method_names:
+        if method_name not in method_factory:
+            parser.error(f"Unknown method {method_name}, choose from {method_factory}")
+    override_grid = dict()
+    if args.grid is not None:
+        with open(args.grid, "r", encoding="utf-8") as f:
+            override_grid = json.load(f)
+
+    sweep_path = os.path.join(args.results, args.project)
+    cells = create_sweep_cells(
+        get_config_names(config_folder_path, args.config),
+        method_names,
+        args.optconfig,
+        override_grid,
+        sweep_path,
+    )
+    missing = sorted(
+        {
+            cell.optconfig_name
+            for cell in cells
+            if not os.path.exists(os.path.join(config_folder_path, cell.optconfig_name))
+        }
+    )
+    if missing:
+        parser.error(f"Missing configs of the optimization {missing}, given by -o")
+    checkpoint = run_sweep(
+        cells,
+        config_folder_path,
+        sweep_path,
+        n_workers=args.jobs,
+        results_db=args.database or os.path.join(args.results, "results.db"),
+    )
+    n_failed = sum(cell.key in checkpoint["failed"] for cell in cells)
+    logging.info("%s %s Done, %d cells failed.", "*" * 15, args.project, n_failed)
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,119 @@
+"""
+Utilities to share the parsed arrays of the holders with worker processes
+through `multiprocessing.shared_memory`, so that the workers do not copy them.
+"""
+
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import List, Tuple
+
+import numpy as np
+
+
+@dataclass
+class SharedArray:
+    """A placeholder of an array held in the shared memory."""
+
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+def _array_attributes(obj):
+    """Get the (name, value) of the attributes held by a holder."""
+    if not hasattr(obj, "__dict__"):
+        return []
+    return list(vars(obj).items())
+
+
+def share_arrays(objs: list):
+    """
+    Move the arrays of the holders to the shared memory.
+
+    Each array attribute of the holders, including the nested ones, is copied
+    once to a shared memory block and replaced by a SharedArray placeholder,
+    making the holders cheap to pickle.
+    The caller owns the returned blocks and should `close` and `unlink` them
+    once the workers are done, and put the arrays back by `restore_arrays`.
+
+    :return blocks: The shared memory blocks.
+    :return replaced: The (holder, name, array) of each replaced attribute.
+    """
+    blocks = list()
+    shared = dict()
+    replaced = list()
+
+    def share(obj, visited):
+        if id(obj) in visited:
+            return
+        visited.add(id(obj))
+        for name, value in _array_attributes(obj):
+            if isinstance(value, np.ndarray):
+                if value.dtype == object or value.nbytes == 0:
+                    continue
+                if id(value) not in shared:
+                    block = shared_memory.SharedMemory(create=True, size=value.nbytes)
+                    np.ndarray(value.shape, value.dtype, buffer=block.buf)[...] = value
+                    blocks.append(block)
+                    shared[id(value)] = SharedArray(
+                        block.name, value.shape, value.dtype.str
+                    )
+                replaced.append((obj, name, value))
+                setattr(obj, name, shared[id(value)])
+            elif hasattr(value, "__dataclass_fields__"):
+                share(value, visited)
+
+    visited = set()
+    try:
+        for obj in objs:
+            share(obj, visited)
+    except BaseException:
+        restore_arrays(replaced)
+        release_arrays(blocks, unlink=True)
+        raise
+    return blocks, replaced
+
+
+def restore_arrays(replaced: List[tuple]):
+    """Put back the arrays of the holders replaced by `share_arrays`."""
+    for obj, name, array in replaced:
+        setattr(obj, name, array)
+
+
+def attach_arrays(objs: list) -> List[shared_memory.SharedMemory]:
+    """
+    Replace the SharedArray placeholders of the holders by read-only views
+    of the shared memory.
+
+    The returned blocks must be kept alive while the holders are in use.
+    """
+    blocks = dict()
+
+    def attach(obj, visited):
+        if id(obj) in visited:
+            return
+        visited.add(id(obj))
+        for name, value in _array_attributes(obj):
+            if isinstance(value, SharedArray):
+                if value.name not in blocks:
+                    blocks[value.name] = shared_memory.SharedMemory(name=value.name)
+                array = np.ndarray(
+                    value.shape, np.dtype(value.dtype), buffer=blocks[value.name].buf
+                )
+                array.flags.writeable = False
+                setattr(obj, name, array)
+            elif hasattr(value, "__dataclass_fields__"):
+                attach(value, visited)
+
+    visited = set()
+    for obj in objs:
+        attach(obj, visited)
+    return list(blocks.values())
+
+
+def release_arrays(blocks: List[shared_memory.SharedMemory], unlink: bool = False):
+    """Close, and unlink if required, the shared memory blocks."""
+    for block in blocks:
+        block.close()
+        if unlink:
+            block.unlink()
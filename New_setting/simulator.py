@@ -0,0 +1,314 @@
+"""
+A discrete-event fluid simulator of the flows, to evaluate the flow rates
+allocated by any method.
+
+Each flow starts once all the flows it depends on are done, and is sent at
+its allocated rate, scaled down on the links whose capacity is exceeded by
+the flows sent on them at the same time. At each event, i.e. when flows
+finish, only the flows sharing links with the started and finished flows
+update their rates.
+"""
+
+import os
+import json
+import argparse
+import logging
+
+import numpy as np
+
+from generic import (
+    BaseContainer,
+    FlowLinkSendHolder,
+    CollectiveGroupContainer,
+    FlowCGHolder,
+    ProblemIndex,
+)
+from opt_utils import create_adjacency_lists, create_problem_index, get_flow_dependencies
+from bps_table import apply_bps_table, load_bps_table
+
+
+def _csr_entries(indptr: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Get the positions of the entries of the rows in the CSR arrays."""
+    if len(rows) == 1:
+        return np.arange(indptr[rows[0]], indptr[rows[0] + 1])
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    ends = np.cumsum(lengths)
+    if not len(ends) or not ends[-1]:
+        return np.zeros(0, dtype=np.int64)
+    return np.repeat(starts - ends + lengths, lengths) + np.arange(ends[-1])
+
+
+def _unique(items: np.ndarray, stamps: np.ndarray) -> np.ndarray:
+    """
+    Get the unique items in O(len(items)) time, where stamps is an array
+    indexed by the items, used as scratch space.
+    """
+    stamps[items] = np.arange(len(items))
+    return items[stamps[items] == np.arange(len(items))]
+
+
+def _transpose_csr(indptr: np.ndarray, indices: np.ndarray, n_cols: int):
+    """Transpose the CSR arrays of a [n_rows, n_cols] matrix."""
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    order = np.argsort(indices, kind="stable")
+    t_indptr = np.concatenate(([0], np.cumsum(np.bincount(indices, minlength=n_cols))))
+    return t_indptr, rows[order]
+
+
+def simulate_flows(
+    flow_datas: np.ndarray,
+    flow_rates: np.ndarray,
+    flow_link_indptr: np.ndarray,
+    flow_link_indices: np.ndarray,
+    link_capacities: np.ndarray,
+    dependency_indptr: np.ndarray,
+    dependency_indices: np.ndarray,
+) -> np.ndarray:
+    """
+    Simulate the flows sent through their links.
+
+    :param flow_datas: The data of each flow, with shape [F].
+    :param flow_rates: The allocated rate of each flow, with shape [F].
+    :param flow_link_indptr, flow_link_indices: The links of each flow in
+     the CSR form.
+    :param link_capacities: The capacity of each link, with shape [E].
+    :param dependency_indptr, dependency_indices: The flows that each flow
+     depends on in the CSR form.
+    :return finish_times: The time each flow is done, with shape [F], where
+     inf presents the flows that can never be done, e.g. with a zero rate.
+    """
+    F = len(flow_datas)
+    E = len(link_capacities)
+    flow_rates = np.asarray(flow_rates, dtype=float)
+    link_capacities = np.asarray(link_capacities, dtype=float)
+    flow_n_links = np.diff(flow_link_indptr)
+    has_no_links = not flow_n_links.all()
+    # The flow of each entry of the links of the flows
+    entry_flows = np.repeat(np.arange(F), flow_n_links)
+    link_flow_indptr, link_flow_indices = _transpose_csr(
+        flow_link_indptr, flow_link_indices, E
+    )
+    dependent_indptr, dependent_indices = _transpose_csr(
+        dependency_indptr, dependency_indices, F
+    )
+    n_waitings = np.diff(dependency_indptr).astype(np.int64)
+
+    remaining_datas = np.asarray(flow_datas, dtype=float).copy()
+    rates = np.zeros(F)
+    update_times = np.zeros(F)
+    # The predicted finish times are split into blocks of about sqrt(F)
+    # flows, where the minimum of each block is kept to find the next event
+    block_size = int(np.sqrt(F)) + 1
+    n_blocks = -(-F // block_size)
+    predicted_times = np.full(n_blocks * block_size, np.inf)
+    block_times = predicted_times.reshape(n_blocks, block_size)
+    block_mins = np.full(n_blocks, np.inf)
+    block_stamps = np.zeros(n_blocks, dtype=np.int64)
+    finish_times = np.full(F, np.inf)
+    is_active = np.zeros(F, dtype=bool)
+    link_loads = np.zeros(E)
+    flow_stamps = np.zeros(F, dtype=np.int64)
+
+    now = 0.0
+    started = np.flatnonzero(n_waitings == 0)
+    finished = np.zeros(0, dtype=np.int64)
+    while len(started) or len(finished):
+        # 1. Update the load of the links of the started and finished flows
+        is_active[started] = True
+        update_times[started] = now
+        entries = _csr_entries(flow_link_indptr, np.concatenate((started, finished)))
+        entry_rates = flow_rates[entry_flows[entries]]
+        changed_links = flow_link_indices[entries]
+        capacities = link_capacities[changed_links]
+        is_exceeded = link_loads[changed_links] > capacities
+        np.add.at(
+            link_loads,
+            changed_links,
+            np.where(is_active[entry_flows[entries]], entry_rates, -entry_rates),
+        )
+        # The capacity shares of the links never exceeded do not change
+        changed_links = changed_links[is_exceeded | (link_loads[changed_links] > capacities)]
+
+        # 2. Update the rates of the active flows on these links, where the
+        # flows exceeding the capacity of a link share it by their rates
+        affected = np.concatenate(
+            (link_flow_indices[_csr_entries(link_flow_indptr, changed_links)], started)
+        )
+        affected = _unique(affected[is_active[affected]], flow_stamps)
+        if len(affected):
+            remaining = remaining_datas[affected] - rates[affected] * (now - update_times[affected])
+            remaining_datas[affected] = remaining
+            update_times[affected] = now
+            links = flow_link_indices[_csr_entries(flow_link_indptr, affected)]
+            capacities = link_capacities[links]
+            link_scales = capacities / np.maximum(link_loads[links], capacities)
+            n_links = flow_n_links[affected]
+            if has_no_links:
+                scales = np.ones(len(affected))
+                has_links = n_links > 0
+                if has_links.any():
+                    bounds = (np.cumsum(n_links) - n_links)[has_links]
+                    scales[has_links] = np.minimum.reduceat(link_scales, bounds)
+            else:
+                scales = np.minimum.reduceat(link_scales, np.cumsum(n_links) - n_links)
+            new_rates = flow_rates[affected] * scales
+            rates[affected] = new_rates
+            durations = np.full(len(affected), np.inf)
+            np.divide(remaining, new_rates, out=durations, where=new_rates > 0)
+            durations[remaining <= 0] = 0.0
+            predicted_times[affected] = now + durations
+            blocks = _unique(affected // block_size, block_stamps)
+            block_mins[blocks] = block_times[blocks].min(axis=1)
+
+        # 3. Move to the next event, where the flows finish
+        now = block_mins.min(initial=np.inf)
+        if now == np.inf:
+            break
+        blocks = np.flatnonzero(block_mins <= now * (1 + 1e-12))
+        rows, cols = np.nonzero(block_times[blocks] <= now * (1 + 1e-12))
+        finished = blocks[rows] * block_size + cols
+        finish_times[finished] = now
+        predicted_times[finished] = np.inf
+        block_mins[blocks] = block_times[blocks].min(axis=1)
+        remaining_datas[finished] = 0.0
+        is_active[finished] = False
+
+        # 4. Start the flows whose dependencies are all done
+        dependents = dependent_indices[_csr_entries(dependent_indptr, finished)]
+        np.subtract.at(n_waitings, dependents, 1)
+        started = dependents[n_waitings[dependents] == 0]
+        if len(started) > 1:
+            started = _unique(started, flow_stamps)
+
+    return finish_times
+
+
+def simulate_allocation(
+    big_R: list,
+    flow_container: BaseContainer,
+    link_container: BaseContainer,
+    fl_s_holder: FlowLinkSendHolder,
+    cg_container: CollectiveGroupContainer,
+    fcg_holder: FlowCGHolder,
+    problem_index: ProblemIndex = None,
+) -> np.ndarray:
+    """
+    Simulate the flows with the rates of their groups.
+
+    :param big_R: The rate of each group, where big_R[k][n] is the rate of
+     the n-th group of the k-th collective.
+    :return completion_times: The completion time of each collective, with shape [K].
+    """
+    if problem_index is None:
+        problem_index = create_problem_index(
+            flow_container, link_container, fl_s_holder, cg_container, fcg_holder
+        )
+    flow_rates = np.concatenate([np.asarray(rates, dtype=float) for rates in big_R])
+    flow_link_indptr, flow_link_indices = create_adjacency_lists(
+        fl_s_holder.fl_holder.matrix
+    )
+    dependency_indptr, dependency_indices = get_flow_dependencies(flow_container)
+    finish_times = simulate_flows(
+        problem_index.flow_datas,
+        flow_rates[problem_index.flow_group_idxes],
+        flow_link_indptr,
+        flow_link_indices,
+        problem_index.link_capacities,
+        dependency_indptr,
+        dependency_indices,
+    )
+    completion_times = np.full(cg_container.K, -np.inf)
+    np.maximum.at(
+        completion_times,
+        problem_index.group_collectives[problem_index.flow_group_idxes],
+        finish_times,
+    )
+    return completion_times
+
+
+def simulate_config(info_data: dict):
+    """
+    Simulate the flows of a config with the `bps` of each flow, e.g. the
+    config with the optimized bps written by `add_bps_config`, or a config
+    with the bps of a table applied by `bps_table.apply_bps_table`.
+
+    :return completion_times: A dict holding the completion time of each collective.
+    """
+    link_positions = {
+        str(link_id): pos for pos, link_id in enumerate(info_data["link_capacities"])
+    }
+    flow_ids = [key for key in info_data if key.isdigit()]
+    flow_positions = {flow_id: pos for pos, flow_id in enumerate(flow_ids)}
+    flows = [info_data[flow_id] for flow_id in flow_ids]
+    to_mb = 8 * 1024 * 1024
+
+    flow_link_indptr = np.concatenate(([0], np.cumsum([len(flow["links"]) for flow in flows])))
+    flow_link_indices = np.array(
+        [link_positions[str(link)] for flow in flows for link in flow["links"]], dtype=np.int64
+    )
+    dependency_indptr = np.concatenate(
+        ([0], np.cumsum([len(flow["dependencies"]) for flow in flows]))
+    )
+    dependency_indices = np.array(
+        [flow_positions[str(dep)] for flow in flows for dep in flow["dependencies"]],
+        dtype=np.int64,
+    )
+    finish_times = simulate_flows(
+        np.array([flow["total"] for flow in flows], dtype=float) / to_mb,
+        np.array([flow["bps"] for flow in flows], dtype=float) / to_mb,
+        flow_link_indptr,
+        flow_link_indices,
+        np.array(list(info_data["link_capacities"].values()), dtype=float) / to_mb,
+        dependency_indptr,
+        dependency_indices,
+    )
+    completion_times = {}
+    for flow, finish_time in zip(flows, finish_times):
+        coll_id = flow["collective_id"]
+        completion_times[coll_id] = max(completion_times.get(coll_id, 0.0), float(finish_time))
+    return completion_times
+
+
+def _main():
+    """Simulate the flows of a config with bps."""
+    parser = argparse.ArgumentParser(description="Simulate the flows of a config.")
+    parser.add_argument(
+        "-c", "--config", type=str, required=True, help="Path to config file with bps"
+    )
+    parser.add_argument(
+        "-s", "--save", type=str, default=None, help="Path to save the completion times"
+    )
+    parser.add_argument(
+        "-b",
+        "--bps",
+        type=str,
+        default=None,
+        help="Path to the bps table of the flows of the config, saved with `bps_output: table`",
+    )
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        info_data = json.load(f)
+    if args.bps is not None:
+        apply_bps_table(info_data, *load_bps_table(args.bps), config_path=args.config)
+    completion_times = simulate_config(info_data)
+    average_time = float(np.average(list(completion_times.values())))
+    logging.info(
+        "%s %s: average completion time %s", "*" * 15, os.path.basename(args.config), average_time
+    )
+    if args.save is not None:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "average_completion_time": average_time,
+                    "completion_times": {str(k): t for k, t in completion_times.items()},
+                },
+                f,
+                indent=4,
+            )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    _main()
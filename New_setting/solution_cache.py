@@ -0,0 +1,265 @@
+"""
+A persistent cache of the solutions of the methods, keyed by the canonical
+form of their problems.
+
+The same collective pattern recurs with its flows, groups or collectives
+relabeled. The canonical form of a problem is invariant to these labels:
+each group is described by its data, the lower bound of its completion time
+and its row of the group-link volume matrix (with the counts and the
+smallest and largest data of its flows on each link), the groups of each
+collective are sorted by these rows, and the collectives by their sorted
+groups. Its hash, with the capacities of the links, the method and its
+parameters, keys the solutions cached in a SQLite file, which are mapped
+back to the collectives and groups of the problem on a hit. The least
+recently used solutions are evicted when the cache exceeds its size.
+
+The cache is enabled by the `solution_cache` path of the optimization
+config, and its size (MB) is given by `solution_cache_mb`.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+from generic import ProblemIndex
+from opt_utils import create_adjacency_lists, get_group_lower_bounds
+from results_store import get_params_key
+
+DEFAULT_CACHE_MB = 256
+# The decimals kept of the values of the canonical form, so that the sums of
+# the data in another order of the flows give the same form
+CANONICAL_DECIMALS = 6
+
+
+@dataclass
+class CanonicalProblem:
+    """The hash of the canonical form of a problem, with its order of the groups."""
+
+    key: str
+    # The collective index and the group indexes of each canonical collective,
+    # in the canonical order
+    order: List[tuple]
+
+    def to_canonical(self, kn_values) -> list:
+        """Reorder the values of the groups of each collective to the canonical order."""
+        return [[kn_values[k][n] for n in group_idxes] for k, group_idxes in self.order]
+
+    def from_canonical(self, values) -> list:
+        """Reorder the values in the canonical order back to the groups of each collective."""
+        kn_values = [None] * len(self.order)
+        for (k, group_idxes), coll_values in zip(self.order, values):
+            kn_values[k] = [None] * len(group_idxes)
+            for n, value in zip(group_idxes, coll_values):
+                kn_values[k][n] = value
+        return kn_values
+
+
+def get_canonical_problem(
+    problem_index: ProblemIndex,
+    flow_link_matrix: np.ndarray,
+    method_name: str,
+    opt_parameters: dict,
+    keep_order: bool = False,
+) -> CanonicalProblem:
+    """
+    Get the canonical form of the problem of a method.
+
+    :param flow_link_matrix: The [F, E] flow-link matrix, to bound the
+     completion times of the groups.
+    :param keep_order: Whether to keep the order of the collectives and
+     groups, for the methods whose solutions depend on it, e.g. the greedy
+     data-aware allocation.
+    """
+    N = len(problem_index.group_datas)
+    with np.errstate(divide="ignore"):
+        flow_times = problem_index.flow_datas / problem_index.flow_bottleneck_capacities
+    lower_bounds = get_group_lower_bounds(
+        problem_index.dependency_index,
+        flow_times,
+        problem_index.flow_group_idxes,
+        *create_adjacency_lists(flow_link_matrix),
+        N,
+    )
+    signatures = np.column_stack(
+        [
+            problem_index.group_datas,
+            lower_bounds,
+            problem_index.group_link_volumes,
+            problem_index.group_link_counts,
+            problem_index.group_link_min_datas,
+            problem_index.group_link_max_datas,
+        ]
+    ).astype(float)
+    signatures = np.where(
+        np.isfinite(signatures), np.round(signatures, CANONICAL_DECIMALS), signatures
+    )
+
+    offsets = problem_index.group_offsets
+    collectives = list()
+    for k in range(len(offsets) - 1):
+        block = signatures[offsets[k] : offsets[k + 1]]
+        # Sort the groups by their signatures, the first column first
+        group_idxes = (
+            np.arange(len(block)) if keep_order else np.lexsort(block.T[::-1])
+        )
+        collectives.append(
+            (len(block), block[group_idxes].tobytes(), k, group_idxes.tolist())
+        )
+    if not keep_order:
+        collectives.sort(key=lambda collective: collective[:2])
+
+    digest = hashlib.sha256()
+    digest.update(method_name.encode("utf-8"))
+    digest.update(get_params_key(opt_parameters).encode("utf-8"))
+    digest.update(np.round(problem_index.link_capacities, CANONICAL_DECIMALS).tobytes())
+    for n_groups, block_bytes, _, _ in collectives:
+        digest.update(np.int64(n_groups).tobytes())
+        digest.update(block_bytes)
+    return CanonicalProblem(
+        key=digest.hexdigest(),
+        order=[(k, group_idxes) for _, _, k, group_idxes in collectives],
+    )
+
+
+def open_solution_cache(cache_path: str) -> sqlite3.Connection:
+    """Open the cache, creating its table if needed."""
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    connection = sqlite3.connect(cache_path, timeout=60, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS solutions (key TEXT PRIMARY KEY, method TEXT, "
+        "solution TEXT, size INTEGER, last_access REAL)"
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS solutions_last_access ON solutions (last_access)"
+    )
+    return connection
+
+
+def load_solution(cache_path: str, key: str) -> dict:
+    """Load the cached solution of the key, None on a miss."""
+    connection = open_solution_cache(cache_path)
+    try:
+        row = connection.execute(
+            "SELECT solution FROM solutions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        connection.execute(
+            "UPDATE solutions SET last_access = ? WHERE key = ?", (time.time(), key)
+        )
+    finally:
+        connection.close()
+    return json.loads(row[0])
+
+
+def save_solution(
+    cache_path: str, key: str, method_name: str, solution: dict, max_mb: float = DEFAULT_CACHE_MB
+):
+    """Save the solution of the key, evicting the least recently used solutions beyond max_mb."""
+    solution_json = json.dumps(solution)
+    connection = open_solution_cache(cache_path)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?, ?)",
+                (key, method_name, solution_json, len(solution_json), time.time()),
+            )
+            total_size = 0
+            evicted = list()
+            for old_key, size in connection.execute(
+                "SELECT key, size FROM solutions ORDER BY last_access DESC"
+            ).fetchall():
+                total_size += size
+                if total_size > max_mb * 1024 * 1024 and old_key != key:
+                    evicted.append((old_key,))
+            connection.executemany("DELETE FROM solutions WHERE key = ?", evicted)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+    finally:
+        connection.close()
+
+
+def _to_lists(kn_values, dtype=float) -> list:
+    """Convert the values of the groups of each collective to lists of dtype."""
+    return [np.asarray(values, dtype=dtype).tolist() for values in kn_values]
+
+
+def lookup_solution(
+    opt_config: dict,
+    method_name: str,
+    problem_index: ProblemIndex,
+    flow_link_matrix: np.ndarray,
+    keep_order: bool = False,
+):
+    """
+    Look up the cached solution of the problem of a method, if the
+    `solution_cache` of the opt_config is given.
+
+    :return canonical: The canonical form of the problem, None without a cache.
+    :return solution: A dict holding the `rates` (and the `tau` of steller)
+     of the groups of each collective and the `objective`, with the
+     `ablation` rates and objective of steller, None on a miss.
+    """
+    cache_path = opt_config.get("solution_cache", None)
+    if cache_path is None:
+        return None, None
+    canonical = get_canonical_problem(
+        problem_index, flow_link_matrix, method_name, opt_config, keep_order
+    )
+    solution = load_solution(cache_path, canonical.key)
+    if solution is None:
+        return canonical, None
+    logging.info("%s Found the solution of %s in the cache.", "*" * 15, method_name)
+    for name in ("rates", "tau"):
+        if solution.get(name) is not None:
+            solution[name] = canonical.from_canonical(solution[name])
+    if solution.get("ablation") is not None:
+        solution["ablation"]["rates"] = canonical.from_canonical(solution["ablation"]["rates"])
+    return canonical, solution
+
+
+def store_solution(
+    opt_config: dict,
+    canonical: CanonicalProblem,
+    method_name: str,
+    rates,
+    objective: float,
+    tau=None,
+    ablation: tuple = None,
+):
+    """
+    Cache the solution of the problem of a method, if the cache is enabled.
+
+    :param tau: The completion time slots of the groups of steller, kept as ints.
+    :param ablation: The ablation rates of steller and their objective.
+    """
+    if canonical is None:
+        return
+    save_solution(
+        opt_config["solution_cache"],
+        canonical.key,
+        method_name,
+        {
+            "rates": canonical.to_canonical(_to_lists(rates)),
+            "tau": None if tau is None else canonical.to_canonical(_to_lists(tau, int)),
+            "objective": float(objective),
+            "ablation": None
+            if ablation is None
+            else {
+                "rates": canonical.to_canonical(_to_lists(ablation[0])),
+                "objective": float(ablation[1]),
+            },
+        },
+        float(opt_config.get("solution_cache_mb", DEFAULT_CACHE_MB)),
+    )
@@ -0,0 +1,569 @@
+"""
+A warm solver service, which runs the methods on the jobs sent over a local
+Unix socket, or over its stdin/stdout, by a pool of workers keeping their
+imports and the parsed configs with their problem indexes in memory.
+
+The jobs and their responses are JSON lines. A job is like
+```json
+{"id": 1, "config": "toy_example.json", "optconfig": "toy_example_optimization.json", "method": "steller", "params": {"T": 30}}
+```
+where the paths are relative to `configs` unless absolute, and `params`
+overrides the parameters of the `optconfig`. Each job is answered by an
+`accepted` line at once and a `done` (or `error`) line when it is solved,
+in the order the jobs are solved:
+```json
+{"id": 1, "status": "done", "rates": [[...]], "tau": [[...]], "objective": null, "time_cost": {...}, "cached": true, "timing": {"queue": 0.0, "parse": 0.0, "solve": 0.2, "total": 0.2}}
+```
+where `rates` holds the optimized rates of the groups of each collective,
+`tau` the completion times of the groups optimized by the OP of steller, and
+`cached` whether the config was already parsed by the worker. The lines
+`{"op": "ping"}` and `{"op": "shutdown"}` check and stop the service.
+
+```bash
+$ python solver_service.py serve -r ./service -s /tmp/stellar_solver.sock -j 4
+$ python solver_service.py submit -s /tmp/stellar_solver.sock -c toy_example.json -o toy_example_optimization.json -m steller
+$ python solver_service.py bench -c toy_example.json -o toy_example_optimization.json -m steller -n 5
+```
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import asyncio
+import argparse
+import logging
+import tempfile
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from stellar import extract_information
+from run_experiment import method_factory, optimize_method
+from results_store import append_result
+from memory_utils import reset_peak_rss
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), "stellar_solver.sock")
+# The number of parsed configs kept by each worker
+MAX_CACHED_CONFIGS = 8
+
+# The parsed configs of a worker, by their path, modification time and size
+_infos = OrderedDict()
+
+
+def _init_worker():
+    """Send the output of the worker, e.g. of the solvers, to stderr, keeping stdout for the responses."""
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+
+def _warm_worker():
+    """Do nothing, to start a worker ahead of the jobs."""
+    return os.getpid()
+
+
+def get_info(config_path: str):
+    """
+    Get the parsed config of a worker, parsing it when it is not cached or
+    changed since.
+
+    :return info: The extracted information of the config.
+    :return cached: Whether the config was cached.
+    """
+    stat = os.stat(config_path)
+    key = (config_path, stat.st_mtime_ns, stat.st_size)
+    if key in _infos:
+        _infos.move_to_end(key)
+        return _infos[key], True
+    _infos[key] = extract_information(os.path.dirname(config_path), os.path.basename(config_path))
+    while len(_infos) > MAX_CACHED_CONFIGS:
+        _infos.popitem(last=False)
+    return _infos[key], False
+
+
+def run_job(job: dict) -> dict:
+    """
+    Run one job in a worker.
+
+    :param job: A dict holding the `config_path`, the `method`, the `params`
+     of the optimization and the time it is `submitted`, and optionally the
+     `results_db` to append the result to.
+    :return response: The `done` response of the job.
+    """
+    start_time = time.time()
+    # The peak memory of this job, not of the earlier jobs of the worker
+    reset_peak_rss()
+    info, cached = get_info(job["config_path"])
+    parse_time = time.time()
+    opt_parameters = job["params"]
+    optimized_kn_rates, objective_value, time_cost = optimize_method(
+        job["method"], info, opt_parameters
+    )
+    solve_time = time.time()
+
+    rates = None
+    if optimized_kn_rates is not None:
+        rates = [np.asarray(kn_rates, dtype=float).tolist() for kn_rates in optimized_kn_rates]
+    tau = None
+    tau_path = os.path.join(opt_parameters["model_path"], "PriorityOptimization", "big_tau.json")
+    if job["method"] == "steller" and os.path.exists(tau_path):
+        with open(tau_path, "r", encoding="utf-8") as f:
+            tau = list(json.load(f).values())
+    if job.get("results_db") is not None:
+        append_result(
+            job["results_db"],
+            job["config_path"],
+            job["method"],
+            opt_parameters,
+            time_cost,
+            objective_value,
+        )
+
+    return {
+        "status": "done",
+        "rates": rates,
+        "tau": tau,
+        "objective": objective_value,
+        "time_cost": time_cost,
+        "cached": cached,
+        "timing": {
+            "queue": start_time - job["submitted"],
+            "parse": parse_time - start_time,
+            "solve": solve_time - parse_time,
+            "total": time.time() - job["submitted"],
+        },
+    }
+
+
+class SolverService:
+    """
+    The service answering the jobs of its connections by its pool of workers.
+
+    :param results_path: The folder of the results of the jobs, each saved
+     at `<results_path>/<job number>-<method>` unless its `params` give a `model_path`.
+    """
+
+    def __init__(
+        self,
+        config_folder_path: str,
+        results_path: str,
+        n_workers: int = None,
+        results_db: str = None,
+    ):
+        self.config_folder_path = config_folder_path
+        self.results_path = results_path
+        self.results_db = results_db
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.n_workers, initializer=_init_worker)
+        self.n_jobs = 0
+        self.stopping = None
+        # The requests being answered, which are finished before stopping
+        self.pending = set()
+
+    def create_job(self, request: dict) -> dict:
+        """Create the job of a request, resolving its paths and parameters."""
+        if request.get("method") not in method_factory:
+            raise ValueError(f"Unknown method {request.get('method')}, choose from {method_factory}")
+        opt_parameters = dict()
+        if request.get("optconfig") is not None:
+            with open(
+                os.path.join(self.config_folder_path, request["optconfig"]), "r", encoding="utf-8"
+            ) as f:
+                opt_parameters = json.load(f)
+        opt_parameters.update(request.get("params") or dict())
+        self.n_jobs += 1
+        opt_parameters.setdefault(
+            "model_path",
+            os.path.join(self.results_path, f"{self.n_jobs}-{request['method']}"),
+        )
+        return {
+            "config_path": os.path.join(self.config_folder_path, request["config"]),
+            "method": request["method"],
+            "params": opt_parameters,
+            "results_db": self.results_db,
+            "submitted": time.time(),
+        }
+
+    async def handle_request(self, request: dict, send):
+        """Answer one request of a connection."""
+        if request.get("op") == "ping":
+            await send({"status": "pong", "workers": self.n_workers, "jobs": self.n_jobs})
+            return
+        if request.get("op") == "shutdown":
+            await send({"status": "shutdown"})
+            self.stopping.set()
+            return
+
+        job_id = request.get("id")
+        try:
+            job = self.create_job(request)
+        except Exception as error:  # pylint: disable=broad-except
+            await send({"id": job_id, "status": "error", "error": repr(error)})
+            return
+        await send({"id": job_id, "status": "accepted"})
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(
+                self.executor, run_job, job
+            )
+        except Exception as error:  # pylint: disable=broad-except
+            logging.error("-----> Job %s failed: %r", job_id, error)
+            response = {"status": "error", "error": repr(error)}
+        await send({"id": job_id, **response})
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer the requests of one connection, running its jobs concurrently."""
+        lock = asyncio.Lock()
+
+        async def send(message: dict):
+            async with lock:
+                writer.write((json.dumps(message) + "\n").encode("utf-8"))
+                await writer.drain()
+
+        tasks = set()
+        try:
+            while not self.stopping.is_set():
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as error:
+                    await send({"status": "error", "error": f"Invalid JSON: {error}"})
+                    continue
+                task = asyncio.create_task(self.handle_request(request, send))
+                for pending in (tasks, self.pending):
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            # Answer the pending jobs before closing the connection
+            if tasks:
+                await asyncio.gather(*tasks)
+        except (ConnectionResetError, BrokenPipeError):
+            logging.warning("-----> A connection is lost.")
+        except asyncio.CancelledError:
+            pass  # the service is stopped, after answering the pending jobs
+        finally:
+            writer.close()
+
+    async def finish_jobs(self):
+        """Wait for the pending requests to be answered."""
+        if self.pending:
+            logging.info("-----> Finishing %d pending requests.", len(self.pending))
+            await asyncio.gather(*self.pending, return_exceptions=True)
+
+    async def warm_up(self):
+        """Start all workers ahead of the jobs."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self.executor, _warm_worker) for _ in range(self.n_workers))
+        )
+
+    async def serve(self, socket_path: str = None):
+        """
+        Serve on the Unix socket, or on stdin/stdout without a socket, until
+        a shutdown request or a signal.
+        """
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stopping.set)
+        await self.warm_up()
+
+        if socket_path is None:
+            reader = asyncio.StreamReader()
+            await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+            )
+            transport, protocol = await loop.connect_write_pipe(
+                asyncio.streams.FlowControlMixin, sys.stdout
+            )
+            writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+            logging.info("%s Serving %d workers on stdin/stdout.", "*" * 15, self.n_workers)
+            connection = asyncio.create_task(self.handle_connection(reader, writer))
+            stopping = asyncio.create_task(self.stopping.wait())
+            await asyncio.wait([connection, stopping], return_when=asyncio.FIRST_COMPLETED)
+            await self.finish_jobs()
+            for task in (connection, stopping):
+                task.cancel()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+            logging.info("%s Serving %d workers at %s.", "*" * 15, self.n_workers, socket_path)
+            async with server:
+                await self.stopping.wait()
+                # Stop accepting new connections, and answer the pending jobs
+                server.close()
+                await self.finish_jobs()
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        logging.info("%s Served %d jobs.", "*" * 15, self.n_jobs)
+
+
+class SolverClient:
+    """A blocking client of the service over its Unix socket."""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, timeout: float = None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.lines = self.sock.makefile("r", encoding="utf-8")
+        self.n_sent = 0
+
+    def send(self, request: dict):
+        """Send a request."""
+        self.sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+
+    def receive(self) -> dict:
+        """Receive the next response."""
+        line = self.lines.readline()
+        if not line:
+            raise ConnectionError("The service closed the connection.")
+        return json.loads(line)
+
+    def submit(
+        self,
+        config: str,
+        method: str,
+        optconfig: str = None,
+        params: dict = None,
+    ):
+        """Submit a job without waiting for it, returning its id."""
+        self.n_sent += 1
+        self.send(
+            {
+                "id": self.n_sent,
+                "config": config,
+                "optconfig": optconfig,
+                "method": method,
+                "params": params or dict(),
+            }
+        )
+        return self.n_sent
+
+    def solve(self, config: str, method: str, optconfig: str = None, params: dict = None) -> dict:
+        """Submit a job and wait for its response."""
+        job_id = self.submit(config, method, optconfig, params)
+        while True:
+            response = self.receive()
+            if response.get("id") == job_id and response["status"] != "accepted":
+                return response
+
+    def ping(self) -> dict:
+        """Check the service."""
+        self.send({"op": "ping"})
+        return self.receive()
+
+    def shutdown(self):
+        """Stop the service."""
+        self.send({"op": "shutdown"})
+        return self.receive()
+
+    def close(self):
+        """Close the connection."""
+        self.lines.close()
+        self.sock.close()
+
+
+def wait_for_service(
+    socket_path: str, timeout: float = 120.0, process: subprocess.Popen = None
+) -> SolverClient:
+    """Connect to the service once it is ready, run by the optional process."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            client = SolverClient(socket_path)
+            client.ping()
+            return client
+        except (FileNotFoundError, ConnectionRefusedError):
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"The service exited with code {process.returncode}.")
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def benchmark_latency(
+    socket_path: str,
+    config_name: str,
+    optconfig_name: str,
+    method_name: str,
+    n_repeat: int,
+    results_path: str,
+    process: subprocess.Popen = None,
+) -> dict:
+    """
+    Compare the latency of the jobs served warm with that of the cold runs
+    of `run_experiment.py`, a new process each.
+
+    :return latencies: A dict holding the latencies (seconds) of the `cold`
+     and `warm` runs.
+    """
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_experiment.py")
+    latencies = {"cold": list(), "warm": list()}
+    for repeat in range(n_repeat):
+        start_time = time.time()
+        subprocess.run(
+            [
+                sys.executable, script_path, "-r", results_path, "-c", config_name,
+                "-o", optconfig_name, "-p", f"cold-{repeat}", "-m", method_name,
+                "-d", os.path.join(results_path, "cold.db"),
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        latencies["cold"].append(time.time() - start_time)
+        logging.info("-----> Cold run %d: %.3f s", repeat + 1, latencies["cold"][-1])
+
+    client = wait_for_service(socket_path, process=process)
+    try:
+        # The first job parses the config, as the cold runs do
+        response = client.solve(config_name, method_name, optconfig_name)
+        if response["status"] != "done":
+            raise RuntimeError(f"The job failed: {response.get('error')}")
+        for repeat in range(n_repeat):
+            start_time = time.time()
+            client.solve(config_name, method_name, optconfig_name)
+            latencies["warm"].append(time.time() - start_time)
+            logging.info("-----> Warm run %d: %.3f s", repeat + 1, latencies["warm"][-1])
+    finally:
+        client.close()
+    return latencies
+
+
+def _main():
+    """Serve, submit to or benchmark the solver service."""
+    parser = argparse.ArgumentParser(description="A warm solver service.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Serve the jobs")
+    serve_parser.add_argument(
+        "-r", "--results", type=str, default="./service", help="Path to results"
+    )
+    serve_parser.add_argument(
+        "-s", "--socket", type=str, default=DEFAULT_SOCKET, help="Path to the Unix socket"
+    )
+    serve_parser.add_argument(
+        "--stdio", action="store_true", help="Serve on stdin/stdout instead of the socket"
+    )
+    serve_parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="Number of workers"
+    )
+    serve_parser.add_argument(
+        "-d", "--database", type=str, default=None, help="Path to the results store, if any"
+    )
+
+    submit_parser = subparsers.add_parser("submit", help="Submit a job and print its response")
+    submit_parser.add_argument(
+        "-s", "--socket", type=str, default=DEFAULT_SOCKET, help="Path to the Unix socket"
+    )
+    submit_parser.add_argument(
+        "-c", "--config", type=str, required=True, help="Path to config file"
+    )
+    submit_parser.add_argument(
+        "-o", "--optconfig", type=str, default=None, help="Config file for the optimization"
+    )
+    submit_parser.add_argument(
+        "-m", "--method", type=str, required=True, choices=method_factory, help="Method"
+    )
+    submit_parser.add_argument(
+        "-P", "--params", type=str, default=None, help="JSON of the overridden parameters"
+    )
+
+    bench_parser = subparsers.add_parser(
+        "bench", help="Compare the latency of the service with cold runs"
+    )
+    bench_parser.add_argument(
+        "-c", "--config", type=str, required=True, help="Path to config file"
+    )
+    bench_parser.add_argument(
+        "-o", "--optconfig", type=str, required=True, help="Config file for the optimization"
+    )
+    bench_parser.add_argument(
+        "-m", "--method", type=str, required=True, choices=method_factory, help="Method"
+    )
+    bench_parser.add_argument(
+        "-n", "--repeat", type=int, default=5, help="Number of runs of each kind"
+    )
+    bench_parser.add_argument(
+        "-r", "--results", type=str, default=None, help="Path to results, a temporary folder by default"
+    )
+
+    args = parser.parse_args()
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    config_folder_path = os.path.join(base_path, "configs")
+
+    if args.command == "serve":
+        service = SolverService(
+            config_folder_path, args.results, n_workers=args.jobs, results_db=args.database
+        )
+        asyncio.run(service.serve(None if args.stdio else args.socket))
+
+    elif args.command == "submit":
+        client = SolverClient(args.socket)
+        try:
+            response = client.solve(
+                args.config,
+                args.method,
+                args.optconfig,
+                json.loads(args.params) if args.params else None,
+            )
+        finally:
+            client.close()
+        print(json.dumps(response, indent=4))
+        if response["status"] != "done":
+            sys.exit(1)
+
+    else:
+        results_path = args.results or tempfile.mkdtemp(prefix="solver_bench_")
+        os.makedirs(results_path, exist_ok=True)
+        socket_path = os.path.join(results_path, "solver.sock")
+        server = subprocess.Popen(
+            [
+                sys.executable, os.path.abspath(__file__), "serve",
+                "-r", os.path.join(results_path, "service"), "-s", socket_path, "-j", "1",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            latencies = benchmark_latency(
+                socket_path,
+                args.config,
+                args.optconfig,
+                args.method,
+                args.repeat,
+                results_path,
+                process=server,
+            )
+            client = SolverClient(socket_path)
+            client.shutdown()
+            client.close()
+            server.wait(timeout=60)
+        finally:
+            if server.poll() is None:
+                server.terminate()
+        cold, warm = np.median(latencies["cold"]), np.median(latencies["warm"])
+        logging.info(
+            "%s %s on %s, median latency: cold %.3f s, warm %.3f s, %.1fx faster.",
+            "*" * 15,
+            args.method,
+            args.config,
+            cold,
+            warm,
+            cold / warm,
+        )
+
+
+if __name__ == "__main__":
+    _main()
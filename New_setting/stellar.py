@@ -13,6 +13,11 @@ import numpy as np
 
 from priority import optimize_completion_time
 from allocation import optimize_flow_rates, optimize_lp_flow_rates
+from opt_utils import create_problem_index, get_flow_dependencies, get_topological_levels
+from tracing import trace
+from memory_utils import check_memory_budget
+from solution_cache import lookup_solution, store_solution
+from utils import save_results, save_alloc_solutions
 from generic import (
     BaseFlow,
     BaseLink,
@@ -21,6 +26,7 @@ from generic import (
     FlowLinkSendHolder,
     CollectiveGroupContainer,
     FlowCGHolder,
+    ProblemIndex,
 )
 
 
@@ -91,6 +97,7 @@ def create_fl_send_holder(
     """Creating the holder for the send of flows in links"""
     fl_sender = FlowLinkSendHolder(fl_holder=fl_holder)
 
+    check_memory_budget("capacity and data matrices", 2 * fl_holder.matrix.nbytes)
     matrix1 = np.zeros_like(fl_holder.matrix)
     matrix2 = np.zeros_like(fl_holder.matrix)
     for i in range(fl_holder.F):
@@ -129,13 +136,15 @@ def create_fcgd_holder(flow_container: BaseContainer) -> FlowCGHolder:
     n_flows = len(flow_container.item_ids)
     matrix = np.zeros((n_flows, 3), dtype=int)
     mapper = dict()
+    # The send order of a flow is its level in the dependency DAG
+    flow_levels, _, _ = get_topological_levels(*get_flow_dependencies(flow_container))
     for idx, flow in enumerate(flow_container.item_objs):
         matrix[idx, 0] = flow.collective_id
         matrix[idx, 1] = flow.group_id
-        matrix[idx, 2] = flow.get_dependency_order()
+        matrix[idx, 2] = flow_levels[idx]
         mapper["collective"] = flow.collective_id
         mapper["group"] = flow.group_id
-        mapper["order"] = flow.get_dependency_order()
+        mapper["order"] = int(flow_levels[idx])
 
     fcg_holder = FlowCGHolder(
         flow_ids=flow_container.item_ids, f2cgd_mapper=mapper, matrix=matrix
@@ -148,20 +157,30 @@ def extract_information(config_path: str, filename: str):
     """Extracting the information from the configuration file."""
     # load the json to dict
     file_path = os.path.join(config_path, filename)
-    with open(file_path, "r", encoding="utf-8") as f:
+    with trace("parse.load_json"), open(file_path, "r", encoding="utf-8") as f:
         info_data = json.load(f)
 
-    f_container, l_container = create_fl_containers(info_data)
-    fl_holder = create_fl_holder(f_container, l_container)
-    fl_s_holder = create_fl_send_holder(fl_holder, f_container, l_container)
+    with trace("parse.containers"):
+        f_container, l_container = create_fl_containers(info_data)
+    with trace("parse.matrices"):
+        fl_holder = create_fl_holder(f_container, l_container)
+        fl_s_holder = create_fl_send_holder(fl_holder, f_container, l_container)
 
     # Create the collective groups holder
-    cg_holder = create_cg_holder(flow_container=f_container)
+    with trace("parse.cg_holder"):
+        cg_holder = create_cg_holder(flow_container=f_container)
 
     # Create the collective group flow holder
-    fcg_holder = create_fcgd_holder(flow_container=f_container)
+    with trace("parse.fcgd_holder"):
+        fcg_holder = create_fcgd_holder(flow_container=f_container)
 
-    return f_container, l_container, fl_s_holder, cg_holder, fcg_holder
+    # Create the index shared by all methods
+    with trace("parse.problem_index"):
+        problem_index = create_problem_index(
+            f_container, l_container, fl_s_holder, cg_holder, fcg_holder
+        )
+
+    return f_container, l_container, fl_s_holder, cg_holder, fcg_holder, problem_index
 
 
 def match_flow_tau(
@@ -193,6 +212,7 @@ def perform_steller(
     cg_container: CollectiveGroupContainer,
     fcg_holder: FlowCGHolder,
     opt_config: dict,
+    problem_index: ProblemIndex = None,
 ):
     """
     Performing the stellar algorithm toward optimizing the flow rates of groups to minimize the average completion time of collectives.
@@ -212,17 +232,68 @@ def perform_steller(
 
     :param fcg_holder: A FlowCGHolder containing the flow-collective-group relation.
      With fcg_holder.matrix: [N, 3]
+
+    :param problem_index: A ProblemIndex shared by all methods, created from the
+     holders when it is not given.
+
+    :return best_kn_rates: The optimized rates of the groups of each collective.
+    :return objective: The average completion time of the collectives under these rates.
+    :return time_cost: The time costs of the OP and the OR.
     """
+    if problem_index is None:
+        problem_index = create_problem_index(
+            flow_container, link_container, fl_s_holder, cg_container, fcg_holder
+        )
+
     start_op = time.time()
 
+    # The same problem may be solved before, with other ids of its flows and collectives
+    with trace("steller.cache_lookup"):
+        canonical, cached = lookup_solution(
+            opt_config, "steller", problem_index, fl_s_holder.fl_holder.matrix
+        )
+    if cached is not None:
+        best_kn_rates = [np.array(rates) for rates in cached["rates"]]
+        save_path = os.path.join(opt_config["model_path"], "PriorityOptimization")
+        os.makedirs(save_path, exist_ok=True)
+        save_results(
+            os.path.join(save_path, "big_tau.json"),
+            [f"collective {k}" for k in range(1, len(cached["tau"]) + 1)],
+            cached["tau"],
+        )
+        save_path = os.path.join(opt_config["model_path"], "AllocationOptimization")
+        os.makedirs(save_path, exist_ok=True)
+        save_alloc_solutions(
+            os.path.join(save_path, "optimized_flow_rates.json"),
+            [(best_kn_rates, cached["objective"])],
+        )
+        # The dumps of the OP model are not cached, only its big tau
+        if cached.get("ablation") is not None:
+            save_alloc_solutions(
+                os.path.join(save_path, "ablation_flow_rates.json"),
+                [
+                    (
+                        [np.array(rates) for rates in cached["ablation"]["rates"]],
+                        cached["ablation"]["objective"],
+                    )
+                ],
+            )
+        return (
+            best_kn_rates,
+            cached["objective"],
+            {"OP-Time": time.time() - start_op, "OR-Time": 0.0},
+        )
+
     # Stage 1. Optimizing the completion times of groups
-    _, _, big_tau = optimize_completion_time(
-        link_container,
-        fl_s_holder,
-        cg_container,
-        fcg_holder,
-        opt_parameters=opt_config,
-    )
+    with trace("steller.op"):
+        _, _, big_tau = optimize_completion_time(
+            link_container,
+            fl_s_holder,
+            cg_container,
+            fcg_holder,
+            opt_parameters=opt_config,
+            problem_index=problem_index,
+        )
     end_op = time.time()
     # Stage 2. Optimizing the flow rates of groups
     # optimal_sol, _, _ = optimize_flow_rates(
@@ -235,20 +306,31 @@ def perform_steller(
     #     opt_parameters=opt_config,
     # )
     start_or = time.time()
-    optimal_sol, ablation_sol, _ = optimize_lp_flow_rates(
-        flow_container,
-        big_tau,
-        link_container,
-        fl_s_holder,
-        cg_container,
-        fcg_holder,
-        opt_parameters=opt_config,
-    )
+    with trace("steller.or"):
+        optimal_sol, ablation_sol, _ = optimize_lp_flow_rates(
+            flow_container,
+            big_tau,
+            link_container,
+            fl_s_holder,
+            cg_container,
+            fcg_holder,
+            opt_parameters=opt_config,
+            problem_index=problem_index,
+        )
     end_or = time.time()
 
     best_kn_rates = optimal_sol[0]
     # Toward ablation study, we get the flow rates based on the big tau
     # of the OP - Stage 1 of our algorithm
     ablation_kn_rates = ablation_sol[0]
+    store_solution(
+        opt_config,
+        canonical,
+        "steller",
+        best_kn_rates,
+        optimal_sol[1],
+        tau=big_tau,
+        ablation=ablation_sol,
+    )
     time_cost = {"OP-Time": end_op - start_op, "OR-Time": end_or - start_or}
-    return best_kn_rates, time_cost
+    return best_kn_rates, optimal_sol[1], time_cost
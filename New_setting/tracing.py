@@ -0,0 +1,230 @@
+"""
+A lightweight tracing of the phases of the methods, e.g. parsing the config,
+building and solving the models and saving the results.
+
+The phases are marked by the `trace` context manager or the `traced`
+decorator, which do nothing until a tracer is started by `start_tracing`.
+The spans of a tracer are saved as a Chrome trace, which can be opened by
+`chrome://tracing` or https://ui.perfetto.dev, and summed up by their names.
+
+A tracer started with `memory` also records the peak resident memory and
+the peak of the memory allocated by Python of each span, and each span
+checks the memory budget of `memory_utils` when it starts.
+"""
+
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+from contextlib import nullcontext
+from typing import List
+
+from memory_utils import MB, check_memory_budget, get_rss, get_peak_rss, reset_peak_rss
+
+# The tracer of the current process, None when the tracing is disabled
+_tracer = None
+# The span given when the tracing is disabled, which does nothing
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    """A span of a tracer, recorded as a complete event when it exits."""
+
+    __slots__ = (
+        "tracer", "name", "args", "start_us", "start_ns", "child_ns", "rss_peak", "traced_peak"
+    )
+
+    def __init__(self, tracer, name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.child_ns = 0
+        tracer = self.tracer
+        check_memory_budget(self.name)
+        if tracer.memory:
+            # The peaks are reset for this span, so its parent keeps its own so far
+            if tracer._stack:
+                tracer._stack[-1].update_peaks()
+            reset_peak_rss()
+            tracemalloc.reset_peak()
+            self.rss_peak = get_rss() or 0.0
+            self.traced_peak = tracemalloc.get_traced_memory()[0] / MB
+        tracer._stack.append(self)
+        self.start_us = time.time_ns() / 1000
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def update_peaks(self):
+        """Update the peaks of the span with those of the process since the last reset."""
+        self.rss_peak = max(self.rss_peak, get_peak_rss() or 0.0)
+        self.traced_peak = max(self.traced_peak, tracemalloc.get_traced_memory()[1] / MB)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration_ns = time.perf_counter_ns() - self.start_ns
+        tracer = self.tracer
+        tracer._stack.pop()
+        if tracer._stack:
+            tracer._stack[-1].child_ns += duration_ns
+        if tracer.memory:
+            self.update_peaks()
+            if tracer._stack:
+                parent = tracer._stack[-1]
+                parent.rss_peak = max(parent.rss_peak, self.rss_peak)
+                parent.traced_peak = max(parent.traced_peak, self.traced_peak)
+        event = {
+            "name": self.name,
+            "cat": self.name.split(".", 1)[0],
+            "ph": "X",
+            "ts": self.start_us,
+            "dur": duration_ns / 1000,
+            "pid": tracer.pid,
+            "tid": threading.get_ident(),
+        }
+        if self.args or exc_type is not None or tracer.memory:
+            event["args"] = dict(self.args)
+            if exc_type is not None:
+                event["args"]["error"] = exc_type.__name__
+            if tracer.memory:
+                event["args"]["rss_peak_mb"] = round(self.rss_peak, 3)
+                event["args"]["traced_peak_mb"] = round(self.traced_peak, 3)
+        tracer.events.append(event)
+        tracer._self_ns[self.name] = tracer._self_ns.get(self.name, 0) + duration_ns - self.child_ns
+        return False
+
+
+class Tracer:
+    """
+    The spans of one process, in the order they end.
+
+    :param events: The optional events of the previous phases, e.g. the
+     parsing of the config in the parent process.
+    :param memory: Whether to record the peak memory of each span, where
+     tracemalloc is started if needed.
+    """
+
+    def __init__(self, events: List[dict] = None, memory: bool = False):
+        self.pid = os.getpid()
+        self.events = list(events or ())
+        self.memory = memory
+        self._stack = list()
+        # The time of each name outside its child spans
+        self._self_ns = dict()
+        # Whether tracemalloc is started by this tracer, to be stopped with it
+        self._owns_tracemalloc = memory and not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start()
+
+    def span(self, name: str, args: dict = None) -> _Span:
+        """Get a span of the name, to be entered by `with`."""
+        return _Span(self, name, args or dict())
+
+    def summary(self) -> dict:
+        """
+        Sum up the spans by their names.
+
+        :return summary: A dict holding the `count`, the `total` time and the
+         `self` time outside the child spans (seconds) of each name, in the
+         order the names first end.
+        """
+        total_ns = dict()
+        counts = dict()
+        for event in self.events:
+            total_ns[event["name"]] = total_ns.get(event["name"], 0) + round(event["dur"] * 1000)
+            counts[event["name"]] = counts.get(event["name"], 0) + 1
+        # The events of other tracers, e.g. of the parent, only have their total time
+        return {
+            name: {
+                "count": counts[name],
+                "total": total_ns[name] / 1e9,
+                "self": self._self_ns.get(name, total_ns[name]) / 1e9,
+            }
+            for name in total_ns
+        }
+
+    def memory_summary(self) -> dict:
+        """
+        Get the largest peaks of the spans of each name, including those of
+        other tracers recorded with their memory.
+
+        :return summary: A dict holding the `rss_peak` and `traced_peak` (MB)
+         of each name, and of all spans under `total`.
+        """
+        summary = dict()
+        for event in self.events:
+            args = event.get("args", dict())
+            if "rss_peak_mb" not in args:
+                continue
+            for name in (event["name"], "total"):
+                record = summary.setdefault(name, {"rss_peak": 0.0, "traced_peak": 0.0})
+                record["rss_peak"] = max(record["rss_peak"], args["rss_peak_mb"])
+                record["traced_peak"] = max(record["traced_peak"], args["traced_peak_mb"])
+        if "total" in summary:
+            summary["total"] = summary.pop("total")
+        return summary
+
+    def close(self):
+        """Stop tracemalloc if it is started by this tracer."""
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+
+    def save(self, trace_path: str):
+        """Save the spans as a Chrome trace."""
+        os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+        with open(trace_path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+def start_tracing(events: List[dict] = None, memory: bool = False) -> Tracer:
+    """Start tracing the current process, replacing its previous tracer."""
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = Tracer(events, memory)
+    return _tracer
+
+
+def stop_tracing() -> Tracer:
+    """Stop tracing the current process, returning its tracer if any."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+    return tracer
+
+
+def get_tracer() -> Tracer:
+    """Get the tracer of the current process, None when the tracing is disabled."""
+    return _tracer
+
+
+def trace(name: str, **args):
+    """
+    Trace a phase by `with trace("op.solve"):`, where the prefix of the name
+    before the first dot is its category.
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, args)
+
+
+def traced(name: str = None):
+    """Trace each call of the decorated function, named after it by default."""
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
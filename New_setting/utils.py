@@ -3,8 +3,11 @@ Some utility functions for the stellar example.
 """
 
 import json
+import logging
 from typing import List
 
+import numpy as np
+
 
 def save_variables(save_path, variables):
     """Saving the optimization variables to a file."""
@@ -47,3 +50,45 @@ def save_alloc_solutions(save_path, solutions: List[tuple]):
     solutions = [str(sol) for sol in solutions]
     with open(save_path, "w", encoding="utf-8") as f:
         json.dump(solutions, f, indent=4)
+
+
+def save_chunk_schedule(save_path, schedule, formats=("csv", "npz")):
+    """
+    Save the columns of the schedule at once to `<save_path>.<format>` for
+    each of the formats "csv", "npz" and "parquet", where "parquet" is
+    skipped without pyarrow.
+    """
+    names = list(schedule)
+    columns = [np.asarray(schedule[name]) for name in names]
+    for save_format in formats:
+        file_path = f"{save_path}.{save_format}"
+        if save_format == "csv":
+            fmt = [
+                {"i": "%d", "u": "%d", "f": "%g"}.get(column.dtype.kind, "%s")
+                for column in columns
+            ]
+            np.savetxt(
+                file_path,
+                np.rec.fromarrays(columns, names=names),
+                fmt=",".join(fmt),
+                header=",".join(names),
+                comments="",
+            )
+        elif save_format == "npz":
+            np.savez_compressed(file_path, **dict(zip(names, columns)))
+        elif save_format == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                logging.warning(
+                    "Saving the schedule as parquet requires pyarrow, skip %s.", file_path
+                )
+                continue
+            pyarrow.parquet.write_table(
+                pyarrow.table(dict(zip(names, columns))), file_path
+            )
+        else:
+            raise ValueError(
+                f"Unknown schedule format {save_format}, choose from csv, npz and parquet."
+            )
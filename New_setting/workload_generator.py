@@ -0,0 +1,482 @@
+"""
+A generator of synthetic workloads, writing configs in the schema of the
+shipped ones, to test the scaling of the methods beyond their sizes.
+
+The collectives follow a pattern over the endpoints of a topology:
+- ring_allreduce: each group is one chunk of the data sent around the ring
+  of the participants in 2(P - 1) steps, one after another.
+- tree_broadcast: each group is one chunk of the data sent from the root
+  down a tree of the participants, where a flow follows the flow bringing
+  the chunk to its source.
+- random: each group is a random DAG of flows between random endpoints.
+
+over the topologies:
+- fat_tree: a k-ary fat-tree, whose hosts are the endpoints, routed up and
+  down by a hash of the endpoints like ECMP.
+- torus: a torus of any dimensions, routed dimension by dimension.
+- zoo: a TopologyZoo-like graph, i.e., a sparse geographic graph whose
+  nodes are placed in a unit square and mostly linked to their neighbors,
+  routed by the shortest paths.
+
+For example, about 10^5 flows of ring all-reduce over a 16-ary fat-tree:
+```bash
+$ python workload_generator.py -s configs/synthetic/fat_tree_rar.json -t fat_tree --k 16 -p ring_allreduce --participants 16 --flows 100000 --seed 0
+```
+"""
+
+import os
+import json
+import argparse
+import logging
+from collections import deque
+from typing import List, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+topology_factory = ["fat_tree", "torus", "zoo"]
+pattern_factory = ["ring_allreduce", "tree_broadcast", "random"]
+
+# The config of the optimization written next to each generated config,
+# where the OP extends T to the lower bounds of the groups when needed
+DEFAULT_OPTIMIZATION = {
+    "T": 20,
+    "segment_base": 1,
+    "is_segment": "False",
+    "small_lambda": 0.2,
+    "jump_range": 40,
+}
+
+
+class Topology:
+    """
+    A topology holding its directed links and routing its endpoints.
+
+    The nodes are numbered from 1, and each undirected edge is two links,
+    one per direction.
+    """
+
+    def __init__(self, n_nodes: int, edges: List[Tuple[int, int]], endpoints: List[int]):
+        self.n_nodes = n_nodes
+        self.endpoints = endpoints
+        # The link of each directed edge, numbered from 1
+        self.links = dict()
+        self.neighbors = [[] for _ in range(n_nodes + 1)]
+        for node_u, node_v in edges:
+            for src, dst in ((node_u, node_v), (node_v, node_u)):
+                if (src, dst) not in self.links:
+                    self.links[(src, dst)] = len(self.links) + 1
+                    self.neighbors[src].append(dst)
+        self._routes = dict()
+
+    def route_nodes(self, src: int, dst: int) -> List[int]:
+        """Get the nodes of the route from src to dst."""
+        raise NotImplementedError
+
+    def route(self, src: int, dst: int) -> List[int]:
+        """Get the links of the route from src to dst."""
+        if (src, dst) not in self._routes:
+            nodes = self.route_nodes(src, dst)
+            self._routes[(src, dst)] = [
+                self.links[(node_u, node_v)] for node_u, node_v in zip(nodes[:-1], nodes[1:])
+            ]
+        return self._routes[(src, dst)]
+
+
+class FatTree(Topology):
+    """
+    A k-ary fat-tree with k pods of k/2 edge and k/2 aggregation switches,
+    (k/2)^2 core switches and k/2 hosts under each edge switch.
+    """
+
+    def __init__(self, k: int):
+        if k < 2 or k % 2:
+            raise ValueError(f"The fat-tree needs an even k >= 2, got {k}.")
+        half = k // 2
+        n_hosts = k * half * half
+        # Node numbers: hosts, then edge, aggregation and core switches
+        self.k = k
+        self.host_base = 1
+        self.edge_base = self.host_base + n_hosts
+        self.agg_base = self.edge_base + k * half
+        self.core_base = self.agg_base + k * half
+        n_nodes = self.core_base + half * half - 1
+
+        edges = list()
+        for pod in range(k):
+            for j in range(half):
+                edge = self.edge_base + pod * half + j
+                for i in range(half):
+                    edges.append((self.host_base + (pod * half + j) * half + i, edge))
+                for a in range(half):
+                    edges.append((edge, self.agg_base + pod * half + a))
+            for a in range(half):
+                for c in range(half):
+                    edges.append((self.agg_base + pod * half + a, self.core_base + a * half + c))
+        super().__init__(n_nodes, edges, list(range(self.host_base, self.edge_base)))
+
+    def route_nodes(self, src: int, dst: int) -> List[int]:
+        half = self.k // 2
+        src_edge_idx = (src - self.host_base) // half
+        dst_edge_idx = (dst - self.host_base) // half
+        src_edge = self.edge_base + src_edge_idx
+        dst_edge = self.edge_base + dst_edge_idx
+        if src_edge == dst_edge:
+            return [src, src_edge, dst]
+        # Pick the aggregation and core switches by a hash of the endpoints
+        path_hash = (src * 2654435761 + dst * 40503) % (1 << 31)
+        agg_idx = path_hash % half
+        src_pod, dst_pod = src_edge_idx // half, dst_edge_idx // half
+        src_agg = self.agg_base + src_pod * half + agg_idx
+        if src_pod == dst_pod:
+            return [src, src_edge, src_agg, dst_edge, dst]
+        core = self.core_base + agg_idx * half + (path_hash // half) % half
+        dst_agg = self.agg_base + dst_pod * half + agg_idx
+        return [src, src_edge, src_agg, core, dst_agg, dst_edge, dst]
+
+
+class Torus(Topology):
+    """A torus whose nodes are all endpoints, e.g. a 2D torus of 8 x 8 nodes."""
+
+    def __init__(self, dims: List[int]):
+        if not dims or min(dims) < 2:
+            raise ValueError(f"The torus needs dimensions >= 2, got {dims}.")
+        self.dims = list(dims)
+        self.strides = np.cumprod([1] + self.dims[:-1]).tolist()
+        n_nodes = int(np.prod(self.dims))
+        edges = list()
+        for node_idx in range(n_nodes):
+            coords = self._coords(node_idx)
+            for dim, size in enumerate(self.dims):
+                if size == 2 and coords[dim] == 1:
+                    continue  # the only neighbor along this dimension is already linked
+                neighbor = list(coords)
+                neighbor[dim] = (coords[dim] + 1) % size
+                edges.append((node_idx + 1, self._index(neighbor) + 1))
+        super().__init__(n_nodes, edges, list(range(1, n_nodes + 1)))
+
+    def _coords(self, node_idx: int) -> List[int]:
+        return [(node_idx // stride) % size for stride, size in zip(self.strides, self.dims)]
+
+    def _index(self, coords: List[int]) -> int:
+        return sum(coord * stride for coord, stride in zip(coords, self.strides))
+
+    def route_nodes(self, src: int, dst: int) -> List[int]:
+        coords = self._coords(src - 1)
+        dst_coords = self._coords(dst - 1)
+        nodes = [src]
+        for dim, size in enumerate(self.dims):
+            forward = (dst_coords[dim] - coords[dim]) % size
+            step = 1 if forward <= size - forward else -1
+            while coords[dim] != dst_coords[dim]:
+                coords[dim] = (coords[dim] + step) % size
+                nodes.append(self._index(coords) + 1)
+        return nodes
+
+
+class ZooTopology(Topology):
+    """
+    A TopologyZoo-like graph of n nodes placed in a unit square, where each
+    node is linked to its nearest previous node, forming a spanning tree,
+    and extra edges link near nodes until the average degree is reached.
+    """
+
+    def __init__(self, n_nodes: int, degree: float, rng: np.random.Generator):
+        if n_nodes < 2:
+            raise ValueError(f"The zoo topology needs at least 2 nodes, got {n_nodes}.")
+        positions = rng.random((n_nodes, 2))
+        distances = np.linalg.norm(positions[:, None, :] - positions[None, :, :], axis=-1)
+        edges = set()
+        for node_idx in range(1, n_nodes):
+            nearest = int(np.argmin(distances[node_idx, :node_idx]))
+            edges.add((nearest + 1, node_idx + 1))
+        # The extra edges are drawn among the pairs of near nodes
+        n_edges = max(n_nodes - 1, int(round(degree * n_nodes / 2)))
+        n_near = min(n_nodes - 1, 6)
+        near = np.argsort(distances, axis=1)[:, 1 : n_near + 1]
+        candidates = sorted(
+            {
+                (min(node_idx, other) + 1, max(node_idx, other) + 1)
+                for node_idx in range(n_nodes)
+                for other in near[node_idx].tolist()
+            }
+            - edges
+        )
+        n_extra = min(len(candidates), n_edges - len(edges))
+        for cand_idx in rng.choice(len(candidates), size=n_extra, replace=False):
+            edges.add(candidates[cand_idx])
+        super().__init__(n_nodes, sorted(edges), list(range(1, n_nodes + 1)))
+        self._parents = dict()
+
+    def route_nodes(self, src: int, dst: int) -> List[int]:
+        if src not in self._parents:
+            # The BFS tree of the shortest paths from src
+            parents = [0] * (self.n_nodes + 1)
+            parents[src] = src
+            frontier = deque([src])
+            while frontier:
+                node = frontier.popleft()
+                for neighbor in self.neighbors[node]:
+                    if not parents[neighbor]:
+                        parents[neighbor] = node
+                        frontier.append(neighbor)
+            self._parents[src] = parents
+        parents = self._parents[src]
+        nodes = [dst]
+        while nodes[-1] != src:
+            nodes.append(parents[nodes[-1]])
+        return nodes[::-1]
+
+
+def create_topology(topology_name: str, args, rng: np.random.Generator) -> Topology:
+    """Create the topology given by its name and the arguments."""
+    if topology_name == "fat_tree":
+        return FatTree(args.k)
+    if topology_name == "torus":
+        return Torus(args.dims)
+    if topology_name == "zoo":
+        return ZooTopology(args.nodes, args.degree, rng)
+    raise ValueError(f"Unknown topology {topology_name}, choose from {topology_factory}")
+
+
+def ring_allreduce(participants: np.ndarray, n_chunks: int, rng: np.random.Generator):
+    """
+    Get the flows of a ring all-reduce, as (group, src, dst, dependency) with
+    the dependency given by the position of a flow in the collective.
+    """
+    n_parts = len(participants)
+    flows = list()
+    for chunk in range(n_chunks):
+        prev_pos = None
+        for step in range(2 * (n_parts - 1)):
+            src = participants[(chunk + step) % n_parts]
+            dst = participants[(chunk + step + 1) % n_parts]
+            flows.append((chunk, src, dst, [] if prev_pos is None else [prev_pos]))
+            prev_pos = len(flows) - 1
+    return flows
+
+
+def tree_broadcast(participants: np.ndarray, n_chunks: int, rng: np.random.Generator, fanout: int = 2):
+    """
+    Get the flows of a broadcast from the first participant down a tree
+    with the fanout, where the chunks are pipelined down the tree.
+    """
+    flows = list()
+    for chunk in range(n_chunks):
+        # The position of the flow bringing the chunk to each participant
+        arrivals = dict()
+        for child_idx in range(1, len(participants)):
+            parent_idx = (child_idx - 1) // fanout
+            dependency = [arrivals[parent_idx]] if parent_idx in arrivals else []
+            flows.append((chunk, participants[parent_idx], participants[child_idx], dependency))
+            arrivals[child_idx] = len(flows) - 1
+    return flows
+
+
+def random_pattern(participants: np.ndarray, n_chunks: int, rng: np.random.Generator, chain: int = 8):
+    """
+    Get the flows of random groups, each of `chain` flows between random
+    participants, where each flow depends on one or two earlier flows of its group.
+    """
+    n_parts = len(participants)
+    # Draw all the endpoints and dependencies at once, a distinct dst by an offset from src
+    src_idx = rng.integers(n_parts, size=(n_chunks, chain))
+    dst_idx = (src_idx + rng.integers(1, n_parts, size=(n_chunks, chain))) % n_parts
+    first_deps = (rng.random((n_chunks, chain)) * np.arange(chain)).astype(int)
+    second_deps = (rng.random((n_chunks, chain)) * np.arange(chain)).astype(int)
+    has_second = rng.random((n_chunks, chain)) < 0.2
+    flows = list()
+    for chunk in range(n_chunks):
+        first_pos = len(flows)
+        for flow_idx in range(chain):
+            dependency = list()
+            if flow_idx:
+                dependency = [first_pos + int(first_deps[chunk, flow_idx])]
+                second_dep = first_pos + int(second_deps[chunk, flow_idx])
+                if has_second[chunk, flow_idx] and second_dep != dependency[0]:
+                    dependency.append(second_dep)
+            flows.append(
+                (
+                    chunk,
+                    participants[src_idx[chunk, flow_idx]],
+                    participants[dst_idx[chunk, flow_idx]],
+                    dependency,
+                )
+            )
+    return flows
+
+
+def get_collective_size(pattern_name: str, n_participants: int, n_chunks: int, chain: int) -> int:
+    """Get the number of flows of one collective of the pattern."""
+    if pattern_name == "ring_allreduce":
+        return n_chunks * 2 * (n_participants - 1)
+    if pattern_name == "tree_broadcast":
+        return n_chunks * (n_participants - 1)
+    return n_chunks * chain
+
+
+def generate_workload(
+    save_path: str,
+    topology: Topology,
+    pattern_name: str,
+    n_collectives: int,
+    n_participants: int,
+    n_chunks: int,
+    rng: np.random.Generator,
+    size_mb: float = 40.0,
+    capacity_mbps: float = 200.0,
+    fanout: int = 2,
+    chain: int = 8,
+) -> int:
+    """
+    Generate the collectives of the pattern on the topology, and write them
+    to a config, flow by flow, so that millions of flows are never held at once.
+
+    :param n_chunks: The number of groups of each collective, i.e., the
+     chunks of the data for the ring all-reduce and the broadcast.
+    :param size_mb: The median data (MB) of a collective, split evenly among
+     its chunks and drawn from a lognormal distribution.
+    :param capacity_mbps: The mean capacity (Mbps) of the links, within 10%.
+    :return n_flows: The number of flows written.
+    """
+    if n_participants > len(topology.endpoints):
+        raise ValueError(
+            f"{n_participants} participants exceed the {len(topology.endpoints)} endpoints."
+        )
+    if n_participants < 2:
+        raise ValueError("A collective needs at least 2 participants.")
+    endpoints = np.array(topology.endpoints)
+    capacities = capacity_mbps * 1e6 * rng.uniform(0.9, 1.1, size=len(topology.links))
+
+    os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
+    n_flows = 0
+    group_base = 0
+    with open(save_path, "w", encoding="utf-8") as f:
+        f.write('{"type": "unicast", "link_to_edge": ')
+        json.dump({str(link): [src, dst] for (src, dst), link in topology.links.items()}, f)
+        f.write(', "link_capacities": ')
+        json.dump(
+            {str(link): int(capacities[link - 1]) for link in topology.links.values()}, f
+        )
+        for coll_idx in range(n_collectives):
+            participants = rng.choice(endpoints, size=n_participants, replace=False).tolist()
+            if pattern_name == "ring_allreduce":
+                flows = ring_allreduce(participants, n_chunks, rng)
+            elif pattern_name == "tree_broadcast":
+                flows = tree_broadcast(participants, n_chunks, rng, fanout)
+            else:
+                flows = random_pattern(participants, n_chunks, rng, chain)
+            # The totals are in bits, as the capacities, and the parser reads whole
+            # MB, so that each flow carries at least 1 MB
+            chunk_total = size_mb * 8 * 1024 * 1024 * rng.lognormal(0.0, 0.25) / n_chunks
+            totals = np.maximum(
+                chunk_total * rng.uniform(0.9, 1.1, size=len(flows)), 8 * 1024 * 1024
+            ).astype(int).tolist()
+            first_id = n_flows + 1
+            for (chunk, src, dst, dependency), total in zip(flows, totals):
+                n_flows += 1
+                flow = {
+                    "src": int(src),
+                    "dst": int(dst),
+                    "src_port": 10000 + n_flows % 50000,
+                    "dependencies": [first_id + pos for pos in dependency],
+                    "bps": -1,
+                    "total": total,
+                    "links": topology.route(int(src), int(dst)),
+                    "group_id": group_base + chunk + 1,
+                    "collective_id": coll_idx + 1,
+                }
+                f.write(f', "{n_flows}": {json.dumps(flow)}')
+            group_base += n_chunks
+        f.write("}\n")
+    return n_flows
+
+
+def _main():
+    """Generate a synthetic workload."""
+    parser = argparse.ArgumentParser(description="Generate a synthetic workload.")
+    parser.add_argument(
+        "-s", "--save", type=str, required=True, help="Path to save the config"
+    )
+    parser.add_argument(
+        "-t", "--topology", type=str, required=True, choices=topology_factory, help="Topology"
+    )
+    parser.add_argument(
+        "-p", "--pattern", type=str, required=True, choices=pattern_factory, help="Pattern"
+    )
+    parser.add_argument("--k", type=int, default=8, help="k of the fat-tree")
+    parser.add_argument(
+        "--dims", type=int, nargs="+", default=[8, 8], help="Dimensions of the torus"
+    )
+    parser.add_argument("--nodes", type=int, default=50, help="Nodes of the zoo topology")
+    parser.add_argument(
+        "--degree", type=float, default=3.0, help="Average degree of the zoo topology"
+    )
+    parser.add_argument(
+        "--participants", type=int, default=8, help="Participants of each collective"
+    )
+    parser.add_argument(
+        "--chunks",
+        type=int,
+        default=None,
+        help="Groups of each collective, the participants by default",
+    )
+    parser.add_argument(
+        "--collectives", type=int, default=2, help="Number of collectives"
+    )
+    parser.add_argument(
+        "--flows",
+        type=int,
+        default=None,
+        help="Approximate number of flows, which sets the number of collectives",
+    )
+    parser.add_argument("--fanout", type=int, default=2, help="Fanout of the broadcast tree")
+    parser.add_argument("--chain", type=int, default=8, help="Flows of each random group")
+    parser.add_argument(
+        "--size-mb", type=float, default=40.0, help="Median data (MB) of a collective"
+    )
+    parser.add_argument(
+        "--capacity-mbps", type=float, default=200.0, help="Mean capacity (Mbps) of the links"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    topology = create_topology(args.topology, args, rng)
+    n_chunks = args.chunks or args.participants
+    n_collectives = args.collectives
+    if args.flows is not None:
+        collective_size = get_collective_size(args.pattern, args.participants, n_chunks, args.chain)
+        n_collectives = max(1, round(args.flows / collective_size))
+
+    n_flows = generate_workload(
+        args.save,
+        topology,
+        args.pattern,
+        n_collectives,
+        args.participants,
+        n_chunks,
+        rng,
+        size_mb=args.size_mb,
+        capacity_mbps=args.capacity_mbps,
+        fanout=args.fanout,
+        chain=args.chain,
+    )
+    optconfig_path = f"{os.path.splitext(args.save)[0]}_optimization.json"
+    if not os.path.exists(optconfig_path):
+        with open(optconfig_path, "w", encoding="utf-8") as f:
+            json.dump(DEFAULT_OPTIMIZATION, f, indent=4)
+    logging.info(
+        "%s Generated %s flows of %s collectives over %s nodes and %s links at %s",
+        "*" * 15,
+        n_flows,
+        n_collectives,
+        topology.n_nodes,
+        len(topology.links),
+        args.save,
+    )
+
+
+if __name__ == "__main__":
+    _main()